@@ -10,4 +10,6 @@ echo "$DATABASE_HOST:$DATABASE_PORT is available."
 
 flask --app web db migrate 
 flask --app web db upgrade
+# Start every deploy with fresh metrics, as a single process restart would.
+rm -rf "${METRICS_DIR:-instance/metrics}"
 exec gunicorn --access-logfile - --error-logfile - 'web:create_app()'
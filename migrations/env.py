@@ -16,6 +16,12 @@ logger = logging.getLogger('alembic.env')
 
 
 def get_engine():
+    # flask db upgrade -x shard=NAME migrates a SHARD_DATABASE_URIS entry.
+    shard = context.get_x_argument(as_dictionary=True).get('shard')
+    if shard:
+        from web.shards import shard_bind
+
+        return current_app.extensions['migrate'].db.engines[shard_bind(shard)]
     try:
         # this works with Flask-SQLAlchemy<3 and Alchemical
         return current_app.extensions['migrate'].db.get_engine()
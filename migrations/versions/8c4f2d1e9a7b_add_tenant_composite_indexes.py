@@ -0,0 +1,52 @@
+"""Add tenant composite indexes
+
+Revision ID: 8c4f2d1e9a7b
+Revises: 6b01ac841987
+Create Date: 2026-10-18 09:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4f2d1e9a7b'
+down_revision = '6b01ac841987'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = (
+    ('ix_task_tenant_author_created', 'task',
+     ['tenant_id', 'author_id', 'created']),
+    ('ix_task_tenant_author_status_created', 'task',
+     ['tenant_id', 'author_id', 'status', 'created']),
+    ('ix_task_comment_tenant_task', 'task_comment',
+     ['tenant_id', 'task_id']),
+    ('ix_task_comment_task_created', 'task_comment',
+     ['task_id', 'created']),
+)
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction on Postgres,
+    # so build the indexes in an autocommit block to avoid locking out writes.
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(
+                name,
+                table,
+                columns,
+                unique=False,
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in reversed(INDEXES):
+            op.drop_index(
+                name,
+                table_name=table,
+                postgresql_concurrently=True,
+            )
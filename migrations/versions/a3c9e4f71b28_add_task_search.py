@@ -0,0 +1,72 @@
+"""Add task search index
+
+Revision ID: a3c9e4f71b28
+Revises: e5a08b7d3c14
+Create Date: 2026-10-18 21:12:05.318440
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c9e4f71b28'
+down_revision = 'e5a08b7d3c14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE task_search USING fts5("
+            "scope, title, body, comments, tokenize='porter unicode61')"
+        )
+        op.execute(
+            "INSERT INTO task_search (rowid, scope, title, body, comments) "
+            "SELECT task.id, 't' || task.tenant_id || 'u' || coalesce(task.author_id, 0), "
+            "task.title, coalesce(task.body, ''), "
+            "coalesce((SELECT group_concat(content, char(10)) FROM task_comment "
+            "WHERE task_comment.task_id = task.id), '') FROM task"
+        )
+    elif dialect == 'postgresql':
+        op.create_table('task_search',
+        sa.Column('task_id', sa.Integer(), nullable=False),
+        sa.Column('tenant_id', sa.Integer(), nullable=False),
+        sa.Column('author_id', sa.Integer(), nullable=True),
+        sa.Column('comments', sa.Text(), server_default='', nullable=False),
+        sa.Column('document', postgresql.TSVECTOR(), nullable=False),
+        sa.PrimaryKeyConstraint('task_id')
+        )
+        op.execute(
+            "INSERT INTO task_search (task_id, tenant_id, author_id, comments, document) "
+            "SELECT id, tenant_id, author_id, comments, "
+            "setweight(to_tsvector('english', title), 'A') || "
+            "setweight(to_tsvector('english', body), 'B') || "
+            "setweight(to_tsvector('english', comments), 'C') "
+            "FROM (SELECT task.id, task.tenant_id, task.author_id, task.title, "
+            "coalesce(task.body, '') AS body, coalesce((SELECT string_agg(content, E'\\n' "
+            "ORDER BY task_comment.id) FROM task_comment "
+            "WHERE task_comment.task_id = task.id), '') AS comments FROM task) AS documents"
+        )
+        # Built after the initial load, which is much faster than maintaining
+        # the GIN index row by row.
+        op.create_index(
+            'ix_task_search_document',
+            'task_search',
+            ['document'],
+            unique=False,
+            postgresql_using='gin',
+        )
+        op.create_index(
+            'ix_task_search_tenant_author',
+            'task_search',
+            ['tenant_id', 'author_id'],
+            unique=False,
+        )
+
+
+def downgrade():
+    op.execute("DROP TABLE IF EXISTS task_search")
@@ -0,0 +1,42 @@
+"""Add overdue sweep watermark
+
+Revision ID: b7e3a9c15d20
+Revises: 8c4f2d1e9a7b
+Create Date: 2026-10-18 11:03:27.540912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e3a9c15d20'
+down_revision = '8c4f2d1e9a7b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('sweep_watermark',
+    sa.Column('timezone', sa.Text(), nullable=False),
+    sa.Column('watermark', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('timezone')
+    )
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_task_due_date_status',
+            'task',
+            ['due_date', 'status'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_task_due_date_status',
+            table_name='task',
+            postgresql_concurrently=True,
+        )
+    op.drop_table('sweep_watermark')
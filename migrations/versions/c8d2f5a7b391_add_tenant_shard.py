@@ -0,0 +1,28 @@
+"""Add tenant shard placement
+
+Revision ID: c8d2f5a7b391
+Revises: a3c9e4f71b28
+Create Date: 2026-10-18 23:41:09.227315
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8d2f5a7b391'
+down_revision = 'a3c9e4f71b28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('tenant', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('shard', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('moving_to', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('tenant', schema=None) as batch_op:
+        batch_op.drop_column('moving_to')
+        batch_op.drop_column('shard')
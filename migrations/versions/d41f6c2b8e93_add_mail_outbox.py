@@ -0,0 +1,45 @@
+"""Add mail outbox
+
+Revision ID: d41f6c2b8e93
+Revises: b7e3a9c15d20
+Create Date: 2026-10-18 20:02:11.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41f6c2b8e93'
+down_revision = 'b7e3a9c15d20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('mail_outbox',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('tenant_id', sa.Integer(), nullable=False),
+    sa.Column('dedup_key', sa.Text(), nullable=False),
+    sa.Column('recipient', sa.Text(), nullable=False),
+    sa.Column('subject', sa.Text(), nullable=False),
+    sa.Column('body', sa.Text(), nullable=False),
+    sa.Column('html', sa.Text(), nullable=True),
+    sa.Column('status', sa.Text(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt', sa.DateTime(), nullable=False),
+    sa.Column('claim_token', sa.Text(), nullable=True),
+    sa.Column('claimed', sa.DateTime(), nullable=True),
+    sa.Column('created', sa.DateTime(), nullable=False),
+    sa.Column('sent', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.ForeignKeyConstraint(['tenant_id'], ['tenant.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('dedup_key')
+    )
+    op.create_index('ix_mail_outbox_status_next_attempt', 'mail_outbox', ['status', 'next_attempt'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_mail_outbox_status_next_attempt', table_name='mail_outbox')
+    op.drop_table('mail_outbox')
@@ -0,0 +1,95 @@
+"""Prepare hash-partitioned task tables
+
+Revision ID: d5e8a1f0c6b4
+Revises: c8d2f5a7b391
+Create Date: 2026-10-19 09:12:44.106218
+
+PostgreSQL only. Creates task_partitioned and task_comment_partitioned,
+hash-partitioned on tenant_id, and triggers that mirror every change to
+task and task_comment into them. `flask partition-copy` then copies the
+existing rows in batches while the app runs, and the next revision swaps
+the tables. Choose the number of partitions with
+`flask db upgrade -x partitions=N` (default 16).
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+from web.partitioning import TABLES, create_sync_triggers, drop_sync_triggers
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5e8a1f0c6b4'
+down_revision = 'c8d2f5a7b391'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    partitions = int(context.get_x_argument(as_dictionary=True).get('partitions', 16))
+
+    # The primary keys lead with id, so lookups by id alone still use an
+    # index in each partition; the composite foreign key keeps a comment
+    # in its task's tenant.
+    op.execute(
+        "CREATE TABLE task_partitioned (LIKE task INCLUDING DEFAULTS, "
+        "PRIMARY KEY (id, tenant_id), "
+        "FOREIGN KEY (tenant_id) REFERENCES tenant (id), "
+        "FOREIGN KEY (author_id) REFERENCES \"user\" (id)) "
+        "PARTITION BY HASH (tenant_id)"
+    )
+    op.execute(
+        "CREATE TABLE task_comment_partitioned (LIKE task_comment INCLUDING DEFAULTS, "
+        "PRIMARY KEY (id, tenant_id), "
+        "FOREIGN KEY (tenant_id) REFERENCES tenant (id), "
+        "FOREIGN KEY (task_id, tenant_id) REFERENCES task_partitioned (id, tenant_id) "
+        "ON DELETE CASCADE) "
+        "PARTITION BY HASH (tenant_id)"
+    )
+    for table in TABLES:
+        for remainder in range(partitions):
+            op.execute(
+                f"CREATE TABLE {table}_p{remainder} PARTITION OF {table}_partitioned "
+                f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+            )
+
+    # Named for after the swap, which drops the originals.
+    op.execute(
+        "CREATE INDEX ix_task_tenant_author_created_p "
+        "ON task_partitioned (tenant_id, author_id, created)"
+    )
+    op.execute(
+        "CREATE INDEX ix_task_tenant_author_status_created_p "
+        "ON task_partitioned (tenant_id, author_id, status, created)"
+    )
+    op.execute("CREATE INDEX ix_task_due_date_status_p ON task_partitioned (due_date, status)")
+    op.execute(
+        "CREATE INDEX ix_task_comment_tenant_task_p "
+        "ON task_comment_partitioned (tenant_id, task_id)"
+    )
+    op.execute(
+        "CREATE INDEX ix_task_comment_task_created_p "
+        "ON task_comment_partitioned (task_id, created)"
+    )
+
+    # How far partition-copy has got, by id, in each table.
+    op.create_table('partition_copy',
+    sa.Column('table_name', sa.Text(), nullable=False),
+    sa.Column('copied_to', sa.Integer(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('table_name')
+    )
+    op.execute("INSERT INTO partition_copy (table_name) VALUES ('task'), ('task_comment')")
+
+    create_sync_triggers(bind)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    drop_sync_triggers(op.get_bind())
+    op.execute("DROP TABLE IF EXISTS partition_copy")
+    op.execute("DROP TABLE IF EXISTS task_comment_partitioned")
+    op.execute("DROP TABLE IF EXISTS task_partitioned")
@@ -0,0 +1,135 @@
+"""Swap in the hash-partitioned task tables
+
+Revision ID: e1c7b3d9a852
+Revises: d5e8a1f0c6b4
+Create Date: 2026-10-19 09:40:17.553902
+
+PostgreSQL only. Run `flask partition-copy` first: this copies whatever it
+has not, with task and task_comment locked against writes, so it is quick
+only once the copy has caught up.
+
+"""
+from alembic import op
+
+from web.partitioning import TABLES, column_names, create_sync_triggers, drop_sync_triggers
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1c7b3d9a852'
+down_revision = 'd5e8a1f0c6b4'
+branch_labels = None
+depends_on = None
+
+INDEXES = (
+    'ix_task_tenant_author_created',
+    'ix_task_tenant_author_status_created',
+    'ix_task_due_date_status',
+    'ix_task_comment_tenant_task',
+    'ix_task_comment_task_created',
+)
+
+# Constraint names Postgres gave the partitioned tables, and the originals'.
+CONSTRAINTS = {
+    'task': (
+        ('task_partitioned_pkey', 'task_pkey'),
+        ('task_partitioned_tenant_id_fkey', 'task_tenant_id_fkey'),
+        ('task_partitioned_author_id_fkey', 'task_author_id_fkey'),
+    ),
+    'task_comment': (
+        ('task_comment_partitioned_pkey', 'task_comment_pkey'),
+        ('task_comment_partitioned_tenant_id_fkey', 'task_comment_tenant_id_fkey'),
+        ('task_comment_partitioned_task_id_tenant_id_fkey', 'task_comment_task_id_fkey'),
+    ),
+}
+
+
+def count(table):
+    return op.get_bind().exec_driver_sql(f"SELECT count(*) FROM {table}").scalar()
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    # Reads carry on; writes wait for the swap.
+    op.execute("LOCK TABLE task, task_comment IN EXCLUSIVE MODE")
+    for table in TABLES:
+        names = ', '.join(column_names(bind, table))
+        op.execute(
+            f"INSERT INTO {table}_partitioned ({names}) SELECT {names} FROM {table} "
+            f"WHERE id > (SELECT copied_to FROM partition_copy WHERE table_name = '{table}') "
+            "ON CONFLICT DO NOTHING"
+        )
+        copied, original = count(f"{table}_partitioned"), count(table)
+        if copied != original:
+            raise RuntimeError(
+                f"{table}_partitioned has {copied} rows and {table} {original}; "
+                "downgrade to c8d2f5a7b391 and start again."
+            )
+
+    drop_sync_triggers(bind)
+    for table in TABLES:
+        op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}_partitioned.id")
+    op.execute("DROP TABLE partition_copy")
+    op.execute("DROP TABLE task_comment")
+    op.execute("DROP TABLE task")
+    for table in TABLES:
+        op.execute(f"ALTER TABLE {table}_partitioned RENAME TO {table}")
+        for partitioned, original in CONSTRAINTS[table]:
+            op.execute(f"ALTER TABLE {table} RENAME CONSTRAINT {partitioned} TO {original}")
+    for index in INDEXES:
+        op.execute(f"ALTER INDEX {index}_p RENAME TO {index}")
+    op.execute("ANALYZE task, task_comment")
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    # Back to unpartitioned tables, leaving the partitioned ones as the
+    # previous revision made them, fully copied.
+    op.execute("LOCK TABLE task, task_comment IN EXCLUSIVE MODE")
+    for index in INDEXES:
+        op.execute(f"ALTER INDEX {index} RENAME TO {index}_p")
+    for table in TABLES:
+        op.execute(f"ALTER TABLE {table} RENAME TO {table}_partitioned")
+        for partitioned, original in CONSTRAINTS[table]:
+            op.execute(
+                f"ALTER TABLE {table}_partitioned RENAME CONSTRAINT {original} TO {partitioned}"
+            )
+
+    for table in TABLES:
+        names = ', '.join(column_names(bind, f"{table}_partitioned"))
+        op.execute(f"CREATE TABLE {table} (LIKE {table}_partitioned INCLUDING DEFAULTS)")
+        op.execute(f"INSERT INTO {table} ({names}) SELECT {names} FROM {table}_partitioned")
+        op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+        op.create_primary_key(f'{table}_pkey', table, ['id'])
+    op.create_foreign_key('task_tenant_id_fkey', 'task', 'tenant', ['tenant_id'], ['id'])
+    op.create_foreign_key('task_author_id_fkey', 'task', 'user', ['author_id'], ['id'])
+    op.create_foreign_key(
+        'task_comment_tenant_id_fkey', 'task_comment', 'tenant', ['tenant_id'], ['id']
+    )
+    op.create_foreign_key(
+        'task_comment_task_id_fkey', 'task_comment', 'task', ['task_id'], ['id'],
+        ondelete='CASCADE',
+    )
+    op.create_index('ix_task_tenant_author_created', 'task',
+                    ['tenant_id', 'author_id', 'created'], unique=False)
+    op.create_index('ix_task_tenant_author_status_created', 'task',
+                    ['tenant_id', 'author_id', 'status', 'created'], unique=False)
+    op.create_index('ix_task_due_date_status', 'task', ['due_date', 'status'], unique=False)
+    op.create_index('ix_task_comment_tenant_task', 'task_comment',
+                    ['tenant_id', 'task_id'], unique=False)
+    op.create_index('ix_task_comment_task_created', 'task_comment',
+                    ['task_id', 'created'], unique=False)
+
+    op.execute(
+        "CREATE TABLE partition_copy (table_name text PRIMARY KEY, "
+        "copied_to integer NOT NULL DEFAULT 0)"
+    )
+    op.execute(
+        "INSERT INTO partition_copy (table_name, copied_to) "
+        "SELECT 'task', coalesce(max(id), 0) FROM task UNION ALL "
+        "SELECT 'task_comment', coalesce(max(id), 0) FROM task_comment"
+    )
+    create_sync_triggers(bind)
@@ -0,0 +1,28 @@
+"""Add reminder change feed
+
+Revision ID: e5a08b7d3c14
+Revises: d41f6c2b8e93
+Create Date: 2026-10-18 20:31:47.905163
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a08b7d3c14'
+down_revision = 'd41f6c2b8e93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('reminder_change',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('task_id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('reminder_change')
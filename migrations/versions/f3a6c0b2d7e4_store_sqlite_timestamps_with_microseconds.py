@@ -0,0 +1,41 @@
+"""Store SQLite task timestamps with microseconds
+
+Revision ID: f3a6c0b2d7e4
+Revises: e1c7b3d9a852
+Create Date: 2026-10-19 14:21:08.317560
+
+SQLite only. Rows from the old CURRENT_TIMESTAMP default are stored as
+"YYYY-MM-DD HH:MM:SS", the ORM writes "YYYY-MM-DD HH:MM:SS.ffffff", and the
+two compare as text, so task pages ordered on created interleaved them
+wrongly within a second. Give the older rows the ORM's form.
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a6c0b2d7e4'
+down_revision = 'e1c7b3d9a852'
+branch_labels = None
+depends_on = None
+
+COLUMNS = (
+    ('task', 'created'),
+    ('task', 'due_date'),
+    ('task_comment', 'created'),
+)
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for table, column in COLUMNS:
+        op.execute(
+            f"UPDATE {table} SET {column} = {column} || '.000000' "
+            f"WHERE length({column}) = 19"
+        )
+
+
+def downgrade():
+    # Both forms read back as the same datetime.
+    pass
@@ -1,42 +1,88 @@
 import os
 import tempfile
+from datetime import datetime, timedelta
 
 import pytest
-from web import create_app
-from web.db import get_db, init_db
+from sqlalchemy import event
+from web import create_app, db
 
 with open(os.path.join(os.path.dirname(__file__), 'data.sql'), 'rb') as f:
     _data_sql = f.read().decode('utf8')
 
 
+def pytest_collection_modifyitems(config, items):
+    # Timing tests are slow and depend on the machine, so they only run on request.
+    if os.getenv('RUN_BENCHMARKS'):
+        return
+    skip = pytest.mark.skip(reason='RUN_BENCHMARKS is not set')
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip)
+
+
 @pytest.fixture
 def app():
     db_fd, db_path = tempfile.mkstemp()
 
-    # Delete the existing SQLite database file if it exists
-    if os.path.exists(db_path):
-        os.remove(db_path)
-
     app = create_app({
         'TESTING': True,
-        'DATABASE': db_path,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + db_path,
         'ADMINS': ['your-email@example.com'],
-        'SECRET_KEY': 'mytestsecretkey'
+        'SECRET_KEY': 'mytestsecretkey',
+        'METRICS_DIR': tempfile.mkdtemp(),
+        'METRICS_TOKEN': 'mytestmetricstoken',
+        'CELERY': {
+            'broker_url': 'memory://',
+            'task_always_eager': True,
+            'task_ignore_result': True,
+        },
     })
 
     with app.app_context():
-        init_db()
-        get_db().executescript(_data_sql)
+        db.create_all()
+        connection = db.engine.raw_connection()
+        connection.executescript(_data_sql)
+        connection.close()
 
     yield app
 
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
     os.close(db_fd)
     os.unlink(db_path)
 
 
+@pytest.fixture
+def cached_app(app):
+    from web.cache import cache
+
+    app.config['RESPONSE_CACHE'] = 'memory'
+    cache.init_app(app)
+    yield app
+    app.config['RESPONSE_CACHE'] = 'none'
+    cache.init_app(app)
+
+
+@pytest.fixture
+def shared_cache_app(app, tmp_path):
+    from web.cache import cache
+
+    app.config['RESPONSE_CACHE'] = 'sqlite'
+    app.config['RESPONSE_CACHE_PATH'] = str(tmp_path / 'cache.sqlite')
+    cache.init_app(app)
+    yield app
+    app.config['RESPONSE_CACHE'] = 'none'
+    cache.init_app(app)
+
+
 @pytest.fixture
 def client(app):
-    return app.test_client()
+    client = app.test_client()
+    # Talisman redirects plain http requests to https.
+    client.environ_base['HTTP_X_FORWARDED_PROTO'] = 'https'
+    return client
 
 
 @pytest.fixture
@@ -60,4 +106,96 @@ class AuthActions(object):
 
 @pytest.fixture
 def auth(client):
-    return AuthActions(client)
\ No newline at end of file
+    return AuthActions(client)
+
+
+# SQL statement recording
+class StatementRecorder(object):
+    def __init__(self, app):
+        self._app = app
+        self.statements = []
+        self.begins = []
+
+    def _record(self, conn, cursor, statement, parameters, context, many):
+        # The SQLite profile issues BEGIN itself; it is not a query.
+        if statement.startswith('BEGIN'):
+            self.begins.append(statement)
+        else:
+            self.statements.append(statement)
+
+    def __enter__(self):
+        self.statements = []
+        self.begins = []
+        with self._app.app_context():
+            self._engine = db.engine
+        event.listen(self._engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self._engine, 'before_cursor_execute', self._record)
+
+    def touching(self, table):
+        return [s for s in self.statements if f'FROM {table}' in s]
+
+
+@pytest.fixture
+def statements(app):
+    return StatementRecorder(app)
+
+
+# Bulk task seeding
+SEED_START = datetime(2023, 7, 1)
+
+
+def _seed_value(option, n):
+    return option(n) if callable(option) else option
+
+
+def _timestamp(value):
+    # The form the ORM stores, so seeded rows compare like the app's.
+    return value.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+@pytest.fixture
+def seed_tasks(app):
+    """Return seed(count, ...), which inserts count tasks by user 1 of tenant
+    1 after the existing ones and returns their ids.
+
+    status, body and created may be values or functions of the task's
+    position n; by default task n is created n minutes after SEED_START.
+    Each task gets comments_per_task comments an hour after it.
+    """
+    def seed(count, status='ACTIVE', body=None, comments_per_task=0,
+             created=lambda n: SEED_START + timedelta(minutes=n)):
+        with app.app_context():
+            connection = db.engine.raw_connection()
+            try:
+                first = connection.execute(
+                    'SELECT coalesce(max(id), 0) + 1 FROM task'
+                ).fetchone()[0]
+                ids = range(first, first + count)
+                connection.executemany(
+                    'INSERT INTO task (id, tenant_id, author_id, created, title, status, body) '
+                    'VALUES (?, 1, 1, ?, ?, ?, ?)',
+                    (
+                        (id, _timestamp(created(n)), f'task {id}',
+                         _seed_value(status, n), _seed_value(body, n))
+                        for n, id in enumerate(ids)
+                    ),
+                )
+                connection.executemany(
+                    'INSERT INTO task_comment (tenant_id, task_id, created, content) '
+                    'VALUES (1, ?, ?, ?)',
+                    (
+                        (id, _timestamp(created(n) + timedelta(hours=1)),
+                         f'comment {c} on task {id}')
+                        for n, id in enumerate(ids)
+                        for c in range(comments_per_task)
+                    ),
+                )
+                connection.commit()
+            finally:
+                connection.close()
+        return list(ids)
+
+    return seed
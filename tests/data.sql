@@ -1,3 +1,22 @@
-INSERT INTO user (username, password)
+INSERT INTO tenant (id, name, timezone)
 VALUES
-  ('Divya', 'Teja');
\ No newline at end of file
+  (1, 'test_trial', 'UTC'),
+  (2, 'Divya_trial', 'Europe/London');
+
+INSERT INTO user (id, tenant_id, username, password)
+VALUES
+  (1, 1, 'test', 'pbkdf2:sha256:260000$R3eXEOSdZiVDtbKF$88ae18201b8b84b4f304f6398a0784aef48cd7e3a91749732971ead3a3ef10cd'),
+  (2, 2, 'Divya', 'pbkdf2:sha256:260000$aAbFXSoZ1Ex7ATMv$7b2155c7738a9baea52ffcccba4f76c8b2e042b034b5f7bc70ba57ba6b0391cd');
+
+INSERT INTO task (id, tenant_id, author_id, created, due_date, title, status, body)
+VALUES
+  (1, 1, 1, '2023-06-01 10:00:00', NULL, 'first task', 'ACTIVE', 'first body'),
+  (2, 1, 1, '2023-06-02 10:00:00', '2023-06-03 00:00:00', 'overdue task', 'OVERDUE', NULL),
+  (3, 1, 1, '2023-06-03 10:00:00', NULL, 'done task', 'DONE', 'done body'),
+  (4, 2, 2, '2023-06-04 10:00:00', NULL, 'other tenant task', 'ACTIVE', NULL);
+
+INSERT INTO task_comment (id, tenant_id, task_id, created, content)
+VALUES
+  (1, 1, 1, '2023-06-01 11:00:00', 'first comment'),
+  (2, 1, 3, '2023-06-03 11:00:00', 'done comment'),
+  (3, 2, 4, '2023-06-04 11:00:00', 'other tenant comment');
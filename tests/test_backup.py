@@ -0,0 +1,186 @@
+import gzip
+import json
+import time
+from datetime import datetime
+
+import pytest
+from flask import g
+
+from web import backup, db
+from web.models import ReminderChange, Task, TaskComment, Tenant, User
+from web.search import rebuild_index, search_tasks
+
+
+def dump(runner, tmp_path, tenant='test_trial'):
+    path = str(tmp_path / 'tenant.jsonl.gz')
+    result = runner.invoke(args=['tenant-dump', tenant, path])
+    assert result.exit_code == 0, result.output
+    return path
+
+
+def rename_users(app):
+    # Usernames are unique across tenants, so free them for the restore.
+    with app.app_context():
+        for user in User.query:
+            user.username = 'old-' + user.username
+        db.session.commit()
+
+
+def test_dump_format(runner, tmp_path):
+    path = dump(runner, tmp_path, tenant='1')
+
+    with gzip.open(path, 'rt') as f:
+        lines = [json.loads(line) for line in f]
+
+    assert lines[0]['tenant'] == {'id': 1, 'name': 'test_trial', 'timezone': 'UTC'}
+    assert lines[0]['rows'] == 6
+    assert lines[1]['table'] == 'user'
+    assert lines[2][:2] == [1, 'test']
+    assert lines[3] == {
+        'table': 'task',
+        'columns': ['id', 'author_id', 'created', 'due_date', 'title', 'status', 'body'],
+        'count': 3,
+        'min_id': 1,
+        'max_id': 3,
+    }
+    assert lines[5] == [
+        2, 1, '2023-06-02 10:00:00.000000', '2023-06-03 00:00:00.000000',
+        'overdue task', 'OVERDUE', None,
+    ]
+    assert lines[-1] == {'end': True}
+    assert b'other tenant' not in gzip.open(path).read()
+
+
+def test_restore_remaps_ids(app, runner, tmp_path):
+    path = dump(runner, tmp_path)
+    rename_users(app)
+
+    result = runner.invoke(args=['tenant-restore', path, '--name', 'copy'])
+
+    assert result.exit_code == 0, result.output
+    assert 'Restored 6 rows as tenant copy (3)' in result.output
+    with app.app_context():
+        user = User.query.filter_by(username='test').one()
+        assert (user.id, user.tenant_id) == (3, 3)
+        tasks = Task.query.filter_by(tenant_id=3).order_by(Task.id).all()
+        assert [(task.id, task.title, task.author_id) for task in tasks] == [
+            (5, 'first task', 3), (6, 'overdue task', 3), (7, 'done task', 3)
+        ]
+        assert tasks[1].created.hour == 10
+        comments = TaskComment.query.filter_by(tenant_id=3).order_by(TaskComment.id)
+        assert [(c.id, c.task_id, c.content) for c in comments] == [
+            (4, 5, 'first comment'), (5, 7, 'done comment')
+        ]
+        assert Task.query.filter_by(tenant_id=1).count() == 3
+
+
+def test_restore_indexes_tasks_and_logs_in(app, client, auth, runner, tmp_path):
+    app.config['REMINDERS_ENABLED'] = True
+    with app.app_context():
+        rebuild_index()
+        db.session.add(Task(tenant_id=1, author_id=1, title='due soon',
+                            due_date=datetime(2099, 1, 1), created=datetime(2023, 7, 1)))
+        db.session.commit()
+    path = dump(runner, tmp_path)
+    rename_users(app)
+    runner.invoke(args=['tenant-restore', path, '--name', 'copy'])
+
+    with app.test_request_context():
+        g.tenant_id = 3
+        assert sorted(task.id for task in search_tasks(3, 'comment')) == [6, 8]
+    with app.app_context():
+        # Only the ACTIVE task with a due date gets a reminder.
+        assert [change.task_id for change in ReminderChange.query] == [10]
+
+    auth.login()
+    assert b'due soon' in client.get('/').data
+
+
+def test_restore_refuses_collisions(app, runner, tmp_path):
+    path = dump(runner, tmp_path)
+
+    result = runner.invoke(args=['tenant-restore', path])
+    assert 'Tenant test_trial already exists' in result.output
+
+    result = runner.invoke(args=['tenant-restore', path, '--name', 'copy'])
+    assert result.exit_code != 0
+    assert 'User test already exists' in result.output
+    with app.app_context():
+        assert Tenant.query.count() == 2
+
+
+def test_restore_rejects_truncated_dump(app, runner, tmp_path):
+    path = dump(runner, tmp_path)
+    rename_users(app)
+    with gzip.open(path, 'rt') as f:
+        lines = f.readlines()
+    with gzip.open(path, 'wt') as f:
+        f.writelines(lines[:-2])
+
+    result = runner.invoke(args=['tenant-restore', path, '--name', 'copy'])
+
+    assert 'The dump is truncated' in result.output
+    with app.app_context():
+        assert Tenant.query.count() == 2
+        assert Task.query.count() == 4
+
+
+def test_restore_rejects_other_files(runner, tmp_path):
+    path = tmp_path / 'notes.txt'
+    path.write_text('not a dump')
+
+    result = runner.invoke(args=['tenant-restore', str(path)])
+
+    assert result.exit_code != 0
+    assert 'Cannot read' in result.output
+
+
+def test_dump_unknown_tenant(runner, tmp_path):
+    result = runner.invoke(args=['tenant-dump', 'nobody', str(tmp_path / 'x.gz')])
+
+    assert 'No tenant nobody' in result.output
+
+
+def test_restore_in_batches(app, runner, tmp_path, monkeypatch, seed_tasks):
+    monkeypatch.setattr(backup, 'BATCH_SIZE', 100)
+    ids = seed_tasks(250, body='a description', comments_per_task=3)
+    # The fixture's 6 rows, and each task with its three comments.
+    rows = 6 + 4 * len(ids)
+    path = dump(runner, tmp_path)
+    rename_users(app)
+
+    result = runner.invoke(args=['tenant-restore', path, '--name', 'copy'])
+
+    assert f'Restored {rows} rows as tenant copy (3)' in result.output
+    with app.app_context():
+        assert Task.query.filter_by(tenant_id=3).count() == 253
+        assert TaskComment.query.filter_by(tenant_id=3).count() == 752
+        assert TaskComment.query.filter_by(tenant_id=3).order_by(
+            TaskComment.id.desc()
+        ).first().content == f'comment 2 on task {ids[-1]}'
+
+
+@pytest.mark.benchmark
+def test_backup_benchmark(app, runner, tmp_path, seed_tasks):
+    # 250,000 tasks with three comments each make 1M rows.
+    tasks = 250_000
+    seed_tasks(tasks, body='a description ' * 4, comments_per_task=3)
+    rows = 6 + 4 * tasks
+
+    start = time.perf_counter()
+    path = dump(runner, tmp_path)
+    dump_elapsed = time.perf_counter() - start
+    rename_users(app)
+
+    start = time.perf_counter()
+    result = runner.invoke(args=['tenant-restore', path, '--name', 'copy'])
+    restore_elapsed = time.perf_counter() - start
+
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        assert TaskComment.query.filter_by(tenant_id=3).count() == tasks * 3 + 2
+    print(f"\n{rows} rows: dump {dump_elapsed:.1f} s "
+          f"({rows / dump_elapsed * 60 / 1e6:.1f}M rows/min), restore "
+          f"{restore_elapsed:.1f} s ({rows / restore_elapsed * 60 / 1e6:.1f}M rows/min)")
+    assert rows / dump_elapsed * 60 > 1_000_000
+    assert rows / restore_elapsed * 60 > 1_000_000
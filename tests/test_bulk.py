@@ -0,0 +1,132 @@
+import time
+from datetime import datetime
+
+import pytest
+
+from web.models import ReminderChange, Task, TaskComment
+from web.search import rebuild_index
+
+
+def test_bulk_create(app, client, auth):
+    auth.login()
+    response = client.post('/tasks/bulk/create', json={'tasks': [
+        {'title': 'one'},
+        {'title': 'two', 'due_date': '2099-01-01', 'body': 'second'},
+        {'title': 'late', 'due_date': '2000-01-01'},
+    ]})
+
+    assert response.status_code == 200
+    assert response.json == {'created': 3, 'ids': [5, 6, 7]}
+    with app.app_context():
+        tasks = {task.id: task for task in Task.query.filter(Task.id >= 5)}
+        assert tasks[6].body == 'second'
+        assert tasks[6].due_date == datetime(2099, 1, 1)
+        assert [task.status for task in tasks.values()] == ['ACTIVE', 'ACTIVE', 'OVERDUE']
+        assert {task.tenant_id for task in tasks.values()} == {1}
+
+
+def test_bulk_create_is_all_or_nothing(app, client, auth):
+    auth.login()
+    response = client.post('/tasks/bulk/create', json={'tasks': [
+        {'title': 'fine'},
+        {'title': ''},
+        {'title': 'bad date', 'due_date': '01/02/2023'},
+    ]})
+
+    assert response.status_code == 400
+    assert [error['index'] for error in response.json['errors']] == [1, 2]
+    with app.app_context():
+        assert Task.query.count() == 4
+
+
+def test_bulk_done_checks_ownership(app, client, auth):
+    auth.login()
+    response = client.post('/tasks/bulk/done', json={'ids': [1, 2, 3, 4, 99, 1]})
+
+    # Task 3 is already done, task 4 belongs to another tenant.
+    assert response.json == {'done': 2, 'ids': [1, 2], 'not_found': [4, 99]}
+    with app.app_context():
+        assert [task.status for task in Task.query.order_by(Task.id)] == [
+            'DONE', 'DONE', 'DONE', 'ACTIVE'
+        ]
+
+
+def test_bulk_delete_removes_comments(app, client, auth):
+    auth.login()
+    response = client.post('/tasks/bulk/delete', json={'ids': [1, 3, 4]})
+
+    assert response.json == {'deleted': 2, 'ids': [1, 3], 'not_found': [4]}
+    with app.app_context():
+        assert [task.id for task in Task.query.order_by(Task.id)] == [2, 4]
+        assert [comment.task_id for comment in TaskComment.query] == [4]
+
+
+@pytest.mark.parametrize('payload', (
+    {},
+    {'ids': []},
+    {'ids': ['1']},
+    {'ids': [True]},
+    {'ids': list(range(501))},
+))
+def test_bulk_rejects_bad_ids(client, auth, payload):
+    auth.login()
+    response = client.post('/tasks/bulk/delete', json=payload)
+
+    assert response.status_code == 400
+    assert response.json['errors']
+
+
+def test_bulk_updates_search_and_reminders(app, client, auth):
+    app.config['REMINDERS_ENABLED'] = True
+    with app.app_context():
+        rebuild_index()
+    auth.login()
+
+    client.post('/tasks/bulk/create', json={'tasks': [{'title': 'bulk sweep'}]})
+    assert client.get('/search?q=sweep').data.count(b'<mark>sweep</mark>') == 1
+
+    client.post('/tasks/bulk/done', json={'ids': [5]})
+    client.post('/tasks/bulk/delete', json={'ids': [5]})
+    assert b'<mark>sweep</mark>' not in client.get('/search?q=sweep').data
+
+    with app.app_context():
+        assert [change.task_id for change in ReminderChange.query] == [5, 5, 5]
+
+
+def test_bulk_statements_do_not_grow_with_batch(client, auth, statements, seed_tasks):
+    ids = seed_tasks(100)
+    auth.login()
+    client.get('/')
+
+    counts = []
+    for batch in (ids[:10], ids[10:]):
+        with statements:
+            client.post('/tasks/bulk/done', json={'ids': batch})
+        counts.append(len(statements.statements))
+
+    assert counts[0] == counts[1]
+
+
+@pytest.mark.benchmark
+def test_bulk_benchmark(app, client, auth, seed_tasks):
+    count = 200
+    single_ids = seed_tasks(count)
+    bulk_ids = seed_tasks(count)
+    auth.login()
+
+    # A browser follows each redirect and renders the dashboard again.
+    start = time.perf_counter()
+    for id in single_ids:
+        client.post(f'/{id}/done', follow_redirects=True)
+    single_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    response = client.post('/tasks/bulk/done', json={'ids': bulk_ids})
+    bulk_elapsed = time.perf_counter() - start
+
+    print(f"\nmove {count} tasks to done: one at a time {single_elapsed * 1000:.0f} ms, "
+          f"bulk {bulk_elapsed * 1000:.1f} ms")
+    assert response.json['done'] == count
+    with app.app_context():
+        assert Task.query.filter_by(status='DONE').count() == 2 * count + 1
+    assert bulk_elapsed * 20 < single_elapsed
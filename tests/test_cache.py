@@ -0,0 +1,146 @@
+import time
+from datetime import datetime
+
+import pytest
+
+from web import create_app, db
+from web.cache import MemoryBackend, SQLiteBackend, cache
+from web.models import Task
+from web.sweeper import sweep_overdue_tasks
+
+
+def test_memory_backend_lru_and_ttl(monkeypatch):
+    backend = MemoryBackend(max_entries=2, ttl=10)
+    backend.set('a', '1')
+    backend.set('b', '2')
+    backend.get('a')
+    backend.set('c', '3')
+
+    assert backend.get('b') is None
+    assert backend.get('a') == '1'
+
+    now = time.monotonic()
+    monkeypatch.setattr('web.cache.time.monotonic', lambda: now + 11)
+    assert backend.get('a') is None
+
+
+def test_sqlite_backend_shared_between_workers(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    worker_a = SQLiteBackend(path)
+    worker_b = SQLiteBackend(path)
+
+    worker_a.set('view:1:1:index:desktop:0', '<html>')
+    assert worker_b.get('view:1:1:index:desktop:0') == '<html>'
+
+    worker_a.bump_version(1)
+    worker_a.bump_version(1)
+    assert worker_b.get_version(1) == 2
+    assert worker_b.get_version(2) == 0
+
+
+def test_sqlite_backend_prunes_to_max_entries(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'cache.sqlite'), max_entries=10)
+    for n in range(100):
+        backend.set(f'key {n}', 'x')
+
+    assert backend.get('key 99') == 'x'
+    assert backend.get('key 0') is None
+
+
+def test_unknown_backend(tmp_path):
+    with pytest.raises(ValueError):
+        create_app({'TESTING': True, 'SECRET_KEY': 'x', 'RESPONSE_CACHE': 'redis'})
+
+
+def test_index_served_from_cache(cached_app, client, auth, statements):
+    auth.login()
+
+    first = client.get('/')
+    with statements:
+        second = client.get('/')
+
+    assert first.data == second.data
+    assert cache.stats() == {'hits': 1, 'misses': 1}
+    # Only g.user is loaded, the dashboard queries are skipped.
+    assert statements.touching('task') == []
+
+
+@pytest.mark.parametrize(('path', 'data'), (
+    ('/create', {'title': 'new task', 'due_date': '', 'body': ''}),
+    ('/1/update', {'title': 'renamed', 'due_date': '', 'body': ''}),
+    ('/1/done', {}),
+    ('/1/delete', {}),
+    ('/1/comment', {'comment': 'new comment'}),
+    ('/1/deletecomment/1', {}),
+))
+def test_writes_invalidate_cached_pages(cached_app, client, auth, path, data):
+    auth.login()
+    client.get('/')
+    client.get('/done')
+
+    client.post(path, data=data)
+
+    with cached_app.app_context():
+        assert cache.get_version(1) == 1
+        assert cache.get_version(2) == 0
+
+    client.get('/')
+    client.get('/done')
+    assert cache.stats()['hits'] == 0
+
+
+def test_mobile_and_desktop_cached_separately(cached_app, client, auth):
+    auth.login()
+    desktop = client.get('/')
+
+    auth.logout()
+    client.environ_base['HTTP_USER_AGENT'] = 'Mobile Safari'
+    auth.login()
+    mobile = client.get('/')
+
+    assert desktop.data != mobile.data
+    assert cache.stats()['hits'] == 0
+
+
+def test_pending_flash_bypasses_cache(cached_app, client, auth):
+    auth.login()
+    client.get('/')
+
+    with client.session_transaction() as session:
+        session['_flashes'] = [('message', 'Task saved')]
+    response = client.get('/')
+
+    assert b'Task saved' in response.data
+    assert cache.stats() == {'hits': 0, 'misses': 1}
+
+
+def test_sweep_invalidates_cached_pages(cached_app):
+    with cached_app.app_context():
+        db.session.get(Task, 1).due_date = datetime(2023, 6, 1)
+        db.session.commit()
+
+        assert sweep_overdue_tasks(now=datetime(2023, 6, 5)) == 1
+        assert cache.get_version(1) == 1
+
+
+def test_page_read_during_sweep_is_not_kept(cached_app, client, auth, monkeypatch):
+    auth.login()
+    with cached_app.app_context():
+        db.session.get(Task, 1).due_date = datetime(2023, 6, 1)
+        db.session.commit()
+    assert b'You have 1 tasks overdue!' in client.get('/').data
+
+    # A request served after the sweep's UPDATE but before its commit.
+    during = []
+    commit = db.session.commit
+
+    def commit_after_a_read():
+        during.append(client.get('/').data)
+        commit()
+
+    with cached_app.app_context():
+        monkeypatch.setattr(db.session, 'commit', commit_after_a_read)
+        assert sweep_overdue_tasks(now=datetime(2023, 6, 5)) == 1
+
+    assert b'You have 1 tasks overdue!' in during[0]
+    assert b'You have 2 tasks overdue!' in client.get('/').data
@@ -0,0 +1,151 @@
+import re
+
+import pytest
+
+from web import create_app
+from web.cache import cache
+
+
+def revisit(client, path, response):
+    return client.get(path, headers={'If-None-Match': response.headers['ETag']})
+
+
+def worker(app, cache_path):
+    """Another app on app's database and cache file, like a second gunicorn
+    worker, with the cache backend it opened."""
+    other = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': app.config['SQLALCHEMY_DATABASE_URI'],
+        'SECRET_KEY': 'mytestsecretkey',
+        'METRICS_DIR': app.config['METRICS_DIR'],
+        'CELERY': {'broker_url': 'memory://', 'task_always_eager': True},
+        'RESPONSE_CACHE': 'sqlite',
+        'RESPONSE_CACHE_PATH': cache_path,
+    })
+    client = other.test_client()
+    client.environ_base['HTTP_X_FORWARDED_PROTO'] = 'https'
+    client.post('/auth/login', data={'username': 'test', 'password': 'test'})
+    return client, cache.backend
+
+
+@pytest.mark.parametrize('path', ('/', '/done', '/settings', '/mobile/1?status=Active'))
+def test_repeat_visit_not_modified(shared_cache_app, client, auth, statements, path):
+    auth.login()
+    first = client.get(path)
+    assert first.status_code == 200
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+
+    with statements:
+        second = revisit(client, path, first)
+
+    assert second.status_code == 304
+    assert second.data == b''
+    assert second.headers['ETag'] == first.headers['ETag']
+    # Only g.user is loaded before the 304 is sent.
+    assert statements.touching('task') == []
+    assert statements.touching('task_comment') == []
+    assert statements.touching('tenant') == []
+
+
+def test_repeat_visit_bytes_saved(shared_cache_app, client, auth):
+    auth.login()
+    pages = ('/', '/done', '/settings')
+
+    first_visit = sum(len(client.get(path).data) for path in pages)
+    repeat_visit = 0
+    for path in pages:
+        response = client.get(path)
+        repeat_visit += len(revisit(client, path, response).data)
+
+    assert first_visit > 0
+    assert repeat_visit == 0
+
+
+@pytest.mark.parametrize(('path', 'data'), (
+    ('/create', {'title': 'new task', 'due_date': '', 'body': ''}),
+    ('/1/comment', {'comment': 'new comment'}),
+    ('/1/done', {}),
+))
+def test_write_changes_etag(shared_cache_app, client, auth, path, data):
+    auth.login()
+    first = client.get('/')
+
+    client.post(path, data=data)
+
+    second = revisit(client, '/', first)
+    assert second.status_code == 200
+    assert second.headers['ETag'] != first.headers['ETag']
+
+
+def test_etag_varies_by_device(shared_cache_app, client, auth):
+    auth.login()
+    desktop = client.get('/')
+
+    auth.logout()
+    client.environ_base['HTTP_USER_AGENT'] = 'Mobile Safari'
+    auth.login()
+    mobile = revisit(client, '/', desktop)
+
+    assert mobile.status_code == 200
+    assert mobile.headers['ETag'] != desktop.headers['ETag']
+    assert 'User-Agent' in mobile.headers['Vary']
+
+
+def test_no_etag_without_cache(client, auth):
+    auth.login()
+    response = client.get('/')
+
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers
+
+
+def test_write_in_another_worker_changes_etag(app, tmp_path, monkeypatch):
+    cache_path = str(tmp_path / 'cache.sqlite')
+    reader, reader_cache = worker(app, cache_path)
+    writer, writer_cache = worker(app, cache_path)
+
+    # The cache extension is one per process; each worker gets its own back.
+    monkeypatch.setattr(cache, 'backend', reader_cache)
+    first = reader.get('/')
+    monkeypatch.setattr(cache, 'backend', writer_cache)
+    writer.post('/create', data={'title': 'new task', 'due_date': '', 'body': ''})
+    monkeypatch.setattr(cache, 'backend', reader_cache)
+    second = revisit(reader, '/', first)
+
+    assert second.status_code == 200
+    assert second.headers['ETag'] != first.headers['ETag']
+    assert b'new task' in second.data
+
+
+def test_no_etag_with_memory_cache(cached_app, client, auth):
+    # Each worker would count versions of its own.
+    auth.login()
+    response = client.get('/')
+
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers
+
+
+def test_no_etag_when_logged_out(shared_cache_app, client):
+    assert 'ETag' not in client.get('/').headers
+
+
+def test_static_urls_fingerprinted(cached_app, client, auth):
+    auth.login()
+    page = client.get('/').get_data(as_text=True)
+
+    url = re.search(r'src="([^"]*pagination\.js\?v=[0-9a-f]+)"', page).group(1)
+    first = client.get(url)
+    assert first.status_code == 200
+    assert first.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+
+    second = revisit(client, url, first)
+    assert second.status_code == 304
+    assert second.data == b''
+
+
+def test_stale_static_fingerprint_not_cached(client):
+    response = client.get('/static/pagination.js?v=stale')
+
+    assert response.status_code == 200
+    assert 'immutable' not in response.headers.get('Cache-Control', '')
@@ -0,0 +1,133 @@
+import csv
+import io
+import json
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from web import export
+
+
+def test_ndjson_nests_comments(client, auth):
+    auth.login()
+    response = client.get('/export/tasks.ndjson')
+
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == 'application/x-ndjson'
+    assert 'attachment' in response.headers['Content-Disposition']
+
+    tasks = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [task['id'] for task in tasks] == [1, 2, 3]
+    assert tasks[0]['comments'][0]['content'] == 'first comment'
+    assert tasks[1] == {
+        'id': 2,
+        'created': '2023-06-02T10:00:00',
+        'due_date': '2023-06-03',
+        'title': 'overdue task',
+        'status': 'OVERDUE',
+        'body': None,
+        'comments': [],
+    }
+
+
+def test_csv_has_a_row_per_comment(client, auth):
+    auth.login()
+    response = client.get('/export/tasks.csv')
+
+    assert response.mimetype == 'text/csv'
+    rows = list(csv.DictReader(io.StringIO(response.data.decode())))
+    assert [(row['task_id'], row['comment']) for row in rows] == [
+        ('1', 'first comment'),
+        ('2', ''),
+        ('3', 'done comment'),
+    ]
+
+
+def test_export_is_scoped_to_tenant(client, auth):
+    auth.login()
+    response = client.get('/export/tasks.ndjson')
+
+    assert b'other tenant' not in response.data
+
+
+def test_export_rejects_unknown_format(client, auth):
+    auth.login()
+    assert client.get('/export/tasks.xml').status_code == 404
+
+
+def test_export_requires_login(client):
+    response = client.get('/export/tasks.csv')
+
+    assert response.status_code == 302
+    assert '/auth/login' in response.headers['Location']
+
+
+# Run in a fresh interpreter, so the peak RSS is not left over from other tests.
+EXPORT_SCRIPT = textwrap.dedent('''
+    import json, resource, sys
+    from web import create_app
+
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': sys.argv[1],
+        'SECRET_KEY': 'mytestsecretkey',
+        'METRICS_ENABLED': False,
+        # Pages SQLite maps count towards RSS, but they are page cache.
+        'SQLITE_MMAP_SIZE': 0,
+        'CELERY': {'broker_url': 'memory://', 'task_always_eager': True},
+    })
+    client = app.test_client()
+    client.environ_base['HTTP_X_FORWARDED_PROTO'] = 'https'
+    client.post('/auth/login', data={'username': 'test', 'password': 'test'})
+    client.get('/')
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    lines = size = 0
+    response = client.get('/export/tasks.' + sys.argv[2], buffered=False)
+    for chunk in response.iter_encoded():
+        lines += chunk.count(b'\\n')
+        size += len(chunk)
+    response.close()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'lines': lines, 'bytes': size, 'baseline': baseline, 'peak': peak}))
+''')
+
+
+def test_export_streams_in_batches(client, auth, monkeypatch, seed_tasks):
+    monkeypatch.setattr(export, 'EXPORT_BATCH', 7)
+    monkeypatch.setattr(export, 'CHUNK_SIZE', 256)
+    ids = seed_tasks(50, body='a description', comments_per_task=3)
+    auth.login()
+
+    response = client.get('/export/tasks.ndjson')
+
+    tasks = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [task['id'] for task in tasks] == [1, 2, 3] + ids
+    assert all(
+        [c['content'] for c in task['comments']] == [f'comment {n} on task {task["id"]}'
+                                                     for n in range(3)]
+        for task in tasks[3:]
+    )
+
+
+@pytest.mark.benchmark
+def test_export_memory_benchmark(app, seed_tasks):
+    # 250,000 tasks with four comments each export as 1M CSV rows.
+    seed_tasks(250_000, body='a description ' * 8, comments_per_task=4)
+
+    result = subprocess.run(
+        [sys.executable, '-c', EXPORT_SCRIPT, app.config['SQLALCHEMY_DATABASE_URI'], 'csv'],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    stats = json.loads(result.stdout.splitlines()[-1])
+    growth_mb = (stats['peak'] - stats['baseline']) / 1024
+
+    print(f"\n{stats['lines'] - 1} CSV rows, {stats['bytes'] / 2 ** 20:.0f} MiB streamed, "
+          f"peak RSS {stats['peak'] / 1024:.0f} MiB, {growth_mb:.1f} MiB above baseline")
+    assert stats['lines'] - 1 == 1_000_003
+    assert growth_mb < 20
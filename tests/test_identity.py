@@ -0,0 +1,126 @@
+import pytest
+
+from web import db
+from web.identity import TenantRecord, UserRecord, identity_cache
+from web.models import Tenant, User
+
+
+@pytest.fixture(autouse=True)
+def clear_identity_cache():
+    identity_cache.clear()
+
+
+def test_user_loaded_once_across_requests(client, auth, statements):
+    auth.login()
+
+    with statements:
+        client.get('/')
+    first = len(statements.statements)
+    assert statements.touching('user') != []
+
+    with statements:
+        client.get('/')
+    second = len(statements.statements)
+
+    assert 'FROM user \n' not in ''.join(statements.statements)
+    assert second == first - 1
+    assert identity_cache.counts[('user', 'hit')] >= 1
+
+
+def test_static_files_skip_user(client, auth, statements):
+    auth.login()
+    with statements:
+        client.get('/static/style.css')
+
+    assert statements.statements == []
+
+
+def test_settings_uses_cached_tenant(client, auth, statements):
+    auth.login()
+    client.get('/settings')
+
+    with statements:
+        response = client.get('/settings')
+
+    assert response.status_code == 200
+    assert statements.statements == []
+
+
+@pytest.mark.parametrize(('path', 'data'), (
+    ('/1/done', {}),
+    ('/1/update', {'title': 'renamed', 'due_date': '', 'body': ''}),
+))
+def test_task_loaded_once_per_request(client, auth, statements, path, data):
+    auth.login()
+    client.get('/')
+
+    with statements:
+        client.post(path, data=data)
+
+    loads = [
+        s for s in statements.statements
+        if 'WHERE task.id = ? AND task.tenant_id = ?' in s
+    ]
+    assert len(loads) == 1
+    assert identity_cache.counts[('task', 'request')] >= 1
+
+
+def test_timezone_change_invalidates_tenant(app, client, auth):
+    auth.login()
+    client.get('/settings')
+
+    client.post('/settings', data={'timezone': 'Asia/Tokyo'})
+
+    with app.test_request_context():
+        assert identity_cache.get_tenant(1).timezone == 'Asia/Tokyo'
+    assert identity_cache.counts[('tenant', 'miss')] == 2
+
+
+def test_password_change_invalidates_user(app):
+    with app.test_request_context():
+        assert identity_cache.get_user(1, 1) == UserRecord(1, 1, 'test')
+
+    with app.app_context():
+        user = db.session.get(User, 1)
+        user.username = 'renamed'
+        db.session.commit()
+
+    with app.test_request_context():
+        assert identity_cache.get_user(1, 1) == UserRecord(1, 1, 'renamed')
+
+
+def test_rolled_back_change_keeps_cache(app):
+    with app.test_request_context():
+        assert identity_cache.get_tenant(1) == TenantRecord(1, 'test_trial', 'UTC')
+
+    with app.app_context():
+        db.session.get(Tenant, 1).timezone = 'Asia/Tokyo'
+        db.session.flush()
+        db.session.rollback()
+
+    with app.test_request_context():
+        identity_cache.get_tenant(1)
+    assert identity_cache.counts[('tenant', 'hit')] == 1
+
+
+def test_cache_is_bounded(app):
+    identity_cache.max_entries = 1
+    with app.test_request_context():
+        identity_cache.get_tenant(1)
+    with app.test_request_context():
+        identity_cache.get_tenant(2)
+    with app.test_request_context():
+        identity_cache.get_tenant(1)
+    assert identity_cache.counts[('tenant', 'miss')] == 3
+    identity_cache.max_entries = 4096
+
+
+def test_lookup_counters_exported(app, client, auth):
+    auth.login()
+    client.get('/')
+    client.get('/')
+
+    body = client.get(
+        '/metrics', headers={'Authorization': 'Bearer mytestmetricstoken'}
+    ).get_data(as_text=True)
+    assert 'taskmate_identity_lookups_total{entity="user",result="hit"}' in body
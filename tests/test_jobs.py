@@ -0,0 +1,100 @@
+import time
+from datetime import datetime
+
+import pytest
+from celery.contrib.testing.worker import start_worker
+
+from web import create_app, db
+from web.jobs import sweep_overdue
+from web.models import Task
+
+
+def job_metrics(client):
+    return client.get(
+        '/metrics', headers={'Authorization': 'Bearer mytestmetricstoken'}
+    ).get_data(as_text=True)
+
+
+def test_sweep_job_runs_in_app_context(app, client):
+    with app.app_context():
+        db.session.get(Task, 1).due_date = datetime(2023, 6, 1)
+        db.session.commit()
+
+    result = sweep_overdue.delay()
+
+    assert result.get() == 1
+    with app.app_context():
+        assert db.session.get(Task, 1).status == 'OVERDUE'
+
+    body = job_metrics(client)
+    assert 'taskmate_jobs_total{job="web.jobs.sweep_overdue",state="SUCCESS"} 1' in body
+    assert 'taskmate_job_run_seconds_count{job="web.jobs.sweep_overdue"} 1' in body
+
+
+def test_transient_failures_retried(app):
+    celery_app = app.extensions['celery']
+    attempts = []
+
+    @celery_app.task
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError('SMTP server went away')
+        return 'sent'
+
+    assert flaky.delay().get() == 'sent'
+    assert len(attempts) == 3
+    assert flaky.retry_backoff is True
+    assert flaky.max_retries == 5
+
+
+def test_permanent_failures_not_retried(app):
+    celery_app = app.extensions['celery']
+    attempts = []
+
+    @celery_app.task
+    def broken():
+        attempts.append(1)
+        raise ValueError('bad input')
+
+    with pytest.raises(ValueError):
+        broken.delay().get()
+    assert len(attempts) == 1
+
+
+def test_worker_records_queue_wait(app, client):
+    celery_app = app.extensions['celery']
+    celery_app.conf.task_always_eager = False
+
+    @celery_app.task
+    def ping():
+        return 'pong'
+
+    with start_worker(celery_app, perform_ping_check=False, pool='solo'):
+        # Results are disabled, so wait for the worker through the metrics.
+        ping.delay()
+        for _ in range(100):
+            if 'state="SUCCESS"' in job_metrics(client):
+                break
+            time.sleep(0.05)
+
+    body = job_metrics(client)
+    assert f'taskmate_job_queue_wait_seconds_count{{job="{ping.name}"}} 1' in body
+    assert 'taskmate_job_queue_depth{queue="celery"} 0' in body
+
+
+def test_queue_depth_gauge(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'SECRET_KEY': 'mytestsecretkey',
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'web.sqlite'),
+        'METRICS_DIR': str(tmp_path / 'metrics'),
+        'METRICS_TOKEN': 'mytestmetricstoken',
+        'CELERY': {'broker_url': 'sqla+sqlite:///' + str(tmp_path / 'celery.sqlite')},
+    })
+    for _ in range(3):
+        sweep_overdue.delay()
+
+    client = app.test_client()
+    client.environ_base['HTTP_X_FORWARDED_PROTO'] = 'https'
+    assert 'taskmate_job_queue_depth{queue="celery"} 3' in job_metrics(client)
@@ -0,0 +1,230 @@
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import pytest
+from flask import g, render_template, session
+
+from web import db
+from web.landing import list_context
+from web.models import Task, User
+from web.queries import (
+    Dashboard,
+    done_task_filters,
+    get_comments,
+    get_dashboard,
+    get_done_tasks,
+    viewed_body_column,
+)
+
+MOBILE = 'Mozilla/5.0 (iPhone; CPU iPhone OS 16_0 like Mac OS X) Mobile'
+
+
+
+def test_dashboard_derives_from_active_tasks(app):
+    with app.test_request_context():
+        g.tenant_id = 1
+        g.user = db.session.get(User, 1)
+
+        dashboard = get_dashboard(1)
+
+        assert [task.id for task in dashboard.tasks] == [2, 1]
+        assert [task.id for task in dashboard.overdue] == [2]
+        assert dashboard.overdue_count == 1
+        assert dashboard.latest_task.id == 2
+        assert dashboard.view.id == 2
+        assert dashboard.comments == ()
+        assert dashboard.find_task(3) is None
+        assert [task.comment_count for task in dashboard.tasks] == [0, 1]
+
+
+def test_dashboard_loads_comments_for_viewed_task_only(app):
+    with app.test_request_context():
+        g.tenant_id = 1
+        g.user = db.session.get(User, 1)
+
+        dashboard = get_dashboard(1, view_id=1)
+
+        assert dashboard.view.id == 1
+        assert dashboard.latest_task.id == 2
+        assert [comment.id for comment in dashboard.comments] == [1]
+        # Only the viewed row carries its description.
+        assert [task.body for task in dashboard.tasks] == [None, 'first body']
+
+
+def test_newest_task_carries_the_only_body(app):
+    with app.test_request_context():
+        g.tenant_id = 1
+        g.user = db.session.get(User, 1)
+        db.session.add(Task(id=5, tenant_id=1, author_id=1, created=datetime(2023, 6, 5),
+                            title='newer done task', status='DONE', body='newer body'))
+        db.session.commit()
+
+        page = get_done_tasks(1, extra_columns=[viewed_body_column(None, done_task_filters(1))])
+        assert [(task.id, task.body) for task in page.tasks] == [(5, 'newer body'), (3, None)]
+
+        db.session.get(Task, 2).body = 'overdue body'
+        db.session.commit()
+        dashboard = get_dashboard(1)
+        assert [task.body for task in dashboard.tasks] == ['overdue body', None]
+
+
+def test_dashboard_is_at_most_two_statements(app, statements):
+    with app.test_request_context():
+        g.tenant_id = 1
+        g.user = db.session.get(User, 1)
+
+        with statements:
+            get_dashboard(1, view_id=1)
+
+    assert len(statements.statements) <= 2
+
+
+@pytest.mark.parametrize('user_agent', ('Mozilla/5.0 (X11; Linux x86_64)', MOBILE))
+def test_index_query_count(client, auth, statements, user_agent):
+    # flask-paranoid ties the session to the User-Agent it was created with.
+    client.environ_base['HTTP_USER_AGENT'] = user_agent
+    auth.login()
+
+    with statements:
+        response = client.get('/')
+
+    assert response.status_code == 200
+    assert b'first task' in response.data
+    assert b'You have 1 tasks overdue!' in response.data
+    # One statement loads g.user, the dashboard accounts for the rest.
+    assert len(statements.statements) <= 3
+
+
+def test_load_view_uses_dashboard_row(client, auth, statements):
+    auth.login()
+
+    with statements:
+        response = client.post('/1/view')
+
+    assert response.status_code == 200
+    assert b'first body' in response.data
+    assert b'You have 1 tasks overdue!' in response.data
+    assert len(statements.statements) <= 3
+
+
+def test_load_view_other_tenant_task(client, auth):
+    auth.login()
+    assert client.post('/4/view').status_code == 404
+
+
+def test_done_loads_comments_for_viewed_task_only(client, auth, statements):
+    auth.login()
+
+    with statements:
+        response = client.get('/done')
+
+    assert response.status_code == 200
+    assert b'done comment' in response.data
+    assert b'1 comments' in response.data
+    assert len(statements.statements) <= 3
+
+
+def test_dashboard_loads_viewed_comments_only(app, seed_tasks):
+    seed_tasks(100, comments_per_task=100)
+
+    with app.test_request_context():
+        g.tenant_id = 1
+        g.user = db.session.get(User, 1)
+
+        all_comments = get_comments(1)
+        dashboard = get_dashboard(1)
+
+    assert len(all_comments) == 10001
+    assert len(dashboard.comments) == 100
+    assert dashboard.latest_task.comment_count == 100
+
+
+# The detail pane as it was rendered before list_context: every section
+# searches the task list for the viewed task and the comment list for its
+# comments, and tasks.index() is linear per call.
+NESTED_DETAIL = """
+{% for task in tasks %}{% if task.id == view.id %}{{ task.title }}{% endif %}{% endfor %}
+{% for task in tasks %}{% if task.id == view.id %}
+<div id="commentSection{{ tasks.index(task) }}"></div>
+{% for comment in comments %}{% if comment.task_id == view.id %}<p>{{ comment.content }}</p>{% endif %}{% endfor %}
+{% endif %}{% endfor %}
+{% for task in tasks %}{% if task.id == view.id %}{{ task.status }}{% endif %}{% endfor %}
+"""
+
+GROUPED_DETAIL = """
+{% if view.id in positions %}{{ view.title }}{% endif %}
+{% if view.id in positions %}
+<div id="commentSection{{ positions[view.id] }}"></div>
+{% for comment in comments_by_task.get(view.id, ()) %}<p>{{ comment.content }}</p>{% endfor %}
+{% endif %}
+{% if view.id in positions %}{{ view.status }}{% endif %}
+"""
+
+
+def render_detail(app, tasks, comments):
+    """The nested and grouped detail panes and the full page for the last
+    task, the worst case for the nested loops, with their render times."""
+    view = tasks[-1]
+    with app.test_request_context():
+        nested = app.jinja_env.from_string(NESTED_DETAIL)
+        grouped = app.jinja_env.from_string(GROUPED_DETAIL)
+
+        start = time.perf_counter()
+        nested_html = nested.render(tasks=tasks, comments=comments, view=view)
+        nested_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        context = list_context(tasks, comments)
+        grouped_html = grouped.render(view=view, **context)
+        grouped_elapsed = time.perf_counter() - start
+
+        session['timezone'] = 'UTC'
+        g.user = db.session.get(User, 1)
+        start = time.perf_counter()
+        page = render_template(
+            'landing/index.html',
+            dashboard=Dashboard(tasks, (), comments, tasks[0], view),
+            view=view,
+            **context,
+        )
+        page_elapsed = time.perf_counter() - start
+
+    assert nested_html.split() == grouped_html.split()
+    return page, nested_elapsed, grouped_elapsed, page_elapsed
+
+
+def detail_rows(tasks, comments):
+    Row = namedtuple('Row', 'id title status due_date created author_id body comment_count')
+    Comment = namedtuple('Comment', 'id task_id content created')
+    return (
+        tuple(
+            Row(n, f'task {n}', 'ACTIVE', None, datetime(2023, 7, 1), 1, None,
+                comments // tasks)
+            for n in range(tasks)
+        ),
+        tuple(
+            Comment(n, n % tasks, f'comment {n}', datetime(2023, 7, 2))
+            for n in range(comments)
+        ),
+    )
+
+
+def test_grouped_detail_matches_nested(app):
+    page = render_detail(app, *detail_rows(50, 500))[0]
+    assert 'commentSection49' in page
+    assert page.count('comment 499') == 1
+
+
+@pytest.mark.benchmark
+def test_render_benchmark(app):
+    page, nested_elapsed, grouped_elapsed, page_elapsed = render_detail(
+        app, *detail_rows(1000, 20000)
+    )
+
+    print(f"1k tasks / 20k comments: nested {nested_elapsed * 1000:.1f} ms, "
+          f"grouped {grouped_elapsed * 1000:.1f} ms, "
+          f"full index.html {page_elapsed * 1000:.1f} ms")
+    assert grouped_elapsed < nested_elapsed
+    assert 'commentSection999' in page
+    assert page.count('comment 19999') == 1
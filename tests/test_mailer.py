@@ -0,0 +1,197 @@
+import socket
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from web import db, mail
+from web.mailer import deliver_outbox, queue_mail, to_message
+from web.models import MailOutbox, Task, User
+
+
+class Sink(object):
+    def __init__(self):
+        self.messages = []
+        self.peers = set()
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        self.peers.add(session.peer)
+        return '250 Message accepted for delivery'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_port():
+    return free_port()
+
+
+@pytest.fixture
+def smtpd(smtp_port):
+    sink = Sink()
+    controller = Controller(sink, hostname='127.0.0.1', port=smtp_port)
+    controller.start()
+    yield sink
+    controller.stop()
+
+
+@pytest.fixture
+def mail_app(app, smtp_port):
+    app.config.update(
+        MAIL_ENABLED=True,
+        MAIL_SERVER='127.0.0.1',
+        MAIL_PORT=smtp_port,
+        MAIL_SUPPRESS_SEND=False,
+        MAIL_RATE_LIMIT=0,
+    )
+    mail.init_app(app)
+    with app.app_context():
+        db.session.get(User, 1).username = 'test@example.com'
+        db.session.commit()
+    return app
+
+
+def queue(count, prefix='bulk'):
+    for n in range(count):
+        queue_mail(1, f'user{n}@example.com', f'Message {n}', 'new_task',
+                   f'{prefix}:{n}', user={'username': 'user'},
+                   body={'title': f'task {n}', 'due_date': None, 'description': ''})
+    db.session.commit()
+
+
+def test_new_task_mail_delivered(mail_app, client, auth, smtpd):
+    auth.login(username='test@example.com')
+
+    client.post('/create', data={'title': 'write report', 'due_date': '', 'body': 'by friday'})
+
+    with mail_app.app_context():
+        outbox = MailOutbox.query.one()
+        task = Task.query.filter_by(title='write report').one()
+        assert outbox.dedup_key == f'new_task:{task.id}'
+        assert outbox.status == 'SENT'
+
+    assert len(smtpd.messages) == 1
+    message = smtpd.messages[0]
+    assert message.rcpt_tos == ['test@example.com']
+    assert b'write report' in message.content
+    assert f'<outbox-{outbox.id}@taskmate>'.encode() in message.content
+
+
+def test_no_mail_for_plain_usernames(mail_app, client, auth):
+    with mail_app.app_context():
+        db.session.get(User, 1).username = 'test'
+        db.session.commit()
+    auth.login()
+
+    client.post('/create', data={'title': 'quiet task', 'due_date': '', 'body': ''})
+
+    with mail_app.app_context():
+        assert MailOutbox.query.count() == 0
+
+
+def test_duplicates_ignored(mail_app):
+    with mail_app.test_request_context():
+        queue(3)
+        queue(3)
+        assert MailOutbox.query.count() == 3
+
+
+def test_batch_reuses_one_connection(mail_app, smtpd):
+    with mail_app.test_request_context():
+        queue(25)
+        assert deliver_outbox() == 25
+
+    assert len(smtpd.messages) == 25
+    assert len(smtpd.peers) == 1
+
+
+def test_unreachable_server_retried_with_backoff(mail_app, smtp_port):
+    with mail_app.test_request_context():
+        queue(2)
+        assert deliver_outbox() == 0
+
+        rows = MailOutbox.query.all()
+        assert {row.status for row in rows} == {'PENDING'}
+        assert {row.attempts for row in rows} == {1}
+        assert all(row.next_attempt > datetime.utcnow() for row in rows)
+        # Not due yet, so nothing is claimed.
+        assert deliver_outbox() == 0
+
+        controller = Controller(Sink(), hostname='127.0.0.1', port=smtp_port)
+        controller.start()
+        try:
+            MailOutbox.query.update({'next_attempt': datetime.utcnow()})
+            db.session.commit()
+            assert deliver_outbox() == 2
+        finally:
+            controller.stop()
+
+
+def test_gives_up_after_max_attempts(mail_app):
+    mail_app.config['MAIL_MAX_ATTEMPTS'] = 2
+    with mail_app.test_request_context():
+        queue(1)
+        for _ in range(2):
+            MailOutbox.query.update({'next_attempt': datetime.utcnow()})
+            db.session.commit()
+            deliver_outbox()
+
+        assert MailOutbox.query.one().status == 'FAILED'
+
+
+def test_stale_claims_taken_over(mail_app, smtpd):
+    with mail_app.test_request_context():
+        queue(1)
+        MailOutbox.query.update({
+            'status': 'SENDING',
+            'claim_token': 'crashed',
+            'claimed': datetime.utcnow() - timedelta(hours=1),
+        })
+        db.session.commit()
+
+        assert deliver_outbox() == 1
+
+
+def test_rate_limit(mail_app, smtpd):
+    mail_app.config['MAIL_RATE_LIMIT'] = 20
+    with mail_app.test_request_context():
+        queue(10)
+        start = time.perf_counter()
+        deliver_outbox()
+        elapsed = time.perf_counter() - start
+
+    assert len(smtpd.messages) == 10
+    # Nine gaps of 1/20 s between ten messages.
+    assert elapsed >= 0.45
+
+
+@pytest.mark.benchmark
+def test_throughput_benchmark(mail_app, smtpd):
+    count = 200
+    with mail_app.test_request_context():
+        queue(count, prefix='inline')
+        messages = [to_message(row) for row in MailOutbox.query.all()]
+        start = time.perf_counter()
+        for message in messages:
+            mail.send(message)
+        inline_elapsed = time.perf_counter() - start
+        MailOutbox.query.delete()
+        db.session.commit()
+
+        queue(count, prefix='outbox')
+        start = time.perf_counter()
+        assert deliver_outbox(batch_size=count) == count
+        outbox_elapsed = time.perf_counter() - start
+
+    print(f"\n{count} mails: connection per mail {count / inline_elapsed:.0f}/s, "
+          f"batched outbox {count / outbox_elapsed:.0f}/s")
+    assert len(smtpd.messages) == 2 * count
+    # A local stand-in has no TLS handshake or network latency, so timings are
+    # close here; the saving that grows with latency is the connection count.
+    assert len(smtpd.peers) == count + 1
@@ -0,0 +1,96 @@
+import re
+
+from web.metrics import MetricsRegistry
+
+TOKEN = {'Authorization': 'Bearer mytestmetricstoken'}
+
+
+def server_timing(response):
+    return {
+        match.group(1): match
+        for match in re.finditer(
+            r'(\w+);dur=([\d.]+)(?:;desc="(\d+) statements")?',
+            response.headers['Server-Timing'],
+        )
+    }
+
+
+def test_server_timing_header(client, auth, statements):
+    auth.login()
+    with statements:
+        response = client.get('/')
+
+    timing = server_timing(response)
+    assert set(timing) == {'db', 'render', 'total'}
+    assert int(timing['db'].group(3)) == len(statements.statements) + len(statements.begins)
+    assert float(timing['render'].group(2)) > 0
+    assert float(timing['total'].group(2)) >= float(timing['db'].group(2))
+
+
+def test_metrics_endpoint(app, client, auth):
+    app.extensions['metrics'].registry.flush_interval = 0
+    auth.login()
+    client.get('/')
+    client.get('/')
+    client.get('/does-not-exist')
+
+    body = client.get('/metrics', headers=TOKEN).get_data(as_text=True)
+
+    assert 'taskmate_http_requests_total{method="GET",route="/",status="200"} 2' in body
+    assert 'route="unmatched",status="404"' in body
+    assert 'taskmate_db_statements_per_request_count{route="/"} 2' in body
+    assert 'taskmate_template_render_seconds_bucket{route="/",le="+Inf"} 2' in body
+    assert 'route="/metrics"' not in body
+
+
+def test_metrics_endpoint_needs_the_token(app, client, auth):
+    auth.login()
+    response = client.get('/metrics')
+    assert response.status_code == 401
+    assert response.headers['WWW-Authenticate'] == 'Bearer'
+    wrong = client.get('/metrics', headers={'Authorization': 'Bearer wrong'})
+    assert wrong.status_code == 401
+
+    app.config['METRICS_TOKEN'] = None
+    assert client.get('/metrics', headers=TOKEN).status_code == 404
+
+
+def test_histogram_buckets_are_cumulative(tmp_path):
+    registry = MetricsRegistry(str(tmp_path))
+    for value in (1, 3, 3, 500):
+        registry.observe('taskmate_db_statements_per_request', {'route': '/'}, value)
+
+    body = registry.render()
+
+    name = 'taskmate_db_statements_per_request'
+    assert f'{name}_bucket{{route="/",le="1"}} 1' in body
+    assert f'{name}_bucket{{route="/",le="5"}} 3' in body
+    assert f'{name}_bucket{{route="/",le="100"}} 3' in body
+    assert f'{name}_bucket{{route="/",le="+Inf"}} 4' in body
+    assert f'{name}_sum{{route="/"}} 507' in body
+
+
+def test_workers_aggregated(tmp_path):
+    worker_a = MetricsRegistry(str(tmp_path))
+    worker_b = MetricsRegistry(str(tmp_path))
+    # Each worker writes its own file, so force distinct names in one process.
+    worker_b._pid, worker_b._path = -1, str(tmp_path / 'other-worker.json')
+
+    labels = {'route': '/', 'method': 'GET', 'status': 200}
+    worker_a.inc('taskmate_http_requests_total', labels, 3)
+    worker_b.inc('taskmate_http_requests_total', labels, 4)
+    worker_b.flush()
+
+    assert 'taskmate_http_requests_total{method="GET",route="/",status="200"} 7' in (
+        worker_a.render()
+    )
+
+    # A restarted worker starts from zero but the old files still count.
+    worker_a.flush()
+    restarted = MetricsRegistry(str(tmp_path))
+    restarted._pid, restarted._path = -2, str(tmp_path / 'restarted.json')
+    restarted.inc('taskmate_http_requests_total', labels)
+
+    assert 'taskmate_http_requests_total{method="GET",route="/",status="200"} 8' in (
+        restarted.render()
+    )
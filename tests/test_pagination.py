@@ -0,0 +1,148 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from flask import g
+
+from web import db
+from web.models import Task, User
+from web.queries import (
+    encode_cursor,
+    get_active_tasks,
+    get_done_tasks,
+    overdue_count_column,
+)
+
+
+def paired(n):
+    # Pairs of rows share a timestamp so ties on created are broken by id.
+    return datetime(2023, 7, 1) + timedelta(minutes=n // 2)
+
+
+def test_pages_cover_every_task_once(app, seed_tasks):
+    seed_tasks(25, 'DONE', created=paired)
+
+    with app.test_request_context():
+        g.tenant_id = 1
+        g.user = db.session.get(User, 1)
+
+        seen = []
+        cursor = None
+        while True:
+            page = get_done_tasks(1, cursor=cursor, limit=10)
+            seen.extend(task.id for task in page.tasks)
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+
+        expected = [
+            task.id
+            for task in Task.query.filter_by(status='DONE', tenant_id=1)
+            .order_by(Task.created.desc(), Task.id.desc())
+        ]
+
+    assert seen == expected
+    assert len(seen) == 26
+
+
+def test_pages_step_past_rows_without_microseconds(app):
+    # Rows written by the CURRENT_TIMESTAMP default, like the fixture's, are
+    # stored without the .000000 that cursor timestamps are bound with.
+    with app.app_context():
+        connection = db.engine.raw_connection()
+        connection.executemany(
+            'INSERT INTO task (id, tenant_id, author_id, created, title, status) '
+            "VALUES (?, 1, 1, '2023-07-01 10:00:00', ?, 'DONE')",
+            ((10, 'legacy 10'), (11, 'legacy 11')),
+        )
+        connection.commit()
+        connection.close()
+
+    with app.test_request_context():
+        g.tenant_id = 1
+        g.user = db.session.get(User, 1)
+
+        seen = []
+        cursor = None
+        for _ in range(5):
+            page = get_done_tasks(1, cursor=cursor, limit=1)
+            seen.extend(task.id for task in page.tasks)
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+
+    assert seen == [11, 10, 3]
+
+
+def test_dashboard_overdue_count_spans_pages(app):
+    with app.test_request_context():
+        g.tenant_id = 1
+        g.user = db.session.get(User, 1)
+
+        page = get_active_tasks(1, limit=1, extra_columns=[overdue_count_column(1)])
+
+    assert len(page.tasks) == 1
+    assert page.tasks[0].overdue_count == 1
+    assert page.next_cursor is not None
+
+
+def test_task_page_endpoint(client, auth, seed_tasks):
+    seed_tasks(60, 'ACTIVE', created=paired)
+    auth.login()
+
+    first = client.get('/tasks?status=active&limit=50').get_json()
+    assert len(first['tasks']) == 50
+    assert first['tasks'][0]['view_url'].endswith('/view')
+
+    second = client.get(f"/tasks?status=active&cursor={first['next_cursor']}").get_json()
+    ids = [task['id'] for task in first['tasks'] + second['tasks']]
+    assert len(ids) == len(set(ids)) == 62
+    assert second['next_cursor'] is None
+
+
+@pytest.mark.parametrize(('query', 'status_code'), (
+    ('status=active&cursor=nonsense', 400),
+    ('status=archived', 400),
+))
+def test_task_page_endpoint_rejects_bad_input(client, auth, query, status_code):
+    auth.login()
+    assert client.get(f'/tasks?{query}').status_code == status_code
+
+
+def test_done_view_renders_first_page(client, auth, seed_tasks):
+    seed_tasks(60, 'DONE', created=paired)
+    auth.login()
+
+    response = client.get('/done')
+
+    assert response.data.count(b'id="task-form-') == 50
+    assert b'Load more' in response.data
+
+
+@pytest.mark.benchmark
+def test_deep_page_latency(app, seed_tasks):
+    seed_tasks(50000, 'DONE', created=paired)
+
+    with app.test_request_context():
+        g.tenant_id = 1
+        g.user = db.session.get(User, 1)
+
+        oldest = (
+            Task.query.filter_by(status='DONE', tenant_id=1)
+            .order_by(Task.created.desc(), Task.id.desc())
+            .offset(50 * 999)
+            .first()
+        )
+
+        def timed(cursor):
+            start = time.perf_counter()
+            for _ in range(20):
+                get_done_tasks(1, cursor=cursor, limit=50)
+            return (time.perf_counter() - start) / 20
+
+        first_page = timed(None)
+        page_1000 = timed(encode_cursor(oldest))
+
+    print(f"done tasks page 1: {first_page * 1000:.2f} ms, "
+          f"page 1000: {page_1000 * 1000:.2f} ms")
+    assert page_1000 < first_page * 3
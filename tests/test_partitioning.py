@@ -0,0 +1,294 @@
+import os
+import random
+import re
+import threading
+import time
+
+import pytest
+from flask import g
+from sqlalchemy import create_engine, event, text
+from werkzeug.security import generate_password_hash
+
+from test_query_plans import QUERY_FUNCTIONS, capture_statements
+from web import create_app, db, queries
+from web.models import User
+
+MIGRATIONS = os.path.join(os.path.dirname(__file__), '..', 'migrations')
+UNPARTITIONED = 'c8d2f5a7b391'
+PREPARED = 'd5e8a1f0c6b4'
+
+# Tenant 1's task 1 is OVERDUE and task 3 DONE, as test_query_plans expects.
+SEED = '''
+INSERT INTO tenant (id, name, timezone)
+SELECT n, 'tenant ' || n, 'UTC' FROM generate_series(1, :tenants) n;
+SELECT setval('tenant_id_seq', :tenants);
+INSERT INTO "user" (id, tenant_id, username, password)
+SELECT n, n, CASE n WHEN 1 THEN 'test' ELSE 'user ' || n END, :password
+FROM generate_series(1, :tenants) n;
+SELECT setval('user_id_seq', :tenants);
+INSERT INTO task (tenant_id, author_id, created, due_date, title, body, status)
+SELECT t, t, timestamp '2023-01-01' + n * interval '1 hour',
+       CASE WHEN n % 5 = 0 THEN timestamp '2023-06-01' END, 'task ' || n, 'body ' || n,
+       CASE n % 4 WHEN 1 THEN 'OVERDUE' WHEN 3 THEN 'DONE' ELSE 'ACTIVE' END
+FROM generate_series(1, :tenants) t, generate_series(1, :tasks) n ORDER BY t, n;
+INSERT INTO task_comment (tenant_id, task_id, created, content)
+SELECT tenant_id, id, created + interval '1 minute', 'comment on ' || title FROM task;
+'''
+
+
+@pytest.fixture
+def postgres_app():
+    """An app on TEST_POSTGRES_URI migrated to just before partitioning."""
+    uri = os.getenv('TEST_POSTGRES_URI')
+    if not uri:
+        pytest.skip('TEST_POSTGRES_URI is not set')
+
+    from flask_migrate import upgrade
+
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': uri,
+        'SECRET_KEY': 'mytestsecretkey',
+        'METRICS_ENABLED': False,
+        'CELERY': {'broker_url': 'memory://', 'task_always_eager': True},
+    })
+    with app.app_context():
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql('DROP SCHEMA public CASCADE; CREATE SCHEMA public')
+        upgrade(directory=MIGRATIONS, revision=UNPARTITIONED)
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+def seed(app, tenants, tasks):
+    with app.app_context(), db.engine.begin() as connection:
+        connection.execute(text(SEED), {
+            'tenants': tenants, 'tasks': tasks, 'password': generate_password_hash('test'),
+        })
+        connection.exec_driver_sql('ANALYZE')
+
+
+def partition(app, partitions=16, copy=True):
+    """Run the prepare migration, partition-copy and the swap."""
+    from flask_migrate import upgrade
+
+    with app.app_context():
+        upgrade(directory=MIGRATIONS, revision=PREPARED, x_arg=[f'partitions={partitions}'])
+    if copy:
+        result = app.test_cli_runner().invoke(args=['partition-copy', '--batch-size', '1000'])
+        assert 'Run flask db upgrade' in result.output, result.output
+    with app.app_context():
+        upgrade(directory=MIGRATIONS)
+
+
+def checksum(connection, table):
+    return connection.exec_driver_sql(
+        f"SELECT count(*), md5(string_agg(rows::text, ',' ORDER BY rows.id)) "
+        f"FROM (SELECT * FROM {table}) rows"
+    ).one()
+
+
+def test_partition_while_writing(postgres_app):
+    from flask_migrate import upgrade
+
+    seed(postgres_app, 50, 40)
+    with postgres_app.app_context():
+        upgrade(directory=MIGRATIONS, revision=PREPARED, x_arg=['partitions=4'])
+        uri = postgres_app.config['SQLALCHEMY_DATABASE_URI']
+
+    # Every kind of change, to rows the copy has and has not reached.
+    stop = threading.Event()
+    writes = []
+
+    def write():
+        engine = create_engine(uri)
+        rng = random.Random(1)
+        while not stop.is_set():
+            tenant, task = rng.randint(1, 50), rng.randint(1, 2000)
+            with engine.begin() as connection:
+                new = connection.execute(text(
+                    "INSERT INTO task (tenant_id, author_id, title, status) "
+                    "VALUES (:t, :t, 'new', 'ACTIVE') RETURNING id"
+                ), {'t': tenant}).scalar()
+                connection.execute(text(
+                    "INSERT INTO task_comment (tenant_id, task_id, content) "
+                    "SELECT tenant_id, id, 'late' FROM task WHERE id IN (:new, :task)"
+                ), {'new': new, 'task': task})
+                connection.execute(text(
+                    "UPDATE task SET title = title || '!' WHERE id = :task"
+                ), {'task': rng.randint(1, 2000)})
+                connection.execute(text("DELETE FROM task WHERE id = :task"),
+                                   {'task': rng.randint(1, 2000)})
+            writes.append(new)
+        engine.dispose()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        result = postgres_app.test_cli_runner().invoke(
+            args=['partition-copy', '--batch-size', '100', '--pause', '0.02']
+        )
+    finally:
+        stop.set()
+        writer.join()
+    assert 'task_comment: ' in result.output
+    assert len(writes) > 10
+
+    with postgres_app.app_context(), db.engine.connect() as connection:
+        before = [checksum(connection, table) for table in ('task', 'task_comment')]
+        copied = [checksum(connection, table + '_partitioned') for table in ('task', 'task_comment')]
+    assert copied == before
+
+    with postgres_app.app_context():
+        upgrade(directory=MIGRATIONS)
+        with db.engine.connect() as connection:
+            assert connection.exec_driver_sql(
+                "SELECT relkind FROM pg_class WHERE relname = 'task'"
+            ).scalar() == 'p'
+            assert [checksum(connection, table) for table in ('task', 'task_comment')] == before
+
+    # The app carries on against the partitioned tables.
+    client = postgres_app.test_client()
+    client.environ_base['HTTP_X_FORWARDED_PROTO'] = 'https'
+    client.post('/auth/login', data={'username': 'test', 'password': 'test'})
+    assert b'task 40' in client.get('/').data
+    response = client.post('/create', data={'title': 'partitioned', 'body': '', 'due_date': ''})
+    assert response.status_code == 302
+    with postgres_app.app_context():
+        task = db.session.execute(text("SELECT id FROM task WHERE title = 'partitioned'")).scalar()
+    client.post(f'/{task}/comment', data={'comment': 'pruned'})
+    assert b'pruned' in client.get(f'/?view={task}').data
+    client.post(f'/{task}/delete')
+    with postgres_app.app_context():
+        assert db.session.execute(
+            text("SELECT count(*) FROM task_comment WHERE task_id = :id"), {'id': task}
+        ).scalar() == 0
+
+
+def partitions_scanned(connection, statement, parameters):
+    plan = '\n'.join(
+        row[0] for row in connection.exec_driver_sql('EXPLAIN ' + statement, parameters)
+    )
+    return {
+        table: set(re.findall(rf'\b{table}_p\d+\b', plan)) for table in ('task', 'task_comment')
+    }
+
+
+@pytest.mark.parametrize(('name', 'args'), QUERY_FUNCTIONS)
+def test_tenant_queries_read_one_partition(postgres_app, name, args):
+    seed(postgres_app, 32, 10)
+    partition(postgres_app)
+    statements = capture_statements(postgres_app, name, args)
+
+    seen = set()
+    with postgres_app.app_context(), db.engine.connect() as connection:
+        for statement, parameters in statements:
+            for table, scanned in partitions_scanned(connection, statement, parameters).items():
+                assert len(scanned) <= 1, (table, scanned, statement)
+                seen |= scanned
+    assert seen or name == 'get_timezone_setting'
+
+
+def test_search_refresh_reads_one_partition(postgres_app):
+    from web.search import get_backend, refresh_tasks
+
+    seed(postgres_app, 32, 10)
+    partition(postgres_app)
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        if statement.lstrip().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    with postgres_app.app_context():
+        task_ids = db.session.execute(
+            text("SELECT id FROM task WHERE tenant_id = 7 ORDER BY id LIMIT 3")
+        ).scalars().all()
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            refresh_tasks(db.session, get_backend(), 7, task_ids)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        db.session.rollback()
+
+    assert len(statements) == 3
+    with postgres_app.app_context(), db.engine.connect() as connection:
+        for statement, parameters in statements:
+            scanned = partitions_scanned(connection, statement, parameters)
+            assert sum(len(tables) for tables in scanned.values()) == 1, (scanned, statement)
+
+
+def median(values):
+    return sorted(values)[len(values) // 2]
+
+
+def time_dashboards(app, sample):
+    """Milliseconds per get_dashboard call for each of the sample tenants,
+    and the server's planning and execution time for its statements."""
+    times, planning, execution = [], [], []
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        statements.append((statement, parameters))
+
+    for tenant_id in sample:
+        with app.test_request_context():
+            g.tenant_id = tenant_id
+            g.user = db.session.get(User, tenant_id)
+            del statements[:]
+            event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+            try:
+                start = time.perf_counter()
+                dashboard = queries.get_dashboard(tenant_id)
+                times.append((time.perf_counter() - start) * 1000)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+            assert dashboard.latest_task.tenant_id == tenant_id
+
+            with db.engine.connect() as connection:
+                plans = [
+                    connection.exec_driver_sql(
+                        'EXPLAIN (ANALYZE, FORMAT JSON) ' + statement, parameters
+                    ).scalar()[0]
+                    for statement, parameters in statements
+                ]
+            planning.append(sum(plan['Planning Time'] for plan in plans))
+            execution.append(sum(plan['Execution Time'] for plan in plans))
+    return sorted(times), median(planning), median(execution)
+
+
+@pytest.mark.benchmark
+def test_benchmark_dashboard_with_10k_tenants(postgres_app):
+    """get_dashboard for 300 random tenants out of 10,000, with 30 tasks
+    and comments each, on the plain tables and on 16 hash partitions."""
+    tenants = 10000
+    seed(postgres_app, tenants, 30)
+    sample = random.Random(2).sample(range(1, tenants + 1), 300)
+
+    time_dashboards(postgres_app, sample[:30])
+    plain = time_dashboards(postgres_app, sample)
+
+    from flask_migrate import upgrade
+
+    with postgres_app.app_context():
+        upgrade(directory=MIGRATIONS, revision=PREPARED)
+    start = time.perf_counter()
+    result = postgres_app.test_cli_runner().invoke(args=['partition-copy'])
+    copy_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    with postgres_app.app_context():
+        upgrade(directory=MIGRATIONS)
+    swap_seconds = time.perf_counter() - start
+    assert 'Copied 600000 rows' in result.output
+
+    time_dashboards(postgres_app, sample[:30])
+    partitioned = time_dashboards(postgres_app, sample)
+
+    for name, (times, planning, execution) in (('plain', plain), ('partitioned', partitioned)):
+        print(f"\n{name}: get_dashboard median {median(times):.2f} ms, "
+              f"p95 {times[len(times) * 95 // 100]:.2f} ms; server planning "
+              f"{planning:.3f} ms, execution {execution:.3f} ms")
+    print(f"\npartition-copy {copy_seconds:.1f} s, swap {swap_seconds:.1f} s")
+    assert median(partitioned[0]) < median(plain[0]) * 1.5
@@ -0,0 +1,59 @@
+import tracemalloc
+
+import pytest
+
+from web import queries
+from web.models import Task
+
+
+def row_bytes(row):
+    return sum(len(str(value)) for value in row if value is not None)
+
+
+class PayloadMeter(object):
+    """Counts the bytes of task list rows returned by queries.paginate."""
+
+    def __init__(self, monkeypatch):
+        self.bytes = 0
+        paginate = queries.paginate
+
+        def metered(*args, **kwargs):
+            page = paginate(*args, **kwargs)
+            self.bytes += sum(row_bytes(row) for row in page.tasks)
+            return page
+
+        monkeypatch.setattr(queries, 'paginate', metered)
+
+    def measure(self, client, path):
+        self.bytes = 0
+        tracemalloc.start()
+        response = client.get(path)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert response.status_code == 200
+        return self.bytes, peak
+
+
+def full_body_column(view_id=None, filters=()):
+    # The projection list queries used before bodies were deferred.
+    return Task.body
+
+
+@pytest.mark.parametrize('path', ('/', '/done'))
+def test_list_payload(client, auth, monkeypatch, path, seed_tasks):
+    seed_tasks(100, status=lambda n: 'DONE' if n % 2 else 'ACTIVE', body='x' * 20000)
+    auth.login()
+    # Compile templates and warm caches so they don't count towards the peak.
+    client.get(path)
+    meter = PayloadMeter(monkeypatch)
+
+    after_bytes, after_peak = meter.measure(client, path)
+
+    with monkeypatch.context() as m:
+        m.setattr(queries, 'viewed_body_column', full_body_column)
+        m.setattr('web.landing.viewed_body_column', full_body_column)
+        before_bytes, before_peak = meter.measure(client, path)
+
+    # Only the viewed task's 20 KB body is fetched instead of all fifty.
+    assert after_bytes < 25000 < 20000 * 50 < before_bytes
+    assert after_peak < before_peak
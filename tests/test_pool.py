@@ -0,0 +1,260 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine, exc, text
+from sqlalchemy.pool import NullPool
+
+from web import create_app
+from web.metrics import HISTOGRAMS, MetricsRegistry
+from web.pool import TimedQueuePool, engine_options
+
+POSTGRES_URI = 'postgresql://user@localhost/taskmate'
+
+
+def test_sqlite_keeps_default_pool(app):
+    assert app.config['SQLALCHEMY_ENGINE_OPTIONS'] == {}
+
+
+def test_engine_options_from_config():
+    options = engine_options({
+        'SQLALCHEMY_DATABASE_URI': POSTGRES_URI,
+        'DB_POOL_SIZE': 3,
+        'DB_MAX_OVERFLOW': 0,
+        'DB_POOL_TIMEOUT': 2.5,
+        'DB_POOL_RECYCLE': 600,
+        'DB_POOL_PRE_PING': False,
+    })
+
+    assert options == {
+        'poolclass': TimedQueuePool,
+        'pool_size': 3,
+        'max_overflow': 0,
+        'pool_timeout': 2.5,
+        'pool_recycle': 600,
+        'pool_pre_ping': False,
+    }
+
+
+def test_pgbouncer_mode_leaves_pooling_to_pgbouncer():
+    pytest.importorskip('psycopg2')
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': POSTGRES_URI,
+        'DB_PGBOUNCER': True,
+        'METRICS_ENABLED': False,
+    })
+
+    assert app.config['SQLALCHEMY_ENGINE_OPTIONS'] == {'poolclass': NullPool}
+    with app.app_context():
+        from web import db
+
+        assert isinstance(db.engine.pool, NullPool)
+
+
+def test_explicit_engine_options_win():
+    pytest.importorskip('psycopg2')
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': POSTGRES_URI,
+        'SQLALCHEMY_ENGINE_OPTIONS': {'pool_size': 4},
+        'METRICS_ENABLED': False,
+    })
+
+    with app.app_context():
+        from web import db
+
+        pool = db.engine.pool
+    assert isinstance(pool, TimedQueuePool)
+    assert (pool.size(), pool._max_overflow) == (4, 3)
+
+
+def test_pool_reports_waits_and_timeouts(app):
+    registry = app.extensions['metrics'].registry
+    path = os.path.join(tempfile.mkdtemp(), 'pool.sqlite')
+    engine = create_engine('sqlite:///' + path, poolclass=TimedQueuePool,
+                           pool_size=1, max_overflow=0, pool_timeout=0.05)
+
+    held = engine.connect()
+    assert engine.pool.utilization() == 1.0
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    threading.Timer(0.02, held.close).start()
+    with engine.connect() as connection:
+        connection.execute(text('SELECT 1'))
+    engine.dispose()
+
+    assert registry.counters[('taskmate_db_pool_timeouts_total', ())] == 1
+    buckets, total, count = registry.histograms[('taskmate_db_pool_checkout_seconds', ())]
+    assert count == 2
+    assert total >= 0.01
+    buckets, total, count = registry.histograms[('taskmate_db_pool_utilization', ())]
+    assert buckets[-1] == 2
+
+    body = app.extensions['metrics'].registry.render()
+    assert 'taskmate_db_pool_timeouts_total 1' in body
+    assert 'taskmate_db_pool_checkout_seconds_count 2' in body
+
+
+# Each worker is a gthread gunicorn worker: one process, several threads.
+LOAD_SCRIPT = textwrap.dedent('''
+    import json, sys, threading, time
+    from web import create_app
+
+    uri, metrics_dir, worker, threads, requests, pool_size, max_overflow, start_at = sys.argv[1:]
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': uri,
+        'SECRET_KEY': 'mytestsecretkey',
+        'METRICS_DIR': metrics_dir,
+        'DB_POOL_SIZE': int(pool_size),
+        'DB_MAX_OVERFLOW': int(max_overflow),
+        'DB_POOL_TIMEOUT': 10,
+        'CELERY': {'broker_url': 'memory://', 'task_always_eager': True},
+    })
+    errors = []
+
+    def run(task_id):
+        client = app.test_client()
+        client.environ_base['HTTP_X_FORWARDED_PROTO'] = 'https'
+        client.post('/auth/login', data={'username': 'test', 'password': 'test'})
+        time.sleep(max(0, float(start_at) - time.time()))
+        for n in range(int(requests)):
+            try:
+                if n % 4 == 0:
+                    response = client.post(f'/{task_id}/comment', data={'comment': f'comment {n}'})
+                else:
+                    response = client.get('/')
+                if response.status_code >= 500:
+                    errors.append(str(response.status_code))
+            except Exception as e:
+                errors.append(str(e).splitlines()[0])
+
+    # Each thread comments on its own task, so writers do not queue on one row.
+    first = int(worker) * int(threads) + 1
+    workers = [
+        threading.Thread(target=run, args=(task_id,))
+        for task_id in range(first, first + int(threads))
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    app.extensions['metrics'].registry.flush()
+    print(json.dumps({'errors': errors}))
+''')
+
+
+@pytest.fixture
+def postgres_uri():
+    uri = os.getenv('TEST_POSTGRES_URI')
+    if not uri:
+        pytest.skip('TEST_POSTGRES_URI is not set')
+
+    from flask_migrate import upgrade
+    from werkzeug.security import generate_password_hash
+
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': uri,
+                      'METRICS_ENABLED': False})
+    with app.app_context():
+        from web import db
+
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql('DROP SCHEMA public CASCADE; CREATE SCHEMA public')
+        upgrade(directory=os.path.join(os.path.dirname(__file__), '..', 'migrations'))
+        with db.engine.begin() as connection:
+            connection.execute(text("INSERT INTO tenant (name, timezone) VALUES ('t', 'UTC')"))
+            connection.execute(
+                text('INSERT INTO "user" (tenant_id, username, password) VALUES (1, :u, :p)'),
+                {'u': 'test', 'p': generate_password_hash('test')},
+            )
+            connection.execute(text(
+                "INSERT INTO task (tenant_id, author_id, created, title, status) "
+                "SELECT 1, 1, now(), 'task ' || n, 'ACTIVE' FROM generate_series(1, 50) n"
+            ))
+        db.engine.dispose()
+    return uri
+
+
+def run_load(uri, workers, threads, pool_size, max_overflow, requests=100):
+    metrics_dir = tempfile.mkdtemp()
+    start_at = time.time() + 4
+    processes = [
+        subprocess.Popen(
+            [sys.executable, '-c', LOAD_SCRIPT, uri, metrics_dir, str(worker), str(threads),
+             str(requests), str(pool_size), str(max_overflow), str(start_at)],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+        )
+        for worker in range(workers)
+    ]
+
+    # Count the server connections the workers hold while they run.
+    engine = create_engine(uri, poolclass=None)
+    peak = 0
+    # Autocommit, as pg_stat_activity is frozen for the rest of a transaction.
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        while any(process.poll() is None for process in processes):
+            peak = max(peak, connection.execute(text(
+                "SELECT count(*) - 1 FROM pg_stat_activity "
+                "WHERE datname = current_database() AND backend_type = 'client backend'"
+            )).scalar())
+            time.sleep(0.02)
+    engine.dispose()
+    errors = [e for p in processes for e in json.loads(p.communicate()[0].splitlines()[-1])['errors']]
+    elapsed = time.time() - start_at
+
+    counters, histograms = MetricsRegistry(metrics_dir).collect()
+    waits = histograms[('taskmate_db_pool_checkout_seconds', ())]
+    utilization = histograms[('taskmate_db_pool_utilization', ())]
+    return {
+        'peak': peak,
+        'errors': errors,
+        'requests_per_second': workers * threads * requests / elapsed,
+        'mean_wait_ms': waits[1] / waits[2] * 1000,
+        'p99_wait_ms': percentile(waits[0], HISTOGRAMS['taskmate_db_pool_checkout_seconds'][1], 0.99) * 1000,
+        'mean_utilization': utilization[1] / utilization[2],
+        'timeouts': counters.get(('taskmate_db_pool_timeouts_total', ()), 0),
+    }
+
+
+def percentile(buckets, bounds, q):
+    """Upper bucket bound below which q of the samples fall."""
+    target = q * sum(buckets)
+    seen = 0
+    for bound, count in zip(bounds, buckets):
+        seen += count
+        if seen >= target:
+            return bound
+    return float('inf')
+
+
+@pytest.mark.benchmark
+def test_postgres_pool_load(postgres_uri):
+    # gunicorn.conf.py's sync workers serve one request at a time.
+    sync = run_load(postgres_uri, 4, 1, pool_size=2, max_overflow=3, requests=400)
+    # 4 workers with 8 threads each, as gunicorn --workers 4 --threads 8.
+    oversized = run_load(postgres_uri, 4, 8, pool_size=5, max_overflow=10)
+    sized = run_load(postgres_uri, 4, 8, pool_size=8, max_overflow=0)
+    small = run_load(postgres_uri, 4, 8, pool_size=2, max_overflow=0)
+
+    results = (('sync 2+3', sync), ('threads 5+10', oversized), ('threads 8+0', sized),
+               ('threads 2+0', small))
+    for name, result in results:
+        print(f"\npool {name}: {result['peak']} connections, "
+              f"{result['requests_per_second']:.0f} requests/s, checkout mean "
+              f"{result['mean_wait_ms']:.2f} ms, p99 <= {result['p99_wait_ms']:.1f} ms, "
+              f"utilization {result['mean_utilization']:.2f}, {result['timeouts']} timeouts")
+        assert result['errors'] == []
+        assert result['timeouts'] == 0
+
+    assert sync['peak'] <= 4
+    assert oversized['peak'] <= 4 * 15
+    assert sized['peak'] <= 4 * 8
+    assert small['peak'] <= 4 * 2
+    assert small['mean_wait_ms'] > sized['mean_wait_ms']
@@ -0,0 +1,128 @@
+import os
+from collections import namedtuple
+from datetime import datetime
+
+import pytest
+from flask import g
+from sqlalchemy import event
+
+from web import create_app, db, queries
+from web.models import Task, TaskComment, Tenant, User
+from web.queries import encode_cursor
+
+CURSOR = encode_cursor(namedtuple("Row", "id created")(3, datetime(2023, 6, 3, 10)))
+
+# Every read function in queries.py, with the arguments used to call it.
+QUERY_FUNCTIONS = (
+    ("get_active_tasks", (1,)),
+    ("get_active_tasks", (1, CURSOR)),
+    ("get_dashboard", (1,)),
+    ("get_latest_task", (1,)),
+    ("get_done_tasks", (1,)),
+    ("get_done_tasks", (1, CURSOR)),
+    ("get_overdue_tasks", (1,)),
+    ("get_comments_for_task", (1,)),
+    ("get_comments", (1,)),
+    ("get_task", (1,)),
+    ("get_latest_done_task", (1,)),
+    ("get_status", (3,)),
+    ("get_done_task", (3,)),
+    ("get_timezone_setting", (1,)),
+)
+
+
+@pytest.fixture
+def postgres_app():
+    uri = os.getenv("TEST_POSTGRES_URI")
+    if not uri:
+        pytest.skip("TEST_POSTGRES_URI is not set")
+
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': uri,
+        'SECRET_KEY': 'mytestsecretkey'
+    })
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        created = datetime(2023, 6, 1, 10, 0, 0)
+        db.session.add(Tenant(id=1, name="test_trial", timezone="UTC"))
+        db.session.add(User(id=1, tenant_id=1, username="test", password="x"))
+        db.session.add_all([
+            Task(id=1, tenant_id=1, author_id=1, created=created, title="a", status="ACTIVE"),
+            Task(id=3, tenant_id=1, author_id=1, created=created, title="b", status="DONE"),
+        ])
+        db.session.add(TaskComment(id=1, tenant_id=1, task_id=1, created=created, content="c"))
+        db.session.commit()
+        with db.engine.connect() as connection:
+            connection.exec_driver_sql("ANALYZE")
+
+    yield app
+
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def capture_statements(app, name, args):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    with app.test_request_context():
+        g.tenant_id = 1
+        g.user = db.session.get(User, 1)
+
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            getattr(queries, name)(*args)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+    assert statements, f"{name} issued no SELECT"
+    return statements
+
+
+def sqlite_sequential_scans(connection, statement, parameters):
+    plan = connection.exec_driver_sql(
+        "EXPLAIN QUERY PLAN " + statement, parameters
+    ).fetchall()
+    # A bare "SCAN <table>" is a full table scan; index lookups are reported
+    # as "SEARCH" and index-ordered walks as "SCAN ... USING INDEX". Scans of
+    # "(subquery-N)" read an already filtered intermediate, e.g. for windows.
+    return [
+        row[-1]
+        for row in plan
+        if row[-1].startswith("SCAN")
+        and "INDEX" not in row[-1]
+        and not row[-1].startswith("SCAN (subquery")
+    ]
+
+
+def postgres_sequential_scans(connection, statement, parameters):
+    # The fixture tables are tiny, so make the planner prove an index path
+    # exists instead of picking a seq scan on cost alone.
+    connection.exec_driver_sql("SET enable_seqscan = off")
+    plan = connection.exec_driver_sql("EXPLAIN " + statement, parameters).fetchall()
+    return [row[0] for row in plan if "Seq Scan" in row[0]]
+
+
+@pytest.mark.parametrize(("name", "args"), QUERY_FUNCTIONS)
+def test_sqlite_queries_use_indexes(app, name, args):
+    statements = capture_statements(app, name, args)
+
+    with app.app_context(), db.engine.connect() as connection:
+        for statement, parameters in statements:
+            assert sqlite_sequential_scans(connection, statement, parameters) == []
+
+
+@pytest.mark.parametrize(("name", "args"), QUERY_FUNCTIONS)
+def test_postgres_queries_use_indexes(postgres_app, name, args):
+    statements = capture_statements(postgres_app, name, args)
+
+    with postgres_app.app_context(), db.engine.connect() as connection:
+        for statement, parameters in statements:
+            assert postgres_sequential_scans(connection, statement, parameters) == []
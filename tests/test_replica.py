@@ -0,0 +1,134 @@
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+from web import create_app, db
+from web.models import TaskComment
+
+
+def copy_database(source, target):
+    """Copy one SQLite file to another, as replication would."""
+    source = sqlite3.connect(source)
+    target = sqlite3.connect(target)
+    source.backup(target)
+    source.close()
+    target.close()
+
+
+@pytest.fixture
+def replica(app):
+    """A replica of app's database whose first task has a different title."""
+    primary = app.config['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):]
+    path = os.path.join(tempfile.mkdtemp(), 'replica.sqlite')
+    copy_database(primary, path)
+    connection = sqlite3.connect(path)
+    connection.execute("UPDATE task SET title = 'first task (replica)' WHERE id = 1")
+    connection.commit()
+    connection.close()
+    return path
+
+
+def replica_app(app, replica_uri, **config):
+    other = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': app.config['SQLALCHEMY_DATABASE_URI'],
+        'REPLICA_DATABASE_URI': replica_uri,
+        'SECRET_KEY': 'mytestsecretkey',
+        'METRICS_DIR': app.config['METRICS_DIR'],
+        'CELERY': {'broker_url': 'memory://', 'task_always_eager': True},
+        **config,
+    })
+    client = other.test_client()
+    client.environ_base['HTTP_X_FORWARDED_PROTO'] = 'https'
+    client.post('/auth/login', data={'username': 'test', 'password': 'test'})
+    with client.session_transaction() as session:
+        session.pop('primary_until', None)
+    return other, client
+
+
+def test_reads_go_to_the_replica(app, replica):
+    other, client = replica_app(app, 'sqlite:///' + replica)
+
+    response = client.get('/')
+    assert b'first task (replica)' in response.data
+
+    registry = other.extensions['metrics'].registry
+    routes = {labels: n for (name, labels), n in registry.counters.items()
+              if name == 'taskmate_db_read_routes_total'}
+    assert routes[(('reason', 'ok'), ('target', 'replica'))] > 0
+
+
+def test_writes_and_their_reads_stay_on_the_primary(app, replica):
+    other, client = replica_app(app, 'sqlite:///' + replica)
+
+    response = client.post('/1/comment', data={'comment': 'on the primary'})
+    assert response.status_code == 200
+    # The re-rendered page reads back from the primary, comment included.
+    assert b'on the primary' in response.data
+    assert b'first task (replica)' not in response.data
+
+    with other.app_context():
+        assert TaskComment.query.filter_by(content='on the primary').count() == 1
+    connection = sqlite3.connect(replica)
+    assert connection.execute(
+        "SELECT count(*) FROM task_comment WHERE content = 'on the primary'"
+    ).fetchone()[0] == 0
+    connection.close()
+
+
+def test_reads_stick_to_the_primary_after_a_write(app, replica):
+    other, client = replica_app(app, 'sqlite:///' + replica)
+
+    client.post('/1/comment', data={'comment': 'sticky'})
+    assert b'first task (replica)' not in client.get('/').data
+
+    with client.session_transaction() as session:
+        session['primary_until'] = 0
+    assert b'first task (replica)' in client.get('/').data
+
+
+def test_searching_is_not_a_write(app, replica):
+    other, client = replica_app(app, 'sqlite:///' + replica)
+
+    assert client.get('/search?q=task').status_code == 200
+    with client.session_transaction() as session:
+        assert 'primary_until' not in session
+    assert b'first task (replica)' in client.get('/').data
+
+
+def test_unavailable_replica_falls_back_to_the_primary(app):
+    missing = os.path.join(tempfile.mkdtemp(), 'missing', 'replica.sqlite')
+    other, client = replica_app(app, 'sqlite:///' + missing)
+
+    response = client.get('/')
+    assert response.status_code == 200
+    assert b'first task' in response.data
+    assert other.extensions['replica'].healthy is False
+
+
+def test_lagging_replica_falls_back_to_the_primary(app, replica):
+    connection = sqlite3.connect(replica)
+    connection.execute('CREATE TABLE replica_lag (seconds REAL)')
+    connection.execute('INSERT INTO replica_lag VALUES (60)')
+    connection.commit()
+
+    other, client = replica_app(
+        app, 'sqlite:///' + replica,
+        REPLICA_LAG_QUERY='SELECT seconds FROM replica_lag',
+        REPLICA_CHECK_INTERVAL=0,
+    )
+    assert b'first task (replica)' not in client.get('/').data
+    assert other.extensions['replica'].lag == 60
+
+    connection.execute('UPDATE replica_lag SET seconds = 1')
+    connection.commit()
+    connection.close()
+    assert b'first task (replica)' in client.get('/').data
+
+
+def test_no_replica_configured(app):
+    with app.app_context():
+        assert 'replica' not in app.extensions
+        assert list(db.engines) == [None]
@@ -0,0 +1,139 @@
+import random
+import statistics
+import time
+
+import pytest
+from flask import g
+
+from web import db
+from web.models import TaskComment
+from web.search import SQLiteSearch, rebuild_index, search_tasks
+
+
+@pytest.fixture
+def search_app(app):
+    with app.app_context():
+        rebuild_index()
+    return app
+
+
+def search(app, query, user_id=1, tenant_id=1):
+    with app.test_request_context():
+        g.tenant_id = tenant_id
+        return search_tasks(user_id, query)
+
+
+def test_rebuild_indexes_seeded_tasks(search_app):
+    results = search(search_app, 'first')
+
+    assert [task.id for task in results] == [1]
+    assert results[0].title == '<mark>first</mark> task'
+    assert results[0].snippet == '<mark>first</mark> body'
+    assert results[0].status == 'ACTIVE'
+
+
+def test_results_are_ranked_and_stemmed(search_app, client, auth):
+    auth.login()
+    client.post('/create', data={'title': 'buy milk', 'due_date': '', 'body': 'reports'})
+    client.post('/create', data={'title': 'write report', 'due_date': '', 'body': ''})
+
+    results = search(search_app, 'Report')
+
+    # Title matches outrank body matches.
+    assert [task.id for task in results] == [6, 5]
+    assert results[0].title == 'write <mark>report</mark>'
+    assert results[1].snippet == '<mark>reports</mark>'
+
+
+def test_search_is_scoped_to_tenant_and_author(search_app):
+    assert sorted(task.id for task in search(search_app, 'task')) == [1, 2, 3]
+    assert [task.id for task in search(search_app, 'task', user_id=2, tenant_id=2)] == [4]
+    assert search(search_app, 'task', user_id=2, tenant_id=1) == ()
+    assert search(search_app, 'other') == ()
+
+
+def test_index_follows_write_paths(search_app, client, auth):
+    auth.login()
+    client.post('/create', data={'title': 'plan trip', 'due_date': '', 'body': 'book hotel'})
+    assert [task.id for task in search(search_app, 'hotel')] == [5]
+
+    client.post('/5/update', data={'title': 'plan holiday', 'due_date': '', 'body': 'book flights'})
+    assert search(search_app, 'trip') == ()
+    assert [task.id for task in search(search_app, 'holiday flights')] == [5]
+
+    client.post('/5/comment', data={'comment': 'window seat please'})
+    results = search(search_app, 'window')
+    assert [task.id for task in results] == [5]
+    assert results[0].snippet == '<mark>window</mark> seat please'
+
+    with search_app.app_context():
+        comment_id = TaskComment.query.filter_by(task_id=5).one().id
+    client.post(f'/{comment_id}/deletecomment/5')
+    assert search(search_app, 'window') == ()
+
+    client.post('/5/done')
+    assert search(search_app, 'holiday')[0].status == 'DONE'
+
+    client.post('/5/delete')
+    assert search(search_app, 'holiday') == ()
+
+
+def test_search_page_escapes_task_text(search_app, client, auth):
+    auth.login()
+    client.post('/create', data={'title': '<b>bold</b> move', 'due_date': '', 'body': ''})
+
+    response = client.get('/search?q=bold')
+
+    assert response.status_code == 200
+    assert b'&lt;b&gt;<mark>bold</mark>&lt;/b&gt; move' in response.data
+    assert b'<b>bold</b>' not in response.data
+
+
+def test_search_page_requires_login(client):
+    response = client.get('/search?q=task')
+
+    assert response.status_code == 302
+    assert '/auth/login' in response.headers['Location']
+
+
+def test_search_ignores_query_syntax(search_app):
+    assert [task.id for task in search(search_app, 'first" OR scope:t1u1 AND "')] == []
+    assert search(search_app, '*') == ()
+
+
+@pytest.mark.benchmark
+def test_search_benchmark(search_app):
+    count = 1_000_000
+    rng = random.Random(17)
+    words = [f'word{n}' for n in range(50000)]
+
+    def documents():
+        for id in range(1000, 1000 + count):
+            # One tenant with three authors, as in a busy team.
+            yield (id, f't1u{1 + id % 3}', ' '.join(rng.choices(words, k=3)),
+                   ' '.join(rng.choices(words, k=6)))
+
+    with search_app.app_context():
+        connection = db.engine.raw_connection()
+        start = time.perf_counter()
+        connection.executemany(
+            'INSERT INTO task_search (rowid, scope, title, body, comments) '
+            "VALUES (?, ?, ?, ?, '')",
+            documents(),
+        )
+        connection.commit()
+        connection.close()
+        build_elapsed = time.perf_counter() - start
+
+        backend = SQLiteSearch()
+        timings = []
+        for term in rng.sample(words, 20):
+            start = time.perf_counter()
+            hits = backend.search(db.session, [term], 1, 1, 20)
+            timings.append(time.perf_counter() - start)
+        assert hits
+
+    median = statistics.median(timings)
+    print(f"\n{count} tasks indexed in {build_elapsed:.1f} s, search median "
+          f"{median * 1000:.1f} ms, max {max(timings) * 1000:.1f} ms")
+    assert median < 0.05
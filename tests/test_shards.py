@@ -0,0 +1,314 @@
+import os
+import sqlite3
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from web import create_app, db
+from web.models import MailOutbox, ReminderChange, Task, TaskComment, Tenant, User
+from web.shards import plan_moves, shard_bind, use_database
+
+
+def sharded_app(app, names=('a', 'b'), uri=None):
+    """An app on app's database, or uri, as directory, with empty SQLite shards."""
+    directory = tempfile.mkdtemp()
+    uris = {name: 'sqlite:///' + os.path.join(directory, name + '.sqlite') for name in names}
+    other = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': uri or app.config['SQLALCHEMY_DATABASE_URI'],
+        'SHARD_DATABASE_URIS': uris,
+        'SHARD_MOVE_WAIT': 0,
+        'SECRET_KEY': 'mytestsecretkey',
+        'METRICS_DIR': app.config['METRICS_DIR'],
+        'CELERY': {'broker_url': 'memory://', 'task_always_eager': True},
+    })
+    with other.app_context():
+        for name in names:
+            db.metadata.create_all(db.engines[shard_bind(name)])
+    return other
+
+
+@pytest.fixture
+def sharded(app):
+    return sharded_app(app)
+
+
+def login(app, username='test', password='test'):
+    client = app.test_client()
+    client.environ_base['HTTP_X_FORWARDED_PROTO'] = 'https'
+    client.post('/auth/login', data={'username': username, 'password': password})
+    return client
+
+
+def count(model, shard, tenant_id):
+    with use_database(shard_bind(shard)):
+        return model.query.filter_by(tenant_id=tenant_id).count()
+
+
+def test_move_tenant(sharded):
+    client = login(sharded)
+    assert b'first task' in client.get('/').data
+
+    result = sharded.test_cli_runner().invoke(args=['shard-move', 'test_trial', 'a'])
+    assert 'Moved 6 rows to a' in result.output
+
+    with sharded.app_context():
+        tenant = db.session.get(Tenant, 1)
+        assert (tenant.shard, tenant.moving_to) == ('a', None)
+        assert count(Task, None, 1) == 0
+        assert count(TaskComment, None, 1) == 0
+        # The directory keeps the users, for logging in.
+        assert count(User, None, 1) == 1
+        assert count(Task, 'a', 1) == 3
+        assert count(User, 'a', 1) == 1
+        assert count(Task, None, 2) == 1
+
+    # Same session, now served from the shard.
+    assert b'first task' in client.get('/').data
+    client.post('/1/comment', data={'comment': 'on shard a'})
+    with sharded.app_context():
+        with use_database(shard_bind('a')):
+            assert TaskComment.query.filter_by(content='on shard a').count() == 1
+            assert Task.query.filter_by(id=1).one().title == 'first task'
+
+    # And on to the next shard, leaving nothing behind.
+    sharded.test_cli_runner().invoke(args=['shard-move', '1', 'b'])
+    with sharded.app_context():
+        assert count(Task, 'a', 1) == 0
+        assert count(User, 'a', 1) == 0
+        with use_database(shard_bind('b')):
+            assert TaskComment.query.filter_by(content='on shard a').count() == 1
+    assert b'first task' in client.get('/').data
+
+
+def test_search_follows_the_tenant(sharded):
+    client = login(sharded)
+    sharded.test_cli_runner().invoke(args=['shard-move', '1', 'a'])
+
+    response = client.get('/search?q=first')
+    assert b'<mark>first</mark> task' in response.data
+
+
+def test_writes_refused_while_moving(sharded):
+    client = login(sharded)
+    with sharded.app_context():
+        db.session.get(Tenant, 1).moving_to = 'a'
+        db.session.commit()
+
+    assert client.get('/').status_code == 200
+    response = client.post('/1/comment', data={'comment': 'lost'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '60'
+
+
+def test_register_places_tenant_on_a_shard(sharded):
+    client = sharded.test_client()
+    client.environ_base['HTTP_X_FORWARDED_PROTO'] = 'https'
+    client.post('/auth/register', data={
+        'username': 'newcomer', 'password': 'secret', 'timezone': 'Europe/London',
+    })
+
+    with sharded.app_context():
+        tenant = Tenant.query.filter_by(name='newcomer_trial').one()
+        # Tenant 3 hashes to the second shard.
+        assert tenant.shard == 'b'
+        with use_database(shard_bind('b')):
+            assert db.session.get(Tenant, 3).timezone == 'Europe/London'
+            assert User.query.filter_by(username='newcomer').one().tenant_id == 3
+
+    client = login(sharded, 'newcomer', 'secret')
+    client.post('/create', data={'title': 'sharded task', 'body': '', 'due_date': ''})
+    assert b'sharded task' in client.get('/').data
+    with sharded.app_context():
+        assert count(Task, 'b', 3) == 1
+        assert count(Task, None, 3) == 0
+
+
+def test_settings_reach_the_directory(sharded):
+    client = login(sharded)
+    sharded.test_cli_runner().invoke(args=['shard-move', '1', 'a'])
+
+    client.post('/settings', data={'timezone': 'Europe/London'})
+
+    with sharded.app_context():
+        assert db.session.get(Tenant, 1).timezone == 'Europe/London'
+        with use_database(shard_bind('a')):
+            assert db.session.get(Tenant, 1).timezone == 'Europe/London'
+
+
+def test_sweep_runs_on_every_shard(sharded):
+    runner = sharded.test_cli_runner()
+    runner.invoke(args=['shard-move', '1', 'a'])
+    with sharded.app_context():
+        with use_database(shard_bind('a')):
+            db.session.get(Task, 1).due_date = datetime(2023, 6, 1)
+            db.session.commit()
+
+    result = runner.invoke(args=['sweep-overdue'])
+    assert 'Set 1 tasks to OVERDUE.' in result.output
+
+
+def test_reminders_run_per_shard(sharded):
+    sharded.config.update(
+        REMINDERS_ENABLED=True, MAIL_ENABLED=True,
+        REMINDER_LEAD_HOURS=72, REMINDER_HORIZON=5 * 86400,
+    )
+    due = datetime.combine(date.today() + timedelta(days=2), datetime.min.time())
+    runner = sharded.test_cli_runner()
+    runner.invoke(args=['shard-move', '1', 'a'])
+    with sharded.app_context():
+        with use_database(shard_bind('a')):
+            db.session.get(User, 1).username = 'test@example.com'
+            db.session.get(Task, 1).due_date = due
+            db.session.commit()
+
+    result = runner.invoke(args=['reminders', '--once'])
+    assert '0 reminders pending.' in result.output
+    with sharded.app_context():
+        assert MailOutbox.query.count() == 0
+
+    result = runner.invoke(args=['reminders', '--once', '--shard', 'a'])
+    assert result.exit_code == 0
+    with sharded.app_context():
+        with use_database(shard_bind('a')):
+            assert MailOutbox.query.one().recipient == 'test@example.com'
+            assert ReminderChange.query.count() == 0
+
+    result = runner.invoke(args=['reminders', '--once', '--shard', 'c'])
+    assert 'No shard c.' in result.output
+
+
+def test_search_reindex_per_shard(sharded):
+    runner = sharded.test_cli_runner()
+    runner.invoke(args=['shard-move', '1', 'a'])
+
+    assert 'Indexed 1 tasks.' in runner.invoke(args=['search-reindex']).output
+    result = runner.invoke(args=['search-reindex', '--shard', 'a'])
+    assert 'Indexed 3 tasks.' in result.output
+
+
+def test_plan_moves():
+    # Directory tenants are placed largest first on the lightest shard.
+    assert plan_moves({1: (None, 10), 2: (None, 7), 3: (None, 4)}, ('a', 'b')) == {
+        1: 'a', 2: 'b', 3: 'b',
+    }
+    # The tenant nearest half the gap moves; a balanced layout stays put.
+    tenants = {1: ('a', 50), 2: ('a', 30), 3: ('a', 20), 4: ('b', 10)}
+    assert plan_moves(tenants, ('a', 'b')) == {1: 'b'}
+    assert plan_moves({1: ('a', 5), 2: ('b', 5)}, ('a', 'b')) == {}
+    # New shards fill up.
+    assert plan_moves({1: ('a', 10), 2: ('a', 10)}, ('a', 'b')) == {1: 'b'}
+
+
+def test_rebalance(sharded):
+    runner = sharded.test_cli_runner()
+
+    result = runner.invoke(args=['shard-rebalance', '--dry-run'])
+    assert 'Tenant 1: 5 rows, directory -> a' in result.output
+    assert 'Tenant 2: 2 rows, directory -> b' in result.output
+    with sharded.app_context():
+        assert db.session.get(Tenant, 1).shard is None
+
+    result = runner.invoke(args=['shard-rebalance'])
+    assert 'Made 2 moves.' in result.output
+    with sharded.app_context():
+        assert [t.shard for t in Tenant.query.order_by(Tenant.id)] == ['a', 'b']
+    assert 'Made 0 moves.' in runner.invoke(args=['shard-rebalance']).output
+
+
+def test_sharding_is_off_by_default(app):
+    assert 'shards' not in app.extensions
+    result = app.test_cli_runner().invoke(args=['shard-rebalance'])
+    assert 'Set SHARD_DATABASE_URIS' in result.output
+
+
+def seed_tenants(path, first, count, tasks):
+    """Add count tenants, from id first, with a user and tasks each."""
+    if not count:
+        return
+    connection = sqlite3.connect(path)
+    connection.executescript(f'''
+        WITH RECURSIVE n(id) AS (SELECT {first} UNION ALL SELECT id + 1 FROM n
+                                 WHERE id < {first + count - 1})
+        INSERT INTO tenant (id, name, timezone) SELECT id, 'tenant ' || id, 'UTC' FROM n;
+        INSERT INTO user (id, tenant_id, username, password)
+        SELECT id, id, 'user ' || id, 'x' FROM tenant WHERE id >= {first};
+        WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < {tasks})
+        INSERT INTO task (tenant_id, author_id, created, title, status)
+        SELECT tenant.id, tenant.id, datetime('2023-01-01', '+' || i || ' minutes'),
+               'task ' || i, 'ACTIVE'
+        FROM tenant, n WHERE tenant.id >= {first};
+    ''')
+    connection.commit()
+    connection.close()
+
+
+def time_requests(client, requests=60):
+    start = time.perf_counter()
+    for n in range(requests):
+        if n % 4 == 0:
+            client.post('/1/comment', data={'comment': f'comment {n}'})
+        else:
+            client.get('/')
+    return (time.perf_counter() - start) / requests * 1000
+
+
+def time_vacuum(path):
+    connection = sqlite3.connect(path)
+    start = time.perf_counter()
+    connection.execute('VACUUM')
+    elapsed = (time.perf_counter() - start) * 1000
+    connection.close()
+    return elapsed
+
+
+@pytest.mark.benchmark
+def test_benchmark_tenant_growth(app):
+    """Tenant 1's request times, and the time to VACUUM its database, as
+    tenants with 2000 tasks each are added.
+
+    Unsharded they all share the directory's tables; sharded, each shard
+    holds 8 of them and tenant 1 has its shard to itself.
+    """
+    shared = app.config['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):]
+    directory = os.path.join(tempfile.mkdtemp(), 'directory.sqlite')
+    source, target = sqlite3.connect(shared), sqlite3.connect(directory)
+    source.backup(target)
+    source.close()
+    target.close()
+    names = [f's{n}' for n in range(9)]
+    sharded = sharded_app(app, names, 'sqlite:///' + directory)
+    client = login(sharded)
+    sharded.test_cli_runner().invoke(args=['shard-move', '1', 's0'])
+    # Cache placements, as in production.
+    sharded.extensions['shards'].move_wait = 5
+    plain = login(app)
+
+    results = []
+    added = 0
+    for tenants in (0, 16, 64):
+        for shard in range(added // 8, tenants // 8):
+            shard_path = sharded.config['SHARD_DATABASE_URIS'][names[shard + 1]][len('sqlite:///'):]
+            seed_tenants(shard_path, 100 + shard * 8, 8, 2000)
+        seed_tenants(shared, 100 + added, tenants - added, 2000)
+        added = tenants
+        for _ in range(2):
+            time_requests(client, 8)
+            time_requests(plain, 8)
+        results.append((
+            tenants,
+            time_requests(plain),
+            time_requests(client),
+            time_vacuum(shared),
+            time_vacuum(sharded.config['SHARD_DATABASE_URIS']['s0'][len('sqlite:///'):]),
+        ))
+
+    for tenants, plain_ms, sharded_ms, plain_vacuum, sharded_vacuum in results:
+        print(f"\n{tenants} other tenants: shared {plain_ms:.1f} ms per request, VACUUM "
+              f"{plain_vacuum:.0f} ms; sharded {sharded_ms:.1f} ms per request, VACUUM "
+              f"{sharded_vacuum:.0f} ms")
+    assert results[-1][2] < results[0][2] * 1.5
+    assert results[-1][4] < results[0][4] * 2
+    assert results[-1][3] > results[0][3] * 10
@@ -0,0 +1,154 @@
+import json
+import sqlite3
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+
+from web import db
+from web.models import TaskComment
+
+
+def test_connections_use_the_profile(app):
+    with app.app_context():
+        connection = db.engine.raw_connection()
+        pragmas = {
+            name: connection.execute(f'PRAGMA {name}').fetchone()[0]
+            for name in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size', 'cache_size')
+        }
+        connection.close()
+
+    # synchronous NORMAL is 1.
+    assert pragmas == {
+        'journal_mode': 'wal',
+        'synchronous': 1,
+        'busy_timeout': 5000,
+        'mmap_size': 256 * 2 ** 20,
+        'cache_size': -65536,
+    }
+
+
+def test_only_writes_begin_immediate(client, auth, statements):
+    auth.login()
+    client.get('/')
+
+    with statements:
+        client.get('/')
+    assert statements.begins == ['BEGIN DEFERRED']
+
+    with statements:
+        client.post('/1/comment', data={'comment': 'hello'})
+    assert statements.begins[0] == 'BEGIN IMMEDIATE'
+
+
+def test_commands_begin_immediate(app, runner, statements):
+    with statements:
+        runner.invoke(args=['sweep-overdue'])
+
+    assert 'BEGIN IMMEDIATE' in statements.begins
+
+
+def test_profile_can_be_disabled(app):
+    from web import create_app
+
+    other = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+        'SQLITE_PROFILE': False,
+        'METRICS_ENABLED': False,
+    })
+
+    assert 'sqlite_profile' in app.extensions
+    assert 'sqlite_profile' not in other.extensions
+
+
+# Each worker is a separate process, like a gunicorn worker.
+WORKER_SCRIPT = textwrap.dedent('''
+    import json, sys, time
+    from web import create_app
+
+    uri, profile, start_at, operations = sys.argv[1:]
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': uri,
+        'SECRET_KEY': 'mytestsecretkey',
+        'METRICS_ENABLED': False,
+        'SQLITE_PROFILE': profile == 'on',
+        'CELERY': {'broker_url': 'memory://', 'task_always_eager': True},
+    })
+    client = app.test_client()
+    client.environ_base['HTTP_X_FORWARDED_PROTO'] = 'https'
+    client.post('/auth/login', data={'username': 'test', 'password': 'test'})
+
+    time.sleep(max(0, float(start_at) - time.time()))
+    errors = []
+    start = time.perf_counter()
+    for n in range(int(operations)):
+        try:
+            # One write for every three reads.
+            if n % 4 == 0:
+                response = client.post('/1/comment', data={'comment': f'comment {n}'})
+            else:
+                response = client.get('/')
+            if response.status_code >= 500:
+                errors.append(str(response.status_code))
+        except Exception as e:
+            errors.append(str(e).splitlines()[0])
+    elapsed = time.perf_counter() - start
+    print(json.dumps({'elapsed': elapsed, 'errors': errors}))
+''')
+
+
+def run_workers(uri, profile, workers=8, operations=120):
+    start_at = time.time() + 3
+    processes = [
+        subprocess.Popen(
+            [sys.executable, '-c', WORKER_SCRIPT, uri, profile, str(start_at), str(operations)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+        for _ in range(workers)
+    ]
+    results = [json.loads(process.communicate()[0].splitlines()[-1]) for process in processes]
+    elapsed = max(result['elapsed'] for result in results)
+    errors = [error for result in results for error in result['errors']]
+    return workers * operations / elapsed, errors
+
+
+def test_concurrent_writers_wait_their_turn(app):
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    with app.app_context():
+        before = TaskComment.query.count()
+
+    errors = run_workers(uri, 'on', workers=3, operations=20)[1]
+
+    assert errors == []
+    with app.app_context():
+        assert TaskComment.query.count() - before == 3 * 20 // 4
+
+
+@pytest.mark.benchmark
+def test_concurrency_benchmark(app):
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    path = uri[len('sqlite:///'):]
+
+    with app.app_context():
+        before = TaskComment.query.count()
+    tuned_rate, tuned_errors = run_workers(uri, 'on')
+    with app.app_context():
+        written = TaskComment.query.count() - before
+        db.engine.dispose()
+
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA journal_mode = DELETE')
+    connection.close()
+    default_rate, default_errors = run_workers(uri, 'off')
+
+    print(f"\n8 workers, 1 write in 4: profile {tuned_rate:.0f} requests/s, "
+          f"{len(tuned_errors)} errors; pysqlite defaults {default_rate:.0f} requests/s, "
+          f"{len(default_errors)} errors {sorted(set(default_errors))[:2]}")
+    assert tuned_errors == []
+    assert written == 8 * 120 // 4
@@ -0,0 +1,106 @@
+from datetime import datetime
+
+import pytz
+from web import db
+from web.identity import identity_cache
+from web.models import SweepWatermark, Task, Tenant
+from web.sweeper import get_due_cutoff, sweep_overdue_tasks
+
+
+def add_task(task_id, tenant_id, due_date, status="ACTIVE"):
+    db.session.add(
+        Task(
+            id=task_id,
+            tenant_id=tenant_id,
+            author_id=tenant_id,
+            created=datetime(2023, 6, 1),
+            due_date=due_date,
+            title=f"task {task_id}",
+            status=status,
+        )
+    )
+
+
+def test_due_cutoff_uses_tenant_timezone(app):
+    now = datetime(2023, 6, 10, 20, 0, tzinfo=pytz.utc)
+
+    with app.app_context():
+        assert get_due_cutoff("UTC", now) == datetime(2023, 6, 11)
+        assert get_due_cutoff("Australia/Sydney", now) == datetime(2023, 6, 12)
+        assert get_due_cutoff("Not/AZone", now) == datetime(2023, 6, 11)
+
+
+def test_sweep_sets_active_tasks_overdue(app):
+    now = datetime(2023, 6, 10, 20, 0, tzinfo=pytz.utc)
+
+    with app.app_context():
+        db.session.get(Tenant, 2).timezone = "Australia/Sydney"
+        add_task(10, 1, datetime(2023, 6, 10))
+        add_task(11, 1, datetime(2023, 6, 11))
+        add_task(12, 2, datetime(2023, 6, 11))
+        add_task(13, 1, datetime(2023, 6, 1), status="DONE")
+        db.session.commit()
+
+        assert sweep_overdue_tasks(now) == 2
+        assert db.session.get(Task, 10).status == "OVERDUE"
+        assert db.session.get(Task, 11).status == "ACTIVE"
+        assert db.session.get(Task, 12).status == "OVERDUE"
+        assert db.session.get(Task, 13).status == "DONE"
+        assert db.session.get(SweepWatermark, "UTC").watermark == datetime(2023, 6, 11)
+
+
+def test_sweep_only_looks_past_watermark(app):
+    with app.app_context():
+        add_task(10, 1, datetime(2023, 6, 1))
+        db.session.commit()
+        sweep_overdue_tasks(datetime(2023, 6, 10, tzinfo=pytz.utc))
+
+        # Older than the watermark and its grace window, so not revisited.
+        db.session.get(Task, 10).status = "ACTIVE"
+        add_task(11, 1, datetime(2023, 6, 11))
+        db.session.commit()
+
+        assert sweep_overdue_tasks(datetime(2023, 6, 12, tzinfo=pytz.utc)) == 1
+        assert db.session.get(Task, 10).status == "ACTIVE"
+        assert db.session.get(Task, 11).status == "OVERDUE"
+
+
+def test_sweep_overdue_command(runner):
+    result = runner.invoke(args=["sweep-overdue"])
+    assert "tasks to OVERDUE" in result.output
+
+
+def count_login_statements(app, auth, statements, tasks):
+    with app.app_context():
+        db.session.execute(
+            Task.__table__.insert(),
+            [
+                {
+                    "tenant_id": 1,
+                    "author_id": 1,
+                    "created": datetime(2023, 6, 1),
+                    "due_date": datetime(2023, 6, 1),
+                    "title": "bulk",
+                    "status": "ACTIVE",
+                }
+                for _ in range(tasks)
+            ],
+        )
+        db.session.commit()
+
+    # Compare cold logins; a cached tenant would hide one statement.
+    identity_cache.clear()
+    with statements:
+        response = auth.login()
+
+    assert response.headers["Location"] == "/"
+    return list(statements.statements)
+
+
+def test_login_independent_of_task_count(app, auth, statements):
+    small = count_login_statements(app, auth, statements, 10)
+    auth.logout()
+    large = count_login_statements(app, auth, statements, 2000)
+
+    assert len(small) == len(large)
+    assert statements.touching("task") == []
@@ -0,0 +1,151 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+from flask import session
+
+from web import convert_utc_to_timezone, db
+from web.models import Tenant, User
+from web.timezones import get_zone, timezones
+
+
+def legacy_convert_utc_to_timezone(utc_time):
+    """The filter as it was before datetimes were passed in directly."""
+    user_timezone = pytz.timezone(session["timezone"])
+    utc_datetime = datetime.strptime(utc_time, '%Y-%m-%d %H:%M:%S')
+    utc_datetime = utc_datetime.replace(tzinfo=pytz.utc)
+    converted_time = utc_datetime.astimezone(user_timezone)
+    return converted_time.strftime("%d %B %Y %H:%M:%S")
+
+
+def test_convert_utc_to_timezone(app):
+    with app.test_request_context():
+        session['timezone'] = 'Australia/Sydney'
+
+        assert convert_utc_to_timezone(datetime(2023, 7, 1, 12, 30)) == (
+            '01 July 2023 22:30:00'
+        )
+        assert convert_utc_to_timezone('2023-01-01 12:30:00') == (
+            '01 January 2023 23:30:00'
+        )
+
+
+def test_unknown_timezone_falls_back_to_utc(app):
+    assert get_zone('Mars/Olympus_Mons') is pytz.utc
+    assert get_zone(None) is pytz.utc
+
+    with app.test_request_context():
+        assert convert_utc_to_timezone(datetime(2023, 7, 1, 12, 30)) == (
+            '01 July 2023 12:30:00'
+        )
+
+
+def render_filters(app, rows):
+    """Render rows through the legacy and current filters, with their times."""
+    app.jinja_env.filters['legacy'] = legacy_convert_utc_to_timezone
+    legacy = app.jinja_env.from_string(
+        '{% for created in rows %}'
+        '{{ created.strftime("%Y-%m-%d %H:%M:%S") | legacy }}'
+        '{% endfor %}'
+    )
+    current = app.jinja_env.from_string(
+        '{% for created in rows %}{{ created | convert_utc_to_timezone }}{% endfor %}'
+    )
+
+    with app.test_request_context():
+        session['timezone'] = 'Europe/London'
+
+        start = time.perf_counter()
+        legacy_html = legacy.render(rows=rows)
+        legacy_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        current_html = current.render(rows=rows)
+        current_elapsed = time.perf_counter() - start
+
+    assert current_html == legacy_html
+    return legacy_elapsed, current_elapsed
+
+
+def test_filter_matches_legacy(app):
+    # Every 13 hours for a year, across both DST changes.
+    render_filters(app, [datetime(2023, 1, 1) + timedelta(hours=13 * n) for n in range(700)])
+
+
+@pytest.mark.benchmark
+def test_filter_benchmark(app):
+    rows = [datetime(2023, 1, 1) + timedelta(minutes=17 * n) for n in range(10000)]
+    legacy_elapsed, current_elapsed = render_filters(app, rows)
+
+    print(f"10k rows: strftime/strptime filter {legacy_elapsed * 1000:.1f} ms, "
+          f"datetime filter {current_elapsed * 1000:.1f} ms")
+    assert current_elapsed < legacy_elapsed
+
+
+def test_registry_covers_iana_database():
+    assert len(timezones) == len(pytz.all_timezones)
+    assert 'America/Argentina/Buenos_Aires' in timezones
+    assert 'Mars/Olympus_Mons' not in timezones
+    assert timezones.canonical(' europe/london ') == 'Europe/London'
+    assert timezones.canonical(None) is None
+
+
+def test_registry_offsets_follow_dst():
+    assert timezones.utcoffset('Europe/London', datetime(2023, 1, 15)) == timedelta(0)
+    assert timezones.utcoffset('Europe/London', datetime(2023, 7, 15)) == timedelta(hours=1)
+    # Cached offsets are only reused inside the same transition window.
+    assert timezones.utcoffset('Europe/London', datetime(2023, 3, 26, 0, 59)) == timedelta(0)
+    assert timezones.utcoffset('Europe/London', datetime(2023, 3, 26, 1, 0)) == timedelta(hours=1)
+    assert timezones.utcoffset('Asia/Kolkata', datetime(2023, 7, 15)) == timedelta(hours=5, minutes=30)
+    assert timezones.label('America/St_Johns', datetime(2023, 1, 15)) == (
+        'America/St_Johns (UTC-03:30)'
+    )
+
+
+def test_registry_choices_hide_deprecated_aliases():
+    names = [name for name, label in timezones.choices()]
+
+    assert names == sorted(names)
+    assert 'Australia/Sydney' in names
+    assert 'Asia/Calcutta' not in names
+    assert 'Asia/Calcutta' in timezones
+
+
+def test_save_settings(client, auth, caplog):
+    auth.login()
+    caplog.clear()
+
+    response = client.post('/settings', data={'timezone': 'australia/sydney'})
+
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        assert session['timezone'] == 'Australia/Sydney'
+    assert 'Key is' not in caplog.text
+
+    page = client.get('/settings').get_data(as_text=True)
+    assert '<option value="Australia/Sydney" selected>' in page
+
+
+def test_save_settings_unknown_timezone(client, auth):
+    auth.login()
+
+    response = client.post('/settings', data={'timezone': 'Mars/Olympus_Mons'})
+
+    assert response.headers['Location'] == '/settings'
+    with client.session_transaction() as session:
+        assert session['timezone'] == 'UTC'
+
+
+def test_register_with_timezone(app, client):
+    page = client.get('/auth/register').get_data(as_text=True)
+    assert '<option value="UTC" selected>' in page
+
+    client.post(
+        '/auth/register',
+        data={'username': 'new', 'password': 'pw', 'timezone': 'Asia/Tokyo'},
+    )
+
+    with app.app_context():
+        user = User.query.filter_by(username='new').one()
+        assert db.session.get(Tenant, user.tenant_id).timezone == 'Asia/Tokyo'
@@ -1,6 +1,6 @@
 import os
 
-from flask import Flask, render_template, make_response, session
+from flask import Flask, g, render_template, make_response, session
 from dotenv import load_dotenv
 from flask_mail import Mail
 from logging.config import dictConfig
@@ -12,7 +12,9 @@ from datetime import datetime, timedelta
 from flask_talisman import Talisman
 from flask_paranoid import Paranoid
 
-db = SQLAlchemy()
+from .replica import RoutingSession
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 migrate = Migrate()
 mail = Mail()
 
@@ -21,22 +23,31 @@ import pytz
 from pytz import timezone
 import tzlocal 
 
-def convert_utc_to_timezone(utc_time):
-    # Get the timezone object
-    user_timezone = pytz.timezone(session["timezone"])
+from .timezones import get_zone
+
+DATETIME_FORMAT = "%d %B %Y %H:%M:%S"
+
+
+def get_session_zone():
+    """Return the tenant's zone, looked up once per request."""
+    if "session_zone" not in g:
+        g.session_zone = get_zone(session.get("timezone"))
+    return g.session_zone
+
 
-    # Convert the UTC time string to a datetime object
-    utc_datetime = datetime.strptime(utc_time, '%Y-%m-%d %H:%M:%S')
+def convert_utc_to_timezone(utc_time):
+    """Format a naive UTC datetime in the tenant's timezone.
 
-    # Set the UTC timezone to the datetime object
-    utc_datetime = utc_datetime.replace(tzinfo=pytz.utc)
+    Templates pass the datetime itself; the "%Y-%m-%d %H:%M:%S" strings
+    they used to pass are still accepted.
+    """
+    if isinstance(utc_time, str):
+        utc_time = datetime.strptime(utc_time, "%Y-%m-%d %H:%M:%S")
 
-    # Convert the UTC time to the provided timezone
-    converted_time = utc_datetime.astimezone(user_timezone)
+    converted_time = pytz.utc.localize(utc_time).astimezone(get_session_zone())
 
-    formatted_time = converted_time.strftime("%d %B %Y %H:%M:%S")
+    return converted_time.strftime(DATETIME_FORMAT)
 
-    return formatted_time
 
 def create_app(test_config=None):
     load_dotenv()
@@ -71,26 +82,81 @@ def create_app(test_config=None):
     else:
         app.logger.error("The SECRET_KEY environment variable needs to be set.")
 
+    from .shards import parse_shards
+
     app.config.from_mapping(
         SECRET_KEY=os.getenv("SECRET_KEY"),
         SQLALCHEMY_DATABASE_URI=os.getenv("SQLALCHEMY_DATABASE_URI")
         or "sqlite:////instance/web.sqlite",
-        # CELERY_BROKER_URL=os.getenv("CELERY_BROKER_URL"),
-        # CELERY_RESULT_BACKEND=os.getenv("CELERY_RESULT_BACKEND"),
+        TASK_PAGE_SIZE=int(os.getenv("TASK_PAGE_SIZE") or 50),
+        RESPONSE_CACHE=os.getenv("RESPONSE_CACHE") or "none",
+        RESPONSE_CACHE_TTL=int(os.getenv("RESPONSE_CACHE_TTL") or 300),
+        RESPONSE_CACHE_MAX_ENTRIES=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES") or 1024),
+        RESPONSE_CACHE_PATH=os.getenv("RESPONSE_CACHE_PATH"),
+        STATIC_MAX_AGE=int(os.getenv("STATIC_MAX_AGE") or 31536000),
+        METRICS_ENABLED=os.getenv("METRICS_ENABLED", "True") == "True",
+        METRICS_DIR=os.getenv("METRICS_DIR"),
+        METRICS_FLUSH_INTERVAL=float(os.getenv("METRICS_FLUSH_INTERVAL") or 5),
+        METRICS_TOKEN=os.getenv("METRICS_TOKEN"),
+        IDENTITY_CACHE_TTL=int(os.getenv("IDENTITY_CACHE_TTL") or 60),
+        IDENTITY_CACHE_MAX_ENTRIES=int(os.getenv("IDENTITY_CACHE_MAX_ENTRIES") or 4096),
+        CELERY=dict(
+            broker_url=os.getenv("CELERY_BROKER_URL"),
+            result_backend=os.getenv("CELERY_RESULT_BACKEND"),
+            task_ignore_result=True,
+            beat_schedule={
+                "sweep-overdue": {
+                    "task": "web.jobs.sweep_overdue",
+                    "schedule": float(os.getenv("SWEEP_INTERVAL") or 900),
+                },
+                "deliver-mail": {
+                    "task": "web.jobs.deliver_mail",
+                    "schedule": float(os.getenv("MAIL_DELIVERY_INTERVAL") or 60),
+                },
+            },
+        ),
+        JOB_MAX_RETRIES=int(os.getenv("JOB_MAX_RETRIES") or 5),
+        JOB_RETRY_BACKOFF_MAX=int(os.getenv("JOB_RETRY_BACKOFF_MAX") or 600),
         # DATABASE=os.path.join(app.instance_path, 'web.sqlite'),
-        # MAIL_SERVER = os.environ.get('MAIL_SERVER'),
-        # MAIL_PORT = int(os.environ.get('MAIL_PORT') or 25),
+        MAIL_ENABLED=os.environ.get("SMTP_ENABLED") == "True",
+        MAIL_SERVER=os.environ.get("MAIL_SERVER") or "localhost",
+        MAIL_PORT=int(os.environ.get("MAIL_PORT") or 25),
+        MAIL_USE_TLS=os.environ.get("MAIL_USE_TLS") == "True",
+        MAIL_USERNAME=os.environ.get("MAIL_USERNAME"),
+        MAIL_PASSWORD=os.environ.get("MAIL_PASSWORD"),
+        MAIL_DEFAULT_SENDER=os.environ.get("MAIL_DEFAULT_SENDER") or "taskmate@localhost",
+        MAIL_BATCH_SIZE=int(os.environ.get("MAIL_BATCH_SIZE") or 100),
+        MAIL_RATE_LIMIT=float(os.environ.get("MAIL_RATE_LIMIT") or 10),
+        MAIL_MAX_ATTEMPTS=int(os.environ.get("MAIL_MAX_ATTEMPTS") or 5),
+        MAIL_RETRY_BACKOFF=int(os.environ.get("MAIL_RETRY_BACKOFF") or 30),
+        REMINDERS_ENABLED=os.environ.get("REMINDERS_ENABLED") == "True",
+        REMINDER_LEAD_HOURS=int(os.environ.get("REMINDER_LEAD_HOURS") or 24),
+        REMINDER_HORIZON=int(os.environ.get("REMINDER_HORIZON") or 86400),
+        REMINDER_POLL_INTERVAL=int(os.environ.get("REMINDER_POLL_INTERVAL") or 30),
+        SEARCH_LIMIT=int(os.environ.get("SEARCH_LIMIT") or 20),
+        BULK_MAX_ITEMS=int(os.environ.get("BULK_MAX_ITEMS") or 500),
+        DB_POOL_SIZE=int(os.environ.get("DB_POOL_SIZE") or 2),
+        DB_MAX_OVERFLOW=int(os.environ.get("DB_MAX_OVERFLOW") or 3),
+        DB_POOL_TIMEOUT=float(os.environ.get("DB_POOL_TIMEOUT") or 30),
+        DB_POOL_RECYCLE=int(os.environ.get("DB_POOL_RECYCLE") or 1800),
+        DB_POOL_PRE_PING=os.environ.get("DB_POOL_PRE_PING", "True") == "True",
+        DB_PGBOUNCER=os.environ.get("DB_PGBOUNCER") == "True",
+        REPLICA_DATABASE_URI=os.environ.get("REPLICA_DATABASE_URI"),
+        REPLICA_MAX_LAG=float(os.environ.get("REPLICA_MAX_LAG") or 10),
+        REPLICA_CHECK_INTERVAL=float(os.environ.get("REPLICA_CHECK_INTERVAL") or 5),
+        REPLICA_LAG_QUERY=os.environ.get("REPLICA_LAG_QUERY"),
+        SHARD_DATABASE_URIS=parse_shards(os.environ.get("SHARD_DATABASE_URIS")),
+        SHARD_MOVE_WAIT=float(os.environ.get("SHARD_MOVE_WAIT") or 5),
+        SQLITE_PROFILE=os.environ.get("SQLITE_PROFILE", "True") == "True",
+        SQLITE_JOURNAL_MODE=os.environ.get("SQLITE_JOURNAL_MODE") or "WAL",
+        SQLITE_SYNCHRONOUS=os.environ.get("SQLITE_SYNCHRONOUS") or "NORMAL",
+        SQLITE_BUSY_TIMEOUT=int(os.environ.get("SQLITE_BUSY_TIMEOUT") or 5000),
+        SQLITE_MMAP_SIZE=int(os.environ.get("SQLITE_MMAP_SIZE") or 256 * 2**20),
+        SQLITE_CACHE_SIZE=int(os.environ.get("SQLITE_CACHE_SIZE") or -64 * 1024),
+        SQLITE_IMMEDIATE_WRITES=os.environ.get("SQLITE_IMMEDIATE_WRITES", "True") == "True",
         # ADMINS = ['your-email@example.com'],
     )
 
-    if os.environ.get("SMTP_ENABLED") == "True":
-        app.logger.info("SMTP is enabled.")
-        MAIL_SERVER = os.environ.get("MAIL_SERVER")
-        MAIL_PORT = int(os.environ.get("MAIL_PORT") or 25)
-        mail = Mail(app)
-    else:
-        app.logger.info("SMTP is not enabled.")
-
     app.logger.info("Using database at %s", app.config["SQLALCHEMY_DATABASE_URI"])
 
     if test_config is None:
@@ -106,16 +172,79 @@ def create_app(test_config=None):
     except OSError:
         pass
 
+    from .pool import pool_init_app
+    from .replica import replica_init_app
+    from .shards import shards_init_app
+
+    pool_init_app(app)
     db.init_app(app)
     migrate.init_app(app, db)
-    from . import models
+    replica_init_app(app)
+    shards_init_app(app)
+
+    from .sqlite import sqlite_init_app
+
+    sqlite_init_app(app)
+
+    if app.config["MAIL_ENABLED"]:
+        app.logger.info("SMTP is enabled.")
+    else:
+        app.logger.info("SMTP is not enabled.")
+    mail.init_app(app)
+
+    from .cache import cache
+
+    cache.init_app(app)
 
-    # mail = Mail(app)
+    from .assets import assets
+
+    assets.init_app(app)
+
+    # Registered before the blueprints so their request hooks are timed too.
+    from .metrics import metrics
+
+    metrics.init_app(app)
+
+    from .identity import identity_cache
+
+    identity_cache.init_app(app)
+
+    from .jobs import celery_init_app
+
+    celery_init_app(app)
+    from . import models
 
     from . import auth
 
     app.register_blueprint(auth.bp)
 
+    from . import sweeper
+
+    app.cli.add_command(sweeper.sweep_overdue_command)
+
+    from . import reminders
+
+    app.cli.add_command(reminders.reminders_command)
+
+    from . import search
+
+    app.cli.add_command(search.search_reindex_command)
+
+    from . import backup
+
+    app.cli.add_command(backup.tenant_dump_command)
+    app.cli.add_command(backup.tenant_restore_command)
+
+    from . import shards
+
+    app.cli.add_command(shards.shard_move_command)
+    app.cli.add_command(shards.shard_rebalance_command)
+    app.cli.add_command(shards.shard_upgrade_command)
+
+    from . import partitioning
+
+    app.cli.add_command(partitioning.partition_copy_command)
+
     @app.route("/sitemap.xml", methods=["GET"])
     def sitemap():
         try:
@@ -141,6 +270,10 @@ def create_app(test_config=None):
     app.register_blueprint(landing.bp)
     app.add_url_rule("/", endpoint="index")
 
+    from . import export
+
+    app.register_blueprint(export.bp)
+
     Talisman(app, content_security_policy=None)
     csrf = SeaSurf(app)
 
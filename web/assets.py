@@ -0,0 +1,87 @@
+import hashlib
+import os
+
+from flask import request
+
+
+class StaticFingerprints(object):
+    """Versions static URLs by content so browsers can cache them for good.
+
+    ``url_for('static', filename=...)`` gains a ``v`` query argument holding
+    a digest of the file. Requests carrying the current digest are served
+    with a long-lived immutable Cache-Control; a changed file gets a new URL.
+    """
+
+    def __init__(self, app=None):
+        self.release = None
+        self._digests = {}
+        self._static_folder = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._static_folder = app.static_folder
+        self._digests = {}
+        self.max_age = app.config.get("STATIC_MAX_AGE", 31536000)
+
+        app.url_defaults(self.add_fingerprint)
+        app.after_request(self.set_cache_headers)
+        app.extensions["static_fingerprints"] = self
+
+        # Digest of everything that shapes a rendered page besides the data,
+        # so HTML validators change on every deploy.
+        self.release = self._digest_tree(
+            os.path.join(app.root_path, app.template_folder), self._static_folder
+        )
+
+    def fingerprint(self, filename):
+        path = os.path.join(self._static_folder, filename)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+
+        cached = self._digests.get(filename)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, self._digest_file(path))
+            self._digests[filename] = cached
+        return cached[1]
+
+    def add_fingerprint(self, endpoint, values):
+        if endpoint != "static" or "filename" not in values:
+            return
+
+        fingerprint = self.fingerprint(values["filename"])
+        if fingerprint is not None:
+            values.setdefault("v", fingerprint)
+
+    def set_cache_headers(self, response):
+        if request.endpoint != "static" or response.status_code not in (200, 304):
+            return response
+
+        version = request.args.get("v")
+        filename = (request.view_args or {}).get("filename")
+        if version and filename and version == self.fingerprint(filename):
+            response.headers["Cache-Control"] = (
+                f"public, max-age={self.max_age}, immutable"
+            )
+        return response
+
+    @staticmethod
+    def _digest_file(path):
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()[:12]
+
+    def _digest_tree(self, *folders):
+        digest = hashlib.sha256()
+        for folder in folders:
+            for root, dirs, files in os.walk(folder):
+                dirs.sort()
+                for name in sorted(files):
+                    path = os.path.join(root, name)
+                    digest.update(os.path.relpath(path, folder).encode())
+                    digest.update(self._digest_file(path).encode())
+        return digest.hexdigest()[:12]
+
+
+assets = StaticFingerprints()
@@ -1,6 +1,4 @@
 import functools
-from datetime import date, datetime
-from pytz import timezone
 
 from flask import (
     Blueprint,
@@ -17,8 +15,10 @@ from werkzeug.security import check_password_hash, generate_password_hash
 
 from . import db
 from . import convert_utc_to_timezone
-from .models import User, Tenant, Task
-from .timezones import get_timezones, get_gmt
+from .identity import identity_cache
+from .models import User, Tenant
+from .shards import place_tenant
+from .timezones import timezones
 
 bp = Blueprint("auth", __name__, url_prefix="/auth")
 
@@ -27,43 +27,15 @@ def get_current_tenant_id():
     return session.get("tenant_id")
 
 
-# Check expired tasks on user login
-def check_for_expired_tasks():
-    tz = session.get("timezone")
-
-    if tz is not None:
-
-        today = datetime.now(timezone("UTC")).date()
-
-        tenants = db.session.query(Tenant).all()
-
-        for tenant in tenants:
-            tasks = db.session.query(Task).filter(Task.tenant_id == tenant.id).all()
-
-            for task in tasks:
-                if (
-                    task.status != "OVERDUE"
-                    and task.due_date
-                    and task.due_date.date() <= today
-                ):
-                    task.status = "OVERDUE"
-
-                    current_app.logger.info(
-                        "Task Check set task [id] %s in tenancy [id] %s to OVERDUE",
-                        task.id,
-                        tenant.id,
-                    )
-
-            db.session.commit()
-        db.session.commit()
-    else:
-        current_app.logger.info("GMT is none")
-
-
 @bp.before_app_request
 def set_current_tenant():
     g.tenant_id = get_current_tenant_id()
 
+    # Logging in and registering read the directory; static files no database.
+    shards = current_app.extensions.get("shards")
+    if shards is not None and request.blueprint != "auth" and request.endpoint != "static":
+        g.shard = shards.route(g.tenant_id)
+
 
 @bp.route("/register", methods=("GET", "POST"))
 def register():
@@ -83,9 +55,8 @@ def register():
         # elif not tenant_name:
         #     error = 'Tenant name is required.'
 
-        if timezone in get_timezones():
-            tenant_timezone = get_gmt(timezone)
-        else:
+        tenant_timezone = timezones.canonical(timezone)
+        if tenant_timezone is None:
             error = f"Timezone {timezone} is not a displayed choice."
 
         user = User.query.filter_by(username=username).first()
@@ -119,6 +90,7 @@ def register():
                 )
                 db.session.add(new_user)
                 db.session.commit()
+                place_tenant(new_tenancy.id)
             except db.IntegrityError:
                 current_app.logger.info("User %s is already registered.", username)
                 error = f"User {username} is already registered."
@@ -128,7 +100,7 @@ def register():
 
         flash(error)
 
-    return render_template("auth/register.html", timezones=get_timezones())
+    return render_template("auth/register.html", timezones=timezones.choices())
 
 
 @bp.route("/login", methods=("GET", "POST"))
@@ -167,7 +139,7 @@ def login():
             request.headers.get('X-Client-IP'),
         )
         if error is None:
-            tenancy = Tenant.query.filter_by(id=user.tenant_id).first()
+            tenancy = identity_cache.get_tenant(user.tenant_id)
             session.clear()
             session["user_id"] = user.id
             session["username"] = username
@@ -180,7 +152,6 @@ def login():
                 username,
                 tenancy.timezone,
             )
-            check_for_expired_tasks()
             return redirect(url_for("index"))
 
         flash(error)
@@ -193,12 +164,11 @@ def load_logged_in_user():
     user_id = session.get("user_id")
     tenant_id = session.get("tenant_id")
 
-    if user_id is None:
+    # Static files never need the user.
+    if user_id is None or request.endpoint == "static":
         g.user = None
     else:
-        g.user = User.query.filter(
-            User.id == user_id, User.tenant_id == tenant_id
-        ).first()
+        g.user = identity_cache.get_user(user_id, tenant_id)
 
 
 @bp.route("/logout")
@@ -0,0 +1,336 @@
+import gzip
+import io
+import json
+import time
+from datetime import datetime
+from itertools import islice
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import func, select, text
+
+from . import db
+from .models import Task, TaskComment, Tenant, User
+from .reminders import chunks, record_tenant_changes
+from .search import rebuild_index
+
+DUMP_FORMAT = "taskmate-tenant"
+DUMP_VERSION = 1
+# Rows fetched per round trip when dumping, and sent per executemany or COPY
+# when restoring.
+BATCH_SIZE = 10000
+# zlib's default level; higher levels cost far more time than they save space.
+COMPRESS_LEVEL = 6
+# The format SQLAlchemy stores DateTime in on SQLite, and PostgreSQL parses.
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+# Dumped and restored in this order, so rows only reference rows restored
+# before them. tenant_id is implied by the dump; each table's id and the
+# foreign keys listed with the table they reference are remapped on restore.
+TABLES = (
+    (User, ("id", "username", "password"), {}),
+    (
+        Task,
+        ("id", "author_id", "created", "due_date", "title", "status", "body"),
+        {"author_id": "user"},
+    ),
+    (TaskComment, ("id", "task_id", "created", "content"), {"task_id": "task"}),
+)
+
+
+def encode_value(value):
+    if isinstance(value, datetime):
+        return value.strftime(DATETIME_FORMAT)
+    raise TypeError(f"Cannot dump a {type(value).__name__}.")
+
+
+encoder = json.JSONEncoder(
+    ensure_ascii=False, separators=(",", ":"), default=encode_value
+)
+
+
+def write_line(out, value):
+    out.write(encoder.encode(value) + "\n")
+
+
+def begin_snapshot():
+    """Read the rest of the transaction from one snapshot of the database.
+
+    Call it before any other query, so a task deleted during a dump cannot
+    leave its comments behind without it.
+    """
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        db.session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+    elif dialect == "sqlite":
+        # A deferred transaction does not block writers while the dump runs.
+        connection = db.session.connection(execution_options={"sqlite_begin": "DEFERRED"})
+        # Without the SQLite profile, pysqlite only begins before a write.
+        if not connection.connection.in_transaction:
+            connection.exec_driver_sql("BEGIN")
+
+
+def find_tenant(name_or_id):
+    tenant = Tenant.query.filter_by(name=name_or_id).one_or_none()
+    if tenant is None and name_or_id.isdigit():
+        tenant = db.session.get(Tenant, int(name_or_id))
+    if tenant is None:
+        raise click.ClickException(f"No tenant {name_or_id}.")
+    return tenant
+
+
+def tenant_stats(tenant_id):
+    """Return {table name: (count, min id, max id)} for the tenant's rows."""
+    return {
+        model.__tablename__: tuple(
+            db.session.execute(
+                select(func.count(), func.min(model.id), func.max(model.id)).where(
+                    model.tenant_id == tenant_id
+                )
+            ).one()
+        )
+        for model, _, _ in TABLES
+    }
+
+
+def dump_tenant(tenant, stats, out, progress=None):
+    """Write the tenant and its rows to out as JSON lines.
+
+    A header line describes the tenant, then each table has a line with its
+    columns and row count followed by one JSON array per row, and an end
+    line marks a complete dump.
+    """
+    write_line(
+        out,
+        {
+            "format": DUMP_FORMAT,
+            "version": DUMP_VERSION,
+            "tenant": {"id": tenant.id, "name": tenant.name, "timezone": tenant.timezone},
+            "rows": sum(count for count, _, _ in stats.values()),
+        },
+    )
+    for model, columns, _ in TABLES:
+        count, min_id, max_id = stats[model.__tablename__]
+        write_line(
+            out,
+            {
+                "table": model.__tablename__,
+                "columns": columns,
+                "count": count,
+                "min_id": min_id,
+                "max_id": max_id,
+            },
+        )
+        query = (
+            select(*(getattr(model, column) for column in columns))
+            .where(model.tenant_id == tenant.id)
+            .execution_options(yield_per=BATCH_SIZE)
+        )
+        for rows in db.session.execute(query).partitions():
+            out.write("".join(encoder.encode(tuple(row)) + "\n" for row in rows))
+            if progress is not None:
+                progress(len(rows))
+    write_line(out, {"end": True})
+
+
+def copy_value(value):
+    """Format value for COPY ... FROM STDIN in PostgreSQL's text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, str):
+        return (
+            value.replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r")
+        )
+    return str(value)
+
+
+def copy_rows(connection, table, columns, rows):
+    """Load rows with one COPY, the fastest way into PostgreSQL."""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(map(copy_value, row)))
+        buffer.write("\n")
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN", buffer)
+    finally:
+        cursor.close()
+
+
+def executemany_rows(connection, table, columns, rows):
+    """Insert rows with one executemany, bypassing SQLAlchemy's type handling.
+
+    The dump already holds every value in the form the database stores.
+    """
+    placeholder = "?" if connection.dialect.paramstyle == "qmark" else "%s"
+    values = ", ".join([placeholder] * len(rows[0]))
+    connection.exec_driver_sql(
+        f"INSERT INTO {table} ({columns}) VALUES ({values})", rows
+    )
+
+
+def read_header(lines):
+    header = next(lines, None)
+    if not isinstance(header, dict) or header.get("format") != DUMP_FORMAT:
+        raise click.ClickException("Not a tenant dump.")
+    if header.get("version") != DUMP_VERSION:
+        raise click.ClickException(f"Unsupported dump version {header.get('version')}.")
+    return header
+
+
+def check_usernames(names):
+    for chunk in chunks(names):
+        taken = db.session.execute(
+            select(User.username).where(User.username.in_(chunk)).limit(1)
+        ).scalar()
+        if taken is not None:
+            raise click.ClickException(f"User {taken} already exists.")
+
+
+def restore_tenant(header, lines, name=None, progress=None, tenant=None, keep_ids=()):
+    """Insert a dumped tenant under new ids, in one transaction.
+
+    Each table's ids are shifted past the largest id already in the table,
+    and foreign keys by the offset of the table they reference, so nothing
+    collides with existing rows. Tables named in keep_ids keep the dumped
+    ids instead. Pass tenant to restore into a tenant already added to the
+    session. The caller commits or rolls back.
+    """
+    if tenant is None:
+        name = name or header["tenant"]["name"]
+        if Tenant.query.filter_by(name=name).first() is not None:
+            raise click.ClickException(
+                f"Tenant {name} already exists; restore it under another --name."
+            )
+        tenant = Tenant(name=name, timezone=header["tenant"]["timezone"])
+        db.session.add(tenant)
+    # On SQLite this write also takes the database's write lock, so the
+    # largest ids read below stay the largest until commit.
+    db.session.flush()
+
+    connection = db.session.connection()
+    postgres = connection.dialect.name == "postgresql"
+    quote = connection.dialect.identifier_preparer.quote
+    tables = ", ".join(quote(model.__tablename__) for model, _, _ in TABLES)
+    if postgres:
+        connection.exec_driver_sql(f"LOCK TABLE {tables} IN SHARE ROW EXCLUSIVE MODE")
+    insert_rows = copy_rows if postgres else executemany_rows
+
+    offsets = {}
+    for model, columns, references in TABLES:
+        table = next(lines, None)
+        if not isinstance(table, dict) or table.get("table") != model.__tablename__:
+            raise click.ClickException(f"Expected the {model.__tablename__} table.")
+        if table["columns"] != list(columns):
+            raise click.ClickException(f"Unexpected columns for {table['table']}.")
+
+        if table["table"] in keep_ids:
+            offset = offsets[table["table"]] = 0
+        else:
+            largest = db.session.query(func.max(model.id)).scalar() or 0
+            offset = offsets[table["table"]] = largest + 1 - (table["min_id"] or 0)
+        remaps = [
+            (columns.index(column), offsets[target])
+            for column, target in references.items()
+        ]
+        target = quote(table["table"])
+        names = ", ".join(map(quote, ("tenant_id",) + columns))
+
+        remaining = table["count"]
+        while remaining:
+            batch = list(islice(lines, min(BATCH_SIZE, remaining)))
+            if not batch or not all(isinstance(row, list) for row in batch):
+                raise click.ClickException("The dump is truncated.")
+            rows = []
+            for row in batch:
+                row[0] += offset
+                for index, shift in remaps:
+                    if row[index] is not None:
+                        row[index] += shift
+                rows.append((tenant.id, *row))
+            if model is User:
+                check_usernames([row[1] for row in batch])
+            insert_rows(connection, target, names, rows)
+            remaining -= len(batch)
+            if progress is not None:
+                progress(len(batch))
+
+    if next(lines, None) != {"end": True}:
+        raise click.ClickException("The dump is truncated.")
+
+    if postgres:
+        # COPY does not advance the id sequences.
+        for model, _, _ in TABLES:
+            connection.execute(
+                text(
+                    "SELECT setval(pg_get_serial_sequence(:table, 'id'), max(id)) "
+                    f"FROM {quote(model.__tablename__)}"
+                ),
+                {"table": quote(model.__tablename__)},
+            )
+    rebuild_index(tenant.id, commit=False)
+    record_tenant_changes(tenant.id)
+    return tenant
+
+
+@click.command("tenant-dump")
+@click.argument("tenant")
+@click.argument("path", type=click.Path(dir_okay=False, writable=True))
+@with_appcontext
+def tenant_dump_command(tenant, path):
+    """Write TENANT (a name or id) with its users, tasks and comments to PATH.
+
+    PATH is gzip compressed JSON lines, read back by tenant-restore.
+    """
+    start = time.perf_counter()
+    begin_snapshot()
+    try:
+        tenant = find_tenant(tenant)
+        stats = tenant_stats(tenant.id)
+        total = sum(count for count, _, _ in stats.values())
+        with gzip.open(
+            path, "wt", encoding="utf-8", compresslevel=COMPRESS_LEVEL
+        ) as out, click.progressbar(length=total, label=f"Dumping {tenant.name}") as bar:
+            dump_tenant(tenant, stats, out, bar.update)
+    finally:
+        db.session.rollback()
+
+    elapsed = time.perf_counter() - start
+    current_app.logger.info("Dumped tenant %s, %s rows in %.1f s.", tenant.id, total, elapsed)
+    click.echo(f"Dumped {total} rows in {elapsed:.1f} s.")
+
+
+@click.command("tenant-restore")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--name", help="Restore under this tenant name instead of the dumped one.")
+@with_appcontext
+def tenant_restore_command(path, name):
+    """Insert the tenant dumped to PATH, with new ids."""
+    start = time.perf_counter()
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            lines = map(json.loads, file)
+            header = read_header(lines)
+            with click.progressbar(length=header["rows"], label="Restoring") as bar:
+                tenant = restore_tenant(header, lines, name, bar.update)
+        db.session.commit()
+    except (OSError, EOFError, ValueError) as e:
+        db.session.rollback()
+        raise click.ClickException(f"Cannot read {path}: {e}")
+    except Exception:
+        db.session.rollback()
+        raise
+
+    elapsed = time.perf_counter() - start
+    current_app.logger.info(
+        "Restored tenant %s, %s rows in %.1f s.", tenant.id, header["rows"], elapsed
+    )
+    click.echo(
+        f"Restored {header['rows']} rows as tenant {tenant.name} ({tenant.id}) "
+        f"in {elapsed:.1f} s."
+    )
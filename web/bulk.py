@@ -0,0 +1,165 @@
+from datetime import date, datetime
+from typing import NamedTuple
+
+import pytz
+from flask import current_app, g
+from sqlalchemy import delete, update
+
+from . import db
+from .models import Task, TaskComment
+from .reminders import record_change, record_changes
+from .search import mark_changed
+
+BULK_MAX_ITEMS = 500
+
+
+class BulkError(ValueError):
+    """A bulk request that was rejected before anything was written."""
+
+    def __init__(self, errors):
+        super().__init__("; ".join(error["error"] for error in errors))
+        self.errors = errors
+
+
+class BulkResult(NamedTuple):
+    """Ids a bulk operation changed, and requested ids it could not find."""
+
+    ids: tuple
+    not_found: tuple = ()
+
+
+def get_max_items():
+    return current_app.config.get("BULK_MAX_ITEMS", BULK_MAX_ITEMS)
+
+
+def parse_ids(ids):
+    """Validate a list of task ids, dropping duplicates but keeping order."""
+    if not isinstance(ids, list) or not ids:
+        raise BulkError([{"error": "ids must be a non-empty list."}])
+    if len(ids) > get_max_items():
+        raise BulkError([{"error": f"At most {get_max_items()} ids per request."}])
+    if not all(isinstance(id, int) and not isinstance(id, bool) for id in ids):
+        raise BulkError([{"error": "ids must be integers."}])
+    return tuple(dict.fromkeys(ids))
+
+
+def owned_tasks(ids):
+    """Return {id: status} for the ids the current user owns, in one query."""
+    return dict(
+        Task.query.with_entities(Task.id, Task.status).filter(
+            Task.id.in_(ids),
+            Task.tenant_id == g.get("tenant_id"),
+            Task.author_id == g.user.id,
+        )
+    )
+
+
+def parse_task(index, payload, today):
+    if not isinstance(payload, dict):
+        raise BulkError([{"index": index, "error": "Task must be an object."}])
+
+    title = payload.get("title")
+    body = payload.get("body") or None
+    due_date = payload.get("due_date") or None
+    if not isinstance(title, str) or not title.strip():
+        raise BulkError([{"index": index, "error": "Title is required."}])
+    if body is not None and not isinstance(body, str):
+        raise BulkError([{"index": index, "error": "Body must be a string."}])
+
+    status = "ACTIVE"
+    if due_date is not None:
+        try:
+            due_date = datetime.strptime(due_date, "%Y-%m-%d").date()
+        except (TypeError, ValueError):
+            raise BulkError(
+                [{"index": index, "error": "Invalid due date format. Please use YYYY-MM-DD."}]
+            )
+        if due_date <= today:
+            status = "OVERDUE"
+
+    return {"title": title, "body": body, "due_date": due_date, "status": status}
+
+
+def bulk_create(payloads):
+    """Insert every task in payloads, or none of them if any is invalid.
+
+    The rows are flushed together, which the PostgreSQL driver sends as one
+    batched INSERT ... RETURNING. Bulk created tasks do not send the new task
+    email.
+    """
+    if not isinstance(payloads, list) or not payloads:
+        raise BulkError([{"error": "tasks must be a non-empty list."}])
+    if len(payloads) > get_max_items():
+        raise BulkError([{"error": f"At most {get_max_items()} tasks per request."}])
+
+    today = date.today()
+    errors = []
+    rows = []
+    for index, payload in enumerate(payloads):
+        try:
+            rows.append(parse_task(index, payload, today))
+        except BulkError as e:
+            errors.extend(e.errors)
+    if errors:
+        raise BulkError(errors)
+
+    created = datetime.now(pytz.utc)
+    tasks = [
+        Task(author_id=g.user.id, tenant_id=g.get("tenant_id"), created=created, **row)
+        for row in rows
+    ]
+    db.session.add_all(tasks)
+    db.session.flush()
+    for task in tasks:
+        record_change(task)
+    db.session.commit()
+
+    current_app.logger.info("Bulk created %s tasks.", len(tasks))
+    return BulkResult(tuple(task.id for task in tasks))
+
+
+def bulk_move_done(ids):
+    """Set the user's tasks among ids to DONE with one UPDATE."""
+    ids = parse_ids(ids)
+    owned = owned_tasks(ids)
+    changed = tuple(id for id in ids if owned.get(id) not in (None, "DONE"))
+
+    if changed:
+        db.session.execute(
+            update(Task)
+            .where(Task.id.in_(changed), Task.tenant_id == g.get("tenant_id"))
+            .values(status="DONE")
+            .execution_options(synchronize_session=False)
+        )
+        record_changes(changed)
+        db.session.commit()
+
+    current_app.logger.info("Bulk moved %s tasks to DONE.", len(changed))
+    return BulkResult(changed, tuple(id for id in ids if id not in owned))
+
+
+def bulk_delete(ids):
+    """Delete the user's tasks among ids, and their comments, in one transaction."""
+    ids = parse_ids(ids)
+    owned = owned_tasks(ids)
+    deleted = tuple(id for id in ids if id in owned)
+
+    if deleted:
+        tenant_id = g.get("tenant_id")
+        # SQLite only cascades with foreign keys enabled, so do it here.
+        db.session.execute(
+            delete(TaskComment)
+            .where(TaskComment.task_id.in_(deleted), TaskComment.tenant_id == tenant_id)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.execute(
+            delete(Task)
+            .where(Task.id.in_(deleted), Task.tenant_id == tenant_id)
+            .execution_options(synchronize_session=False)
+        )
+        record_changes(deleted)
+        mark_changed(deleted, tenant_id)
+        db.session.commit()
+
+    current_app.logger.info("Bulk deleted %s tasks.", len(deleted))
+    return BulkResult(deleted, tuple(id for id in ids if id not in owned))
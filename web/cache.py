@@ -0,0 +1,340 @@
+import functools
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, make_response, request, session
+
+from .assets import assets
+
+
+class MemoryBackend(object):
+    """Per-process LRU cache with a TTL on every entry.
+
+    Versions live in the same process, so writes handled by one gunicorn
+    worker are not seen by the others until their entries expire. Use the
+    sqlite backend when running more than one worker.
+    """
+
+    # Versions restart at 0 in every process, so they cannot back an ETag.
+    shared = False
+
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_version(self, tenant_id):
+        return self._versions.get(tenant_id, 0)
+
+    def bump_version(self, tenant_id):
+        with self._lock:
+            self._versions[tenant_id] = self._versions.get(tenant_id, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteBackend(object):
+    """Cache stored in a local SQLite file shared by every worker process.
+
+    Tenant versions are kept in the same file, so a write in one worker
+    invalidates the cached pages of every other worker immediately.
+    """
+
+    shared = True
+
+    def __init__(self, path, max_entries=1024, ttl=300):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entry ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS ix_cache_entry_expires "
+                "ON cache_entry (expires)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache_version ("
+                "tenant_id INTEGER PRIMARY KEY, version INTEGER NOT NULL)"
+            )
+
+    def _connect(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        row = (
+            self._connect()
+            .execute(
+                "SELECT value FROM cache_entry WHERE key = ? AND expires >= ?",
+                (key, time.time()),
+            )
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def set(self, key, value):
+        connection = self._connect()
+        connection.execute(
+            "INSERT OR REPLACE INTO cache_entry (key, value, expires) VALUES (?, ?, ?)",
+            (key, value, time.time() + self.ttl),
+        )
+
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._prune(connection)
+
+    def _prune(self, connection):
+        connection.execute("DELETE FROM cache_entry WHERE expires < ?", (time.time(),))
+        # Entries are written with a fixed TTL, so the soonest to expire are
+        # also the least recently written.
+        connection.execute(
+            "DELETE FROM cache_entry WHERE key IN ("
+            "SELECT key FROM cache_entry ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def get_version(self, tenant_id):
+        row = (
+            self._connect()
+            .execute(
+                "SELECT version FROM cache_version WHERE tenant_id = ?", (tenant_id,)
+            )
+            .fetchone()
+        )
+        return row[0] if row else 0
+
+    def bump_version(self, tenant_id):
+        self._connect().execute(
+            "INSERT INTO cache_version (tenant_id, version) VALUES (?, 1) "
+            "ON CONFLICT(tenant_id) DO UPDATE SET version = version + 1",
+            (tenant_id,),
+        )
+
+    def clear(self):
+        self._connect().execute("DELETE FROM cache_entry")
+
+
+class ResponseCache(object):
+    """Caches rendered pages per tenant, user, view and device class.
+
+    Every key is stamped with the tenant's data version, so bumping the
+    version after a write makes all of that tenant's cached pages unreachable.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config.get("RESPONSE_CACHE", "none")
+        max_entries = app.config.get("RESPONSE_CACHE_MAX_ENTRIES", 1024)
+        ttl = app.config.get("RESPONSE_CACHE_TTL", 300)
+
+        if backend == "memory":
+            self.backend = MemoryBackend(max_entries, ttl)
+        elif backend == "sqlite":
+            path = app.config.get("RESPONSE_CACHE_PATH") or os.path.join(
+                app.instance_path, "cache.sqlite"
+            )
+            self.backend = SQLiteBackend(path, max_entries, ttl)
+        elif backend == "none":
+            self.backend = None
+        else:
+            raise ValueError(f"Unknown RESPONSE_CACHE backend {backend}.")
+
+        self.hits = 0
+        self.misses = 0
+        app.extensions["response_cache"] = self
+        app.logger.info("Response cache backend is %s.", backend)
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    @property
+    def validates(self):
+        """Whether every worker sees the same versions, as ETags need."""
+        return self.enabled and self.backend.shared
+
+    def make_key(self, tenant_id, user_id, view, device):
+        version = self.backend.get_version(tenant_id)
+        return f"view:{tenant_id}:{user_id}:{view}:{device}:{version}"
+
+    def make_etag(self, view, device, args):
+        """Strong validator for a page, derived from the tenant's data version.
+
+        Besides the data version the page depends on the user, the device
+        class, the viewed task, the query string, the session timezone used
+        by the date filters and the deployed templates and static files.
+        """
+        parts = (
+            assets.release,
+            g.tenant_id,
+            self.backend.get_version(g.tenant_id),
+            g.user.id,
+            view,
+            device,
+            sorted(args.items()),
+            request.query_string,
+            session.get("timezone"),
+        )
+        return hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
+
+    def get(self, key):
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value)
+
+    def get_version(self, tenant_id):
+        if not self.enabled:
+            return 0
+        return self.backend.get_version(tenant_id)
+
+    def bump_version(self, tenant_id):
+        if self.enabled and tenant_id is not None:
+            self.backend.bump_version(tenant_id)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+cache = ResponseCache()
+
+
+def cached_view(name, device_class):
+    """Serve a GET view from the response cache when nothing has changed.
+
+    Only whole-page GETs of a logged in user are cached. Views re-rendered
+    from a POST handler, or with a flashed message pending, always render.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped_view(*args, **kwargs):
+            if (
+                not cache.enabled
+                or request.method != "GET"
+                or args
+                or kwargs.get("id") is not None
+                or g.get("user") is None
+                or g.get("tenant_id") is None
+                or "_flashes" in session
+            ):
+                return view(*args, **kwargs)
+
+            key = cache.make_key(g.tenant_id, g.user.id, name, device_class())
+            body = cache.get(key)
+            if body is not None:
+                return body
+
+            body = view(**kwargs)
+            if isinstance(body, str):
+                cache.set(key, body)
+            return body
+
+        return wrapped_view
+
+    return decorator
+
+
+def conditional_view(name, device_class):
+    """Answer a repeated GET with 304 Not Modified while the page is unchanged.
+
+    Validators come from the tenant's data version, so a matching
+    If-None-Match is answered before any query runs or template renders.
+    Needs the sqlite backend: with per-process versions a worker that missed
+    a write would keep answering 304.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped_view(*args, **kwargs):
+            if (
+                not cache.validates
+                or request.method != "GET"
+                or args
+                or g.get("user") is None
+                or g.get("tenant_id") is None
+                or "_flashes" in session
+            ):
+                return view(*args, **kwargs)
+
+            etag = cache.make_etag(name, device_class(), kwargs)
+            if request.if_none_match.contains(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = "private, no-cache"
+            response.vary.add("Cookie")
+            response.vary.add("User-Agent")
+            return response
+
+        return wrapped_view
+
+    return decorator
+
+
+def invalidates_cache(view):
+    """Bump the tenant's data version after a POST to the wrapped view."""
+
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        response = view(**kwargs)
+        if request.method == "POST":
+            cache.bump_version(g.get("tenant_id"))
+        return response
+
+    return wrapped_view
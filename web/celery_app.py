@@ -0,0 +1,9 @@
+"""Entry point for the job workers started by celery.sh.
+
+    celery -A web.celery_app worker --loglevel=info
+    celery -A web.celery_app beat
+"""
+from . import create_app
+
+flask_app = create_app()
+celery_app = flask_app.extensions["celery"]
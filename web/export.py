@@ -0,0 +1,159 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+from flask import Blueprint, Response, current_app, g, stream_with_context
+from sqlalchemy import and_, select
+from werkzeug.exceptions import abort
+
+from . import db
+from .auth import login_required
+from .models import Task, TaskComment
+
+bp = Blueprint("export", __name__, url_prefix="/export")
+
+# Rows fetched per round trip, and bytes buffered per chunk sent.
+EXPORT_BATCH = 1000
+CHUNK_SIZE = 64 * 1024
+
+CSV_COLUMNS = (
+    "task_id",
+    "created",
+    "due_date",
+    "title",
+    "status",
+    "body",
+    "comment_id",
+    "comment_created",
+    "comment",
+)
+
+
+def isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+def export_rows(user_id, tenant_id):
+    """Yield the user's tasks joined with their comments, oldest task first.
+
+    Rows are fetched EXPORT_BATCH at a time through a server-side cursor where
+    the driver has one, so memory does not grow with the tenant. The order
+    follows ix_task_tenant_author_created and ix_task_comment_task_created,
+    so neither table is sorted.
+    """
+    query = (
+        select(
+            Task.id,
+            Task.created,
+            Task.due_date,
+            Task.title,
+            Task.status,
+            Task.body,
+            TaskComment.id.label("comment_id"),
+            TaskComment.created.label("comment_created"),
+            TaskComment.content,
+        )
+        .outerjoin(
+            TaskComment,
+            and_(TaskComment.task_id == Task.id, TaskComment.tenant_id == tenant_id),
+        )
+        .where(Task.tenant_id == tenant_id, Task.author_id == user_id)
+        .order_by(Task.created, Task.id, TaskComment.created, TaskComment.id)
+        .execution_options(yield_per=EXPORT_BATCH)
+    )
+    return db.session.execute(query)
+
+
+def chunked(lines):
+    """Join lines into chunks of about CHUNK_SIZE bytes."""
+    buffer = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def ndjson_lines(rows):
+    """One JSON object per task, with its comments nested in order."""
+    task = None
+    for row in rows:
+        if task is None or task["id"] != row.id:
+            if task is not None:
+                yield json.dumps(task) + "\n"
+            task = {
+                "id": row.id,
+                "created": isoformat(row.created),
+                "due_date": isoformat(row.due_date and row.due_date.date()),
+                "title": row.title,
+                "status": row.status,
+                "body": row.body,
+                "comments": [],
+            }
+        if row.comment_id is not None:
+            task["comments"].append(
+                {
+                    "id": row.comment_id,
+                    "created": isoformat(row.comment_created),
+                    "content": row.content,
+                }
+            )
+    if task is not None:
+        yield json.dumps(task) + "\n"
+
+
+def csv_lines(rows):
+    """One CSV row per task and comment; tasks without comments get one row."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for row in rows:
+        writer.writerow(
+            (
+                row.id,
+                isoformat(row.created),
+                isoformat(row.due_date and row.due_date.date()),
+                row.title,
+                row.status,
+                row.body,
+                row.comment_id,
+                isoformat(row.comment_created),
+                row.content,
+            )
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+FORMATS = {
+    "ndjson": (ndjson_lines, "application/x-ndjson"),
+    "csv": (csv_lines, "text/csv"),
+}
+
+
+@bp.route("/tasks.<fmt>", methods=("GET",))
+@login_required
+def export_tasks(fmt):
+    if fmt not in FORMATS:
+        abort(404, f"Unknown export format {fmt}.")
+
+    lines, mimetype = FORMATS[fmt]
+    user_id = g.user.id
+    tenant_id = g.get("tenant_id")
+    current_app.logger.info("Exporting tasks of user %s as %s.", user_id, fmt)
+
+    def generate():
+        yield from chunked(lines(export_rows(user_id, tenant_id)))
+
+    filename = f"taskmate-{datetime.utcnow():%Y%m%d}.{fmt}"
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    response.headers["Cache-Control"] = "no-store"
+    return response
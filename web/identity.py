@@ -0,0 +1,170 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from flask import g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .cache import cache
+from .metrics import metrics
+from .models import Tenant, User
+
+
+class UserRecord(NamedTuple):
+    id: int
+    tenant_id: int
+    username: str
+
+
+class TenantRecord(NamedTuple):
+    id: int
+    name: str
+    timezone: str
+
+
+def load_once(kind, key, loader):
+    """Call loader at most once per request for each kind and key."""
+    if not has_app_context():
+        return loader()
+
+    identity_map = g.setdefault("identity_map", {})
+    if (kind, key) in identity_map:
+        identity_cache.count(kind, "request")
+        return identity_map[(kind, key)]
+
+    value = identity_map[(kind, key)] = loader()
+    return value
+
+
+def forget(kind, key):
+    if has_app_context() and "identity_map" in g:
+        g.identity_map.pop((kind, key), None)
+
+
+class IdentityCache(object):
+    """Bounded TTL cache of the user and tenant records loaded on every request.
+
+    Records are plain tuples, never ORM instances, so they can outlive the
+    session that loaded them. Keys carry the tenant's response cache version,
+    so a change committed by another worker is picked up as soon as the
+    version is bumped when a shared cache backend is configured, and after
+    at most the TTL otherwise.
+    """
+
+    def __init__(self, app=None):
+        self.ttl = 60
+        self.max_entries = 4096
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counts = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get("IDENTITY_CACHE_TTL", 60)
+        self.max_entries = app.config.get("IDENTITY_CACHE_MAX_ENTRIES", 4096)
+        self.clear()
+        app.extensions["identity_cache"] = self
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.counts = {}
+
+    def count(self, kind, result):
+        key = (kind, result)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        if metrics.registry is not None:
+            metrics.registry.inc(
+                "taskmate_identity_lookups_total", {"entity": kind, "result": result}
+            )
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            record, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return record
+
+    def _set(self, key, record):
+        with self._lock:
+            self._entries[key] = (record, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _load(self, kind, key, tenant_id, loader):
+        def load():
+            entry_key = (kind, key, cache.get_version(tenant_id))
+            record = self._get(entry_key)
+            if record is not None:
+                self.count(kind, "hit")
+                return record
+
+            self.count(kind, "miss")
+            record = loader()
+            if record is not None:
+                self._set(entry_key, record)
+            return record
+
+        return load_once(kind, key, load)
+
+    def get_user(self, user_id, tenant_id):
+        def loader():
+            row = (
+                User.query.with_entities(User.id, User.tenant_id, User.username)
+                .filter(User.id == user_id, User.tenant_id == tenant_id)
+                .first()
+            )
+            return UserRecord(*row) if row else None
+
+        return self._load("user", (user_id, tenant_id), tenant_id, loader)
+
+    def get_tenant(self, tenant_id):
+        def loader():
+            row = (
+                Tenant.query.with_entities(Tenant.id, Tenant.name, Tenant.timezone)
+                .filter(Tenant.id == tenant_id)
+                .first()
+            )
+            return TenantRecord(*row) if row else None
+
+        return self._load("tenant", tenant_id, tenant_id, loader)
+
+    def invalidate(self, kind, key):
+        with self._lock:
+            for entry_key in [k for k in self._entries if k[:2] == (kind, key)]:
+                del self._entries[entry_key]
+        forget(kind, key)
+
+
+identity_cache = IdentityCache()
+
+
+@event.listens_for(Session, "after_flush")
+def collect_identity_changes(session, flush_context):
+    changed = session.info.setdefault("identity_changes", set())
+    for instance in list(session.dirty) + list(session.deleted):
+        if isinstance(instance, User):
+            changed.add(("user", (instance.id, instance.tenant_id), instance.tenant_id))
+        elif isinstance(instance, Tenant):
+            changed.add(("tenant", instance.id, instance.id))
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_identity_changes(session):
+    for kind, key, tenant_id in session.info.pop("identity_changes", ()):
+        identity_cache.invalidate(kind, key)
+        cache.bump_version(tenant_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_identity_changes(session):
+    session.info.pop("identity_changes", None)
@@ -0,0 +1,148 @@
+import os
+import time
+
+from celery import Celery, Task, shared_task
+from celery.signals import (
+    before_task_publish,
+    task_failure,
+    task_postrun,
+    task_prerun,
+    task_retry,
+)
+from celery.utils.log import get_task_logger
+from flask import current_app
+from kombu.exceptions import ChannelError
+from sqlalchemy.exc import SQLAlchemyError
+
+from .metrics import metrics
+
+# Signals can fire outside the job's app context, so they log through Celery.
+logger = get_task_logger(__name__)
+
+
+class JobTask(Task):
+    """Retries jobs that fail on transient database or network errors.
+
+    OSError covers socket and SMTP failures. Retries back off exponentially
+    with jitter, up to JOB_RETRY_BACKOFF_MAX seconds between attempts.
+    """
+
+    autoretry_for = (SQLAlchemyError, OSError)
+    retry_backoff = True
+    retry_backoff_max = 600
+    retry_jitter = True
+    max_retries = 5
+
+
+def celery_init_app(app):
+    """Create the Celery app for app and make it the default for shared tasks.
+
+    Without CELERY_BROKER_URL jobs are queued in instance/celery.sqlite, so a
+    single node needs nothing beyond `./celery.sh` next to gunicorn.
+    """
+
+    class FlaskTask(JobTask):
+        max_retries = app.config.get("JOB_MAX_RETRIES", 5)
+        retry_backoff_max = app.config.get("JOB_RETRY_BACKOFF_MAX", 600)
+
+        def __call__(self, *args, **kwargs):
+            with app.app_context():
+                return self.run(*args, **kwargs)
+
+    config = dict(app.config["CELERY"])
+    if not config.get("broker_url"):
+        config["broker_url"] = "sqla+sqlite:///" + os.path.join(
+            app.instance_path, "celery.sqlite"
+        )
+    if not config.get("result_backend"):
+        config.pop("result_backend", None)
+
+    celery_app = Celery(app.name, task_cls=FlaskTask)
+    celery_app.config_from_object(config)
+    celery_app.set_default()
+    app.extensions["celery"] = celery_app
+
+    metrics.add_gauge(
+        "taskmate_job_queue_depth",
+        "Jobs waiting in each queue.",
+        lambda: get_queue_depths(celery_app),
+    )
+    return celery_app
+
+
+def get_queue_depths(celery_app):
+    """Return [(labels, depth)] for every queue the workers consume."""
+    depths = []
+    queues = celery_app.amqp.queues.keys() or [celery_app.conf.task_default_queue]
+    try:
+        with celery_app.connection_for_read() as connection:
+            channel = connection.default_channel
+            for queue in queues:
+                try:
+                    _, depth, _ = channel.queue_declare(queue, passive=True)
+                except ChannelError:
+                    # Nothing has been published to the queue yet.
+                    depth = 0
+                depths.append(({"queue": queue}, depth))
+    except Exception as e:
+        current_app.logger.warning("Could not read job queue depth: %s", e)
+    return depths
+
+
+@before_task_publish.connect
+def stamp_published_at(headers=None, **extra):
+    if headers is not None:
+        headers.setdefault("published_at", time.time())
+
+
+@task_prerun.connect
+def start_job_timer(task=None, **extra):
+    task.request.started_at = time.monotonic()
+    published_at = task.request.get("published_at")
+    if published_at is not None and metrics.registry is not None:
+        metrics.registry.observe(
+            "taskmate_job_queue_wait_seconds",
+            {"job": task.name},
+            max(time.time() - published_at, 0),
+        )
+
+
+@task_postrun.connect
+def record_job(task=None, state=None, **extra):
+    registry = metrics.registry
+    if registry is None:
+        return
+
+    started_at = task.request.get("started_at")
+    if started_at is not None:
+        registry.observe(
+            "taskmate_job_run_seconds", {"job": task.name}, time.monotonic() - started_at
+        )
+    registry.inc("taskmate_jobs_total", {"job": task.name, "state": state})
+    registry.maybe_flush()
+
+
+@task_retry.connect
+def log_job_retry(request=None, reason=None, **extra):
+    logger.warning("Retrying job %s: %s", request.task, reason)
+
+
+@task_failure.connect
+def log_job_failure(sender=None, exception=None, **extra):
+    logger.error("Job %s failed: %s", sender.name, exception)
+
+
+@shared_task(ignore_result=True)
+def sweep_overdue():
+    from .shards import run_on_every_database
+    from .sweeper import sweep_overdue_tasks
+
+    return run_on_every_database(sweep_overdue_tasks)
+
+
+@shared_task(ignore_result=True)
+def deliver_mail():
+    from .mailer import deliver_outbox
+    from .shards import run_on_every_database
+
+    return run_on_every_database(deliver_outbox)
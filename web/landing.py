@@ -2,6 +2,7 @@ from flask import (
     Blueprint,
     flash,
     g,
+    jsonify,
     redirect,
     render_template,
     request,
@@ -13,8 +14,13 @@ from flask import (
 import os
 from .models import Task, User, TaskComment
 from web.auth import login_required
+from .mailer import queue_new_task_mail, wake_sender
+from .reminders import record_change
+from .search import search_tasks
+from .bulk import BulkError, bulk_create, bulk_delete, bulk_move_done
+from .cache import cached_view, conditional_view, invalidates_cache
 from . import db
-from .timezones import get_timezones, get_gmt
+from .timezones import timezones
 
 from datetime import datetime, date
 import pytz
@@ -24,18 +30,17 @@ import pytz
 
 bp = Blueprint("landing", __name__)
 from .queries import (
+    Dashboard,
     get_active_tasks,
-    get_overdue_tasks,
-    get_comments,
+    get_dashboard,
     get_task,
-    set_task_overdue,
     get_done_tasks,
     delete_single_comment,
-    get_latest_task,
     get_comments_for_task,
-    get_latest_done_task,
     get_done_task,
     get_status,
+    viewed_body_column,
+    done_task_filters,
     set_timezone_setting,
     get_timezone_setting,
     # check_expired_tasks
@@ -49,6 +54,23 @@ def mobile_check():
         return True
 
 
+def device_class():
+    return "mobile" if mobile_check() else "desktop"
+
+
+def list_context(tasks, comments):
+    """Precompute the lookups the list templates need so they render in
+    a single pass over tasks and comments."""
+    comments_by_task = {}
+    for comment in comments:
+        comments_by_task.setdefault(comment.task_id, []).append(comment)
+
+    return {
+        "comments_by_task": comments_by_task,
+        "positions": {task.id: position for position, task in enumerate(tasks)},
+    }
+
+
 @bp.route("/error", methods=("GET",))
 def error():
     return render_template(
@@ -57,52 +79,29 @@ def error():
 
 
 @bp.route("/", methods=("GET",))
+@conditional_view("index", device_class)
+@cached_view("index", device_class)
 def index(id=None):
     try:
         if g.user and g.user.id:
-            tasks = get_active_tasks(g.user.id)
-            overdue = get_overdue_tasks(g.user.id)
-            comments = get_comments(g.user.id)
-            latest_task = get_latest_task(g.user.id)
-
-            if id is not None:
-                view_task = get_task(id)
-
-                if mobile_check():
-                    return render_template(
-                        "mobile/index.html",
-                        tasks=tasks,
-                        overdue=overdue,
-                        comments=comments,
-                        view=latest_task,
-                        status="Active",
-                    )
+            if mobile_check():
+                dashboard = get_dashboard(g.user.id, load_detail=False)
 
                 return render_template(
-                    "landing/index.html",
-                    tasks=tasks,
-                    overdue=overdue,
-                    comments=comments,
-                    view=view_task,
+                    "mobile/index.html",
+                    dashboard=dashboard,
+                    view=dashboard.view,
+                    status="Active",
                 )
-            else:
-                if mobile_check():
-                    return render_template(
-                        "mobile/index.html",
-                        tasks=tasks,
-                        overdue=overdue,
-                        comments=comments,
-                        view=latest_task,
-                        status="Active",
-                    )
 
-                return render_template(
-                    "landing/index.html",
-                    tasks=tasks,
-                    overdue=overdue,
-                    comments=comments,
-                    view=latest_task,
-                )
+            dashboard = get_dashboard(g.user.id, view_id=id)
+
+            return render_template(
+                "landing/index.html",
+                dashboard=dashboard,
+                view=dashboard.view,
+                **list_context(dashboard.tasks, dashboard.comments),
+            )
         else:
             current_app.logger.debug("User is not logged in.")
             return render_template("landing/index.html")
@@ -112,6 +111,7 @@ def index(id=None):
 
 
 @bp.route("/mobile/<int:id>")
+@conditional_view("task", device_class)
 def task_view(id):
     if g.user and g.user.id:
         if id is not None:
@@ -128,6 +128,87 @@ def task_view(id):
     )
 
 
+@bp.route("/tasks", methods=("GET",))
+@login_required
+def task_page():
+    status = request.args.get("status", "active")
+    cursor = request.args.get("cursor")
+    limit = request.args.get("limit", type=int)
+
+    if status == "done":
+        page = get_done_tasks(g.user.id, cursor=cursor, limit=limit)
+        view_endpoint = "landing.load_doneview"
+    elif status == "active":
+        page = get_active_tasks(g.user.id, cursor=cursor, limit=limit)
+        view_endpoint = "landing.load_view"
+    else:
+        return jsonify(error=f"Unknown status {status}."), 400
+
+    return jsonify(
+        tasks=[
+            {
+                "id": task.id,
+                "title": task.title,
+                "status": task.status,
+                "created": task.created.isoformat(),
+                "due_date": task.due_date.strftime("%d/%m/%Y") if task.due_date else None,
+                "comment_count": task.comment_count,
+                "view_url": url_for(view_endpoint, id=task.id),
+            }
+            for task in page.tasks
+        ],
+        next_cursor=page.next_cursor,
+    )
+
+
+@bp.route("/tasks/bulk/create", methods=("POST",))
+@login_required
+@invalidates_cache
+def bulk_create_tasks():
+    payload = request.get_json(silent=True) or {}
+    try:
+        result = bulk_create(payload.get("tasks"))
+    except BulkError as e:
+        return jsonify(errors=e.errors), 400
+    return jsonify(created=len(result.ids), ids=list(result.ids))
+
+
+@bp.route("/tasks/bulk/done", methods=("POST",))
+@login_required
+@invalidates_cache
+def bulk_move_done_tasks():
+    payload = request.get_json(silent=True) or {}
+    try:
+        result = bulk_move_done(payload.get("ids"))
+    except BulkError as e:
+        return jsonify(errors=e.errors), 400
+    return jsonify(
+        done=len(result.ids), ids=list(result.ids), not_found=list(result.not_found)
+    )
+
+
+@bp.route("/tasks/bulk/delete", methods=("POST",))
+@login_required
+@invalidates_cache
+def bulk_delete_tasks():
+    payload = request.get_json(silent=True) or {}
+    try:
+        result = bulk_delete(payload.get("ids"))
+    except BulkError as e:
+        return jsonify(errors=e.errors), 400
+    return jsonify(
+        deleted=len(result.ids), ids=list(result.ids), not_found=list(result.not_found)
+    )
+
+
+@bp.route("/search", methods=("GET",))
+@login_required
+def search():
+    query = request.args.get("q", "").strip()
+    results = search_tasks(g.user.id, query) if query else ()
+    return render_template("landing/search.html", query=query, results=results)
+
+
 @bp.route("/<int:id>/view", methods=("POST",))
 def load_view(id):
     if id is not None and mobile_check():
@@ -146,6 +227,7 @@ def load_doneview(id):
 
 @bp.route("/create", methods=("GET", "POST"))
 @login_required
+@invalidates_cache
 def create():
     if request.method == "POST":
         title = request.form["title"]
@@ -178,12 +260,8 @@ def create():
                 )
 
                 task = Task(author_id=g.user.id, title=title, tenant_id=tenant_id, created=utc_time)
-                db.session.add(task)
-                db.session.commit()
-             
-                return redirect(url_for("landing.index"))
 
-            if due_date == "" and body != "":
+            elif due_date == "" and body != "":
                 current_app.logger.info(
                     "Inserting task [author_id] %s, [title] %s, [body] %s.",
                     g.user.id,
@@ -193,12 +271,8 @@ def create():
                 task = Task(
                     author_id=g.user.id, title=title, body=body, tenant_id=tenant_id, created=utc_time
                 )
-                db.session.add(task)
-                db.session.commit()
-
-                return redirect(url_for("landing.index"))
 
-            if due_date != "" and body == "":
+            elif due_date != "" and body == "":
                 current_app.logger.info(
                     "Inserting task [author_id] %s, [title] %s, [due_date] %s, [status] %s.",
                     g.user.id,
@@ -209,110 +283,86 @@ def create():
 
                 task = Task(
                     author_id=g.user.id,
-                    due_date=due_date,
+                    due_date=date_obj,
                     title=title,
                     status=status,
                     tenant_id=tenant_id,
                     created=utc_time,
                 )
-                db.session.add(task)
-                db.session.commit()
 
-                return redirect(url_for("landing.index"))
+            else:
+                current_app.logger.info(
+                    "Inserting task [author_id] %s, [title] %s, [body] %s, [due_date] %s, [status] %s.",
+                    g.user.id,
+                    title,
+                    body,
+                    due_date,
+                    status,
+                )
 
-            current_app.logger.info(
-                "Inserting task [author_id] %s, [title] %s, [body] %s, [due_date] %s, [status] %s.",
-                g.user.id,
-                title,
-                body,
-                due_date,
-                status,
-            )
+                task = Task(
+                    author_id=g.user.id,
+                    due_date=date_obj,
+                    title=title,
+                    body=body,
+                    status=status,
+                    tenant_id=tenant_id,
+                    created=utc_time,
+                )
 
-            task = Task(
-                author_id=g.user.id,
-                due_date=due_date,
-                title=title,
-                body=body,
-                status=status,
-                tenant_id=tenant_id,
-                created=utc_time,
-            )
             db.session.add(task)
+            # Queued in the same transaction, delivered by a job worker.
+            queued = queue_new_task_mail(task, g.user)
+            record_change(task)
             db.session.commit()
+            if queued is not None:
+                wake_sender()
 
             return redirect(url_for("landing.index"))
     return render_template("landing/create.html")
 
 
 @bp.route("/done", methods=("GET",))
+@conditional_view("done", device_class)
+@cached_view("done", device_class)
 def done(id=None):
     try:
         if g.user.id:
-            tasks = (
-                Task.query.join(User)
-                .filter(
-                    Task.author_id == User.id,
-                    Task.author_id == g.user.id,
-                    Task.status == "DONE",
-                    Task.tenant_id == g.get("tenant_id"),
-                )
-                .order_by(Task.created.desc())
-                .all()
-            )
-
-            comments = (
-                TaskComment.query.join(Task)
-                .join(User)
-                .filter(
-                    Task.author_id == g.user.id,
-                    Task.status == "DONE",
-                    Task.tenant_id == g.get("tenant_id"),
-                    User.tenant_id == g.get("tenant_id"),
-                    TaskComment.tenant_id == g.get("tenant_id"),
-                )
-                .order_by(TaskComment.task_id.asc())
-                .with_entities(
-                    TaskComment.id,
-                    TaskComment.task_id,
-                    TaskComment.content,
-                    TaskComment.created,
-                )
-                .all()
-            )
-
-            if id is not None:
-                latest_task = get_done_task(id)
-
-                if mobile_check():
-                    return render_template(
-                        "mobile/index.html",
-                        tasks=tasks,
-                        comments=comments,
-                        view=latest_task,
-                        status="Done",
-                    )
-
-                return render_template(
-                    "landing/done_tasks.html",
-                    tasks=tasks,
-                    comments=comments,
-                    view=latest_task,
-                )
-
-            latest = get_latest_done_task(g.user.id)
-
             if mobile_check():
+                page = get_done_tasks(g.user.id)
+                tasks = page.tasks
+                latest = tasks[0] if tasks else None
+
                 return render_template(
                     "mobile/index.html",
-                    tasks=tasks,
-                    comments=comments,
+                    dashboard=Dashboard(
+                        tasks, (), (), latest, latest, next_cursor=page.next_cursor
+                    ),
                     view=latest,
                     status="Done",
                 )
 
+            page = get_done_tasks(
+                g.user.id,
+                extra_columns=[viewed_body_column(id, done_task_filters(g.user.id))],
+            )
+            tasks = page.tasks
+
+            view = tasks[0] if tasks else None
+            if id is not None:
+                view = next((task for task in tasks if task.id == id), None)
+                view = view or get_done_task(id)
+
+            comments = ()
+            if view is not None:
+                comments = get_comments_for_task(view.id)
+
             return render_template(
-                "landing/done_tasks.html", tasks=tasks, comments=comments, view=latest
+                "landing/done_tasks.html",
+                tasks=tasks,
+                view=view,
+                next_cursor=page.next_cursor,
+                **list_context(tasks, comments),
             )
     except TypeError as e:
         current_app.logger.exception("An error occurred: %s", e)
@@ -322,6 +372,7 @@ def done(id=None):
 
 @bp.route("/<int:id>/comment", methods=("POST",))
 @login_required
+@invalidates_cache
 def add_comment(id):
     comment = request.form["comment"]
     current_app.logger.info("Task [id] %s, adding [comment] %s", id, comment)
@@ -349,12 +400,14 @@ def add_comment(id):
 
 @bp.route("/<int:id>/deletecomment/<int:task>", methods=("POST",))
 @login_required
+@invalidates_cache
 def delete_comment(id, task):
     current_app.logger.info("Deleting comment [id] %s", id)
     error = None
-    if not Task.query.get(task):
+    tenant_id = g.get("tenant_id")
+    if not Task.query.filter_by(id=task, tenant_id=tenant_id).first():
         error = "Cannot delete comment as task does not exist."
-    if not TaskComment.query.get(id):
+    if not TaskComment.query.filter_by(id=id, tenant_id=tenant_id).first():
         error = "Cannot delete comment as comment does not exist."
     else:
         delete_single_comment(id)
@@ -370,6 +423,7 @@ def delete_comment(id, task):
 
 @bp.route("/<int:id>/done", methods=("POST",))
 @login_required
+@invalidates_cache
 def move_done(id):
     current_app.logger.info("Setting task [id] %s status to DONE", id)
     error = None
@@ -378,6 +432,7 @@ def move_done(id):
     else:
         task = get_task(id)
         task.status = "DONE"
+        record_change(task)
         db.session.commit()
     if error is not None:
         flash(error)
@@ -387,6 +442,7 @@ def move_done(id):
 
 @bp.route("/<int:id>/update", methods=("POST", "GET"))
 @login_required
+@invalidates_cache
 def update_task(id):
     if request.method == "POST":
         title = request.form["title"]
@@ -434,13 +490,14 @@ def update_task(id):
             if due_date != "":
                 date_obj = datetime.strptime(due_date, "%Y-%m-%d").date()
                 date_today = date.today()
-                task.due_date = due_date
+                task.due_date = date_obj
                 if date_obj <= date_today:
                     status = "OVERDUE"
             else:
                 task.due_date = None
 
             task.status = status
+            record_change(task)
             db.session.commit()
 
             return load_view(id)
@@ -451,6 +508,7 @@ def update_task(id):
 
 @bp.route("/<int:id>/delete", methods=("POST",))
 @login_required
+@invalidates_cache
 def delete(id):
     task = get_task(id)
     tenant_id = g.get("tenant_id")
@@ -465,27 +523,28 @@ def delete(id):
     if task.status == "ACTIVE" or task.status == "OVERDUE":
         # if task["status"] == "ACTIVE" or task["status"] == "OVERDUE":
         current_app.logger.info("Deleting task [id] %s.", id)
+        record_change(task)
         db.session.delete(task)
         db.session.commit()
         return redirect(url_for("landing.index"))
     else:
         current_app.logger.info("Deleting task [id] %s.", id)
+        record_change(task)
         db.session.delete(task)
         db.session.commit()
         return redirect(url_for("landing.done"))
 
 
 @bp.route("/settings", methods=["GET"])
+@conditional_view("settings", device_class)
 def show_settings():
     try:
         current_timezone = get_timezone_setting(g.user.tenant_id)
         current_app.logger.info("Got tenancy timezone %s.", current_timezone)
-        timezones = get_timezones()
-        for tz in timezones:
-            if current_timezone in tz:
-                tenant_timezone = tz
         return render_template(
-            "landing/settings.html", timezones=get_timezones(), selected=tenant_timezone
+            "landing/settings.html",
+            timezones=timezones.choices(),
+            selected=timezones.canonical(current_timezone),
         )
     except Exception as e:
         current_app.logger.debug(
@@ -494,16 +553,17 @@ def show_settings():
             g.user.id,
             e,
         )
-        return render_template("landing/settings.html", timezones=get_timezones())
+        return render_template("landing/settings.html", timezones=timezones.choices())
 
 @bp.route("/settings", methods=["POST"])
 @login_required
+@invalidates_cache
 def save_settings():
 
     timezone = request.form.get("timezone")
+    tenant_timezone = timezones.canonical(timezone)
 
-    if timezone in get_timezones():
-        tenant_timezone = get_gmt(timezone)
+    if tenant_timezone is not None:
         set_timezone_setting(g.user.tenant_id, tenant_timezone)
         session["timezone"] = tenant_timezone
 
@@ -516,17 +576,8 @@ def save_settings():
         if error is not None:
             flash(error)
 
-        return redirect(url_for("landing.show_settings.html"))
+        return redirect(url_for("landing.show_settings"))
 
 @bp.route("/robots.txt")
 def robots_txt():
     return render_template("robots.txt")
-
-
-# TODO run this with scheduler
-# @bp.route("/<int:id>/overdue", methods=("POST",))
-# @login_required
-# def move_overdue(id):
-#     set_task_overdue(id)
-#     print("Moving task to overdue")
-#     return redirect(url_for("landing.index"))
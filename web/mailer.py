@@ -0,0 +1,207 @@
+import smtplib
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app, render_template
+from flask_mail import Message
+
+from . import db, mail
+from .models import MailOutbox
+
+# Messages sent between commits of their SENT status.
+CHECKPOINT_EVERY = 25
+
+# SMTP errors that end the batch because the connection itself is gone.
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+def mail_enabled():
+    return current_app.config.get("MAIL_ENABLED", False)
+
+
+def queue_mail(tenant_id, recipient, subject, template, dedup_key, **context):
+    """Render a message into the outbox, to be delivered by deliver_outbox.
+
+    The row joins the caller's transaction, so the message is only sent if
+    the change it describes commits. A dedup_key already in the outbox is
+    ignored. Returns the new outbox row, or None when nothing was queued.
+    """
+    if not mail_enabled() or not recipient:
+        return None
+
+    if MailOutbox.query.filter_by(dedup_key=dedup_key).count():
+        current_app.logger.info("Mail %s is already queued.", dedup_key)
+        return None
+
+    now = datetime.utcnow()
+    message = MailOutbox(
+        tenant_id=tenant_id,
+        dedup_key=dedup_key,
+        recipient=recipient,
+        subject=subject,
+        body=render_template(f"email/{template}.txt", **context),
+        html=render_template(f"email/{template}.html", **context),
+        next_attempt=now,
+        created=now,
+    )
+    db.session.add(message)
+    return message
+
+
+def queue_new_task_mail(task, user):
+    """Queue the new task notification for task, sent to its author."""
+    # Users sign up with a username, which is only mailable if it is an address.
+    if "@" not in user.username:
+        return None
+
+    db.session.flush()
+    return queue_mail(
+        task.tenant_id,
+        user.username,
+        f"New task: {task.title}",
+        "new_task",
+        f"new_task:{task.id}",
+        user=user,
+        body={
+            "title": task.title,
+            "due_date": task.due_date or "None",
+            "description": task.body or "",
+        },
+    )
+
+
+def wake_sender():
+    """Ask a worker to deliver the outbox now rather than on its next beat."""
+    from .jobs import deliver_mail
+
+    try:
+        deliver_mail.delay()
+    except Exception as e:
+        # The beat schedule still picks the message up.
+        current_app.logger.warning("Could not enqueue mail delivery: %s", e)
+
+
+def claim_batch(batch_size, now):
+    """Mark up to batch_size due messages as ours and return them.
+
+    The conditional UPDATE makes each message belong to exactly one sender,
+    even when two deliveries overlap. Claims older than MAIL_CLAIM_TIMEOUT
+    are assumed to belong to a crashed sender and are taken over.
+    """
+    stale = now - timedelta(seconds=current_app.config.get("MAIL_CLAIM_TIMEOUT", 600))
+    due = db.or_(
+        db.and_(MailOutbox.status == "PENDING", MailOutbox.next_attempt <= now),
+        db.and_(MailOutbox.status == "SENDING", MailOutbox.claimed < stale),
+    )
+    ids = [
+        row.id
+        for row in MailOutbox.query.with_entities(MailOutbox.id)
+        .filter(due)
+        .order_by(MailOutbox.id)
+        .limit(batch_size)
+    ]
+    if not ids:
+        return []
+
+    token = uuid.uuid4().hex
+    MailOutbox.query.filter(MailOutbox.id.in_(ids), due).update(
+        {"status": "SENDING", "claim_token": token, "claimed": now},
+        synchronize_session=False,
+    )
+    db.session.commit()
+
+    return (
+        MailOutbox.query.filter_by(claim_token=token, status="SENDING")
+        .order_by(MailOutbox.id)
+        .all()
+    )
+
+
+def to_message(outbox):
+    message = Message(
+        subject=outbox.subject,
+        recipients=[outbox.recipient],
+        body=outbox.body,
+        html=outbox.html,
+    )
+    # Retries reuse the Message-ID, so receivers can drop duplicates.
+    message.msgId = f"<outbox-{outbox.id}@taskmate>"
+    return message
+
+
+def record_failure(outbox, error, now):
+    max_attempts = current_app.config.get("MAIL_MAX_ATTEMPTS", 5)
+    outbox.attempts += 1
+    outbox.last_error = str(error)
+    outbox.claim_token = None
+    if outbox.attempts >= max_attempts:
+        outbox.status = "FAILED"
+        current_app.logger.error(
+            "Giving up on mail %s after %s attempts: %s",
+            outbox.dedup_key,
+            outbox.attempts,
+            error,
+        )
+    else:
+        outbox.status = "PENDING"
+        backoff = current_app.config.get("MAIL_RETRY_BACKOFF", 30)
+        outbox.next_attempt = now + timedelta(seconds=backoff * 2 ** (outbox.attempts - 1))
+
+
+def deliver_outbox(batch_size=None):
+    """Send due outbox messages over a single SMTP connection.
+
+    Sends at most MAIL_RATE_LIMIT messages per second (0 for no limit).
+    Outcomes are committed every CHECKPOINT_EVERY messages, so a crash
+    resends at most that many, with the same Message-ID. Returns the number
+    sent.
+    """
+    config = current_app.config
+    batch_size = batch_size or config.get("MAIL_BATCH_SIZE", 100)
+    rate_limit = config.get("MAIL_RATE_LIMIT", 10)
+    interval = 1.0 / rate_limit if rate_limit else 0
+
+    batch = claim_batch(batch_size, datetime.utcnow())
+    if not batch:
+        return 0
+
+    sent = 0
+    unsaved = 0
+    next_send = time.monotonic()
+    try:
+        with mail.connect() as connection:
+            for outbox in batch:
+                delay = next_send - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_send = time.monotonic() + interval
+
+                try:
+                    connection.send(to_message(outbox))
+                except CONNECTION_ERRORS:
+                    raise
+                except smtplib.SMTPException as e:
+                    record_failure(outbox, e, datetime.utcnow())
+                else:
+                    outbox.status = "SENT"
+                    outbox.sent = datetime.utcnow()
+                    outbox.claim_token = None
+                    sent += 1
+
+                unsaved += 1
+                if unsaved == CHECKPOINT_EVERY:
+                    db.session.commit()
+                    unsaved = 0
+            db.session.commit()
+    except OSError as e:
+        # The rest of the batch goes back to the queue with a backoff.
+        current_app.logger.warning("SMTP connection failed: %s", e)
+        now = datetime.utcnow()
+        for outbox in batch:
+            if outbox.status == "SENDING":
+                record_failure(outbox, e, now)
+        db.session.commit()
+
+    current_app.logger.info("Delivered %s of %s queued mails.", sent, len(batch))
+    return sent
@@ -0,0 +1,358 @@
+import atexit
+import glob
+import hmac
+import json
+import os
+import threading
+import time
+
+from flask import (
+    before_render_template,
+    current_app,
+    g,
+    has_request_context,
+    request,
+    template_rendered,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.exceptions import abort
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+JOB_BUCKETS = (0.01, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0)
+CHECKOUT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+UTILIZATION_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+COUNTERS = {
+    "taskmate_http_requests_total": "Requests handled, by route, method and status.",
+    "taskmate_jobs_total": "Background jobs finished or retried, by job and state.",
+    "taskmate_identity_lookups_total": (
+        "User, tenant and task lookups, by whether they were answered from the "
+        "request, the identity cache (hit) or the database (miss)."
+    ),
+    "taskmate_db_pool_timeouts_total": (
+        "Connection checkouts that gave up after DB_POOL_TIMEOUT."
+    ),
+    "taskmate_db_read_routes_total": (
+        "Replica-eligible queries, by the database they read and why."
+    ),
+}
+
+HISTOGRAMS = {
+    "taskmate_http_request_duration_seconds": (
+        "Total request latency.",
+        SECONDS_BUCKETS,
+    ),
+    "taskmate_db_statements_per_request": (
+        "SQL statements executed per request.",
+        STATEMENT_BUCKETS,
+    ),
+    "taskmate_db_duration_seconds": (
+        "Time spent executing SQL per request.",
+        SECONDS_BUCKETS,
+    ),
+    "taskmate_template_render_seconds": (
+        "Time spent rendering templates per request.",
+        SECONDS_BUCKETS,
+    ),
+    "taskmate_job_queue_wait_seconds": (
+        "Time background jobs waited in the queue before starting.",
+        JOB_BUCKETS,
+    ),
+    "taskmate_job_run_seconds": (
+        "Time background jobs took to run.",
+        JOB_BUCKETS,
+    ),
+    "taskmate_db_pool_checkout_seconds": (
+        "Time spent waiting for a pooled database connection.",
+        CHECKOUT_BUCKETS,
+    ),
+    "taskmate_db_pool_utilization": (
+        "Share of the worker's pool capacity in use after each checkout.",
+        UTILIZATION_BUCKETS,
+    ),
+}
+
+
+class MetricsRegistry(object):
+    """Counters and histograms of one worker process.
+
+    Samples are kept in memory and written to ``<directory>/<pid>-<start>.json``
+    at most every ``flush_interval`` seconds. A scrape of any worker merges
+    every file in the directory, so the totals cover all gunicorn workers,
+    including ones that have since been restarted.
+    """
+
+    def __init__(self, directory, flush_interval=5):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+        self._path = None
+        self._pid = None
+
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def path(self):
+        # Resolved lazily so workers forked from a preloaded app get their own file.
+        if self._path is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._path = os.path.join(
+                self.directory, f"{self._pid}-{time.time_ns()}.json"
+            )
+        return self._path
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][1]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(buckets), 0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": [[n, l, v] for (n, l), v in self.counters.items()],
+                "histograms": [
+                    [n, l, list(h[0]), h[1], h[2]]
+                    for (n, l), h in self.histograms.items()
+                ],
+            }
+
+    def maybe_flush(self):
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        path = self.path
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def collect(self):
+        """Merge the samples of every worker, using live data for this one."""
+        snapshots = [self.snapshot()]
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            if path == self._path:
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+
+        counters = {}
+        histograms = {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot["counters"]:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, buckets, total, count in snapshot["histograms"]:
+                key = (name, tuple(map(tuple, labels)))
+                merged = histograms.setdefault(key, [[0] * len(buckets), 0, 0])
+                merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+                merged[1] += total
+                merged[2] += count
+        return counters, histograms
+
+    def render(self):
+        counters, histograms = self.collect()
+        lines = []
+
+        for name, help_text in COUNTERS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (sample, labels), value in sorted(counters.items()):
+                if sample == name:
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+
+        for name, (help_text, bounds) in HISTOGRAMS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for (sample, labels), (buckets, total, count) in sorted(
+                histograms.items()
+            ):
+                if sample != name:
+                    continue
+                cumulative = 0
+                for bound, bucket in zip(bounds, buckets):
+                    cumulative += bucket
+                    le = format_labels(labels + (("le", str(bound)),))
+                    lines.append(f"{name}_bucket{le} {cumulative}")
+                le = format_labels(labels + (("le", "+Inf"),))
+                lines.append(f"{name}_bucket{le} {count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {total}")
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+        for k, v in labels
+    )
+    return "{" + pairs + "}"
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "request_timing" in g:
+        context._query_start = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_query_start", None)
+    if started is not None and has_request_context() and "request_timing" in g:
+        timing = g.request_timing
+        timing["db"] += time.perf_counter() - started
+        timing["statements"] += 1
+
+
+def before_render(sender, template, context, **extra):
+    if "request_timing" in g:
+        g.request_timing["render_start"].append(time.perf_counter())
+
+
+def after_render(sender, template, context, **extra):
+    if "request_timing" in g and g.request_timing["render_start"]:
+        started = g.request_timing["render_start"].pop()
+        # Nested render_template calls are already inside the outer one.
+        if not g.request_timing["render_start"]:
+            g.request_timing["render"] += time.perf_counter() - started
+
+
+class Metrics(object):
+    """Times every request's SQL, template rendering and total latency.
+
+    The timings are sent back in a Server-Timing header and aggregated for
+    Prometheus at ``/metrics``, which answers only requests bearing
+    METRICS_TOKEN.
+    """
+
+    def __init__(self, app=None):
+        self.registry = None
+        self.gauges = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get("METRICS_ENABLED", True):
+            return
+
+        directory = app.config.get("METRICS_DIR") or os.path.join(
+            app.instance_path, "metrics"
+        )
+        self.registry = MetricsRegistry(
+            directory, app.config.get("METRICS_FLUSH_INTERVAL", 5)
+        )
+        atexit.register(self.registry.flush)
+
+        if not event.contains(Engine, "before_cursor_execute", before_cursor_execute):
+            event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+        before_render_template.connect(before_render, app)
+        template_rendered.connect(after_render, app)
+
+        app.before_request(self.start_timing)
+        app.after_request(self.record_timing)
+        app.add_url_rule("/metrics", "metrics", self.metrics_view)
+        app.extensions["metrics"] = self
+
+    def start_timing(self):
+        g.request_timing = {
+            "start": time.perf_counter(),
+            "db": 0.0,
+            "statements": 0,
+            "render": 0.0,
+            "render_start": [],
+        }
+
+    def record_timing(self, response):
+        timing = g.pop("request_timing", None)
+        if timing is None:
+            return response
+
+        total = time.perf_counter() - timing["start"]
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+
+        response.headers["Server-Timing"] = (
+            f'db;dur={timing["db"] * 1000:.2f};desc="{timing["statements"]} statements", '
+            f'render;dur={timing["render"] * 1000:.2f}, '
+            f"total;dur={total * 1000:.2f}"
+        )
+
+        if route == "/metrics":
+            return response
+
+        registry = self.registry
+        registry.inc(
+            "taskmate_http_requests_total",
+            {"route": route, "method": request.method, "status": response.status_code},
+        )
+        labels = {"route": route}
+        registry.observe("taskmate_http_request_duration_seconds", labels, total)
+        registry.observe(
+            "taskmate_db_statements_per_request", labels, timing["statements"]
+        )
+        registry.observe("taskmate_db_duration_seconds", labels, timing["db"])
+        registry.observe("taskmate_template_render_seconds", labels, timing["render"])
+
+        try:
+            registry.maybe_flush()
+        except OSError as e:
+            current_app.logger.warning("Could not write metrics: %s", e)
+
+        return response
+
+    def add_gauge(self, name, help_text, collect):
+        """Report collect()'s [(labels, value)] as a gauge on every scrape.
+
+        Gauges describe shared state such as queue depth, so they are read
+        when scraped rather than summed across workers.
+        """
+        self.gauges[name] = (help_text, collect)
+
+    def render_gauges(self):
+        lines = []
+        for name, (help_text, collect) in self.gauges.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in collect():
+                labels = tuple(sorted(labels.items()))
+                lines.append(f"{name}{format_labels(labels)} {value}")
+        return "".join(line + "\n" for line in lines)
+
+    def metrics_view(self):
+        # Routes, queue depths and read routing are not for every visitor.
+        token = current_app.config.get("METRICS_TOKEN")
+        if not token:
+            abort(404)
+        given = request.headers.get("Authorization", "").encode()
+        if not hmac.compare_digest(given, f"Bearer {token}".encode()):
+            return "", 401, {"WWW-Authenticate": "Bearer"}
+        return self.registry.render() + self.render_gauges(), 200, {
+            "Content-Type": "text/plain; version=0.0.4; charset=utf-8"
+        }
+
+
+metrics = Metrics()
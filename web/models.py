@@ -4,6 +4,10 @@ class Tenant(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.Text, unique=True, nullable=False)
     timezone = db.Column(db.Text, nullable=False, default="UTC")
+    # The SHARD_DATABASE_URIS entry holding the tenant's tasks, or None for
+    # this database, and the shard it is being moved to.
+    shard = db.Column(db.Text, default=None)
+    moving_to = db.Column(db.Text, default=None)
 
     def __repr__(self):
         return "<Tenant {}>".format(self.name)
@@ -35,6 +39,20 @@ class Task(db.Model):
     author = db.relationship("User")
     author_id = db.Column(db.Integer, db.ForeignKey("user.id"))
 
+    # Shaped to the list queries in queries.py: tenant and author equality,
+    # status equality (or inequality) and newest-first ordering.
+    __table_args__ = (
+        db.Index("ix_task_tenant_author_created", "tenant_id", "author_id", "created"),
+        db.Index(
+            "ix_task_tenant_author_status_created",
+            "tenant_id",
+            "author_id",
+            "status",
+            "created",
+        ),
+        db.Index("ix_task_due_date_status", "due_date", "status"),
+    )
+
     def __repr__(self):
         return "<Task ID {}>".format(self.id)
 
@@ -51,5 +69,55 @@ class TaskComment(db.Model):
     content = db.Column(db.Text, nullable=False)
     task = db.relationship("Task")
 
+    __table_args__ = (
+        db.Index("ix_task_comment_tenant_task", "tenant_id", "task_id"),
+        db.Index("ix_task_comment_task_created", "task_id", "created"),
+    )
+
     def __repr__(self):
         return "<Comment ID {}>".format(self.id)
+
+
+class SweepWatermark(db.Model):
+    timezone = db.Column(db.Text, primary_key=True)
+    watermark = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return "<SweepWatermark {} {}>".format(self.timezone, self.watermark)
+
+
+class MailOutbox(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    tenant_id = db.Column(db.Integer, db.ForeignKey("tenant.id"), nullable=False)
+    # One message per event, e.g. "new_task:42", however often it is queued.
+    dedup_key = db.Column(db.Text, unique=True, nullable=False)
+    recipient = db.Column(db.Text, nullable=False)
+    subject = db.Column(db.Text, nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    html = db.Column(db.Text, default=None)
+    status = db.Column(db.Text, nullable=False, default="PENDING")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt = db.Column(db.DateTime, nullable=False)
+    claim_token = db.Column(db.Text, default=None)
+    claimed = db.Column(db.DateTime, default=None)
+    created = db.Column(db.DateTime, nullable=False)
+    sent = db.Column(db.DateTime, default=None)
+    last_error = db.Column(db.Text, default=None)
+
+    __table_args__ = (db.Index("ix_mail_outbox_status_next_attempt", "status", "next_attempt"),)
+
+    def __repr__(self):
+        return "<MailOutbox ID {} {}>".format(self.id, self.status)
+
+
+class ReminderChange(db.Model):
+    """A task whose reminder must be rescheduled, read by the reminder scheduler.
+
+    task_id has no foreign key, so deletes are recorded too.
+    """
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    task_id = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return "<ReminderChange task {}>".format(self.task_id)
@@ -0,0 +1,156 @@
+import time
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import exc, inspect, text
+
+from . import db
+from .shards import shard_bind
+
+# Copied in this order: a comment's task must be copied before it.
+TABLES = ("task", "task_comment")
+
+PARTITION_COPY_BATCH = 5000
+
+# A batch chosen as a deadlock victim, by a transaction changing several of
+# its rows, is tried again this many times.
+PARTITION_COPY_RETRIES = 5
+
+
+def sync_function(table, columns):
+    """Trigger function mirroring changes to table into its partitioned copy.
+
+    Rows partition-copy has not reached are left for it. So is a comment on
+    a task it has not copied yet, as comments are copied after all tasks.
+    """
+    names = ", ".join(columns)
+    values = ", ".join("NEW." + column for column in columns)
+    if table == "task_comment":
+        insert = (
+            f"INSERT INTO {table}_partitioned ({names}) SELECT {values} "
+            "WHERE EXISTS (SELECT 1 FROM task_partitioned "
+            "WHERE id = NEW.task_id AND tenant_id = NEW.tenant_id) "
+            "ON CONFLICT DO NOTHING"
+        )
+    else:
+        insert = (
+            f"INSERT INTO {table}_partitioned ({names}) VALUES ({values}) "
+            "ON CONFLICT DO NOTHING"
+        )
+    return f"""
+CREATE FUNCTION {table}_partition_sync() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        {insert};
+    ELSIF TG_OP = 'UPDATE' THEN
+        UPDATE {table}_partitioned SET ({names}) = ({values})
+        WHERE id = OLD.id AND tenant_id = OLD.tenant_id;
+    ELSE
+        DELETE FROM {table}_partitioned WHERE id = OLD.id AND tenant_id = OLD.tenant_id;
+    END IF;
+    RETURN NULL;
+END
+$$"""
+
+
+def column_names(connection, table):
+    return [column["name"] for column in inspect(connection).get_columns(table)]
+
+
+def create_sync_triggers(connection):
+    """Start mirroring task and task_comment into their partitioned copies."""
+    for table in TABLES:
+        connection.exec_driver_sql(sync_function(table, column_names(connection, table)))
+        connection.exec_driver_sql(
+            f"CREATE TRIGGER {table}_partition_sync "
+            f"AFTER INSERT OR UPDATE OR DELETE ON {table} "
+            f"FOR EACH ROW EXECUTE FUNCTION {table}_partition_sync()"
+        )
+
+
+def drop_sync_triggers(connection):
+    for table in TABLES:
+        connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {table}_partition_sync ON {table}")
+        connection.exec_driver_sql(f"DROP FUNCTION IF EXISTS {table}_partition_sync()")
+
+
+def copy_table(engine, table, batch_size=PARTITION_COPY_BATCH, pause=0, progress=None):
+    """Copy table's rows into its partitioned copy, batch_size ids per
+    transaction, and return the number copied.
+
+    Rows added after the triggers were created are mirrored already, so the
+    copy stops at the highest id it finds on starting. Each batch locks its
+    rows FOR SHARE, so a concurrent change waits for it and is then mirrored
+    onto the copied row. It resumes from partition_copy if interrupted.
+    """
+    with engine.connect() as connection:
+        names = ", ".join(column_names(connection, table))
+        copied_to = connection.execute(
+            text("SELECT copied_to FROM partition_copy WHERE table_name = :table"),
+            {"table": table},
+        ).scalar()
+        last = connection.exec_driver_sql(f"SELECT coalesce(max(id), 0) FROM {table}").scalar()
+
+    rows = 0
+    while copied_to < last:
+        upper = min(copied_to + batch_size, last)
+        for attempt in range(PARTITION_COPY_RETRIES + 1):
+            try:
+                rows += copy_batch(engine, table, names, copied_to, upper)
+                break
+            except exc.DBAPIError as e:
+                deadlock = getattr(e.orig, "pgcode", None) == "40P01"
+                if not deadlock or attempt == PARTITION_COPY_RETRIES:
+                    raise
+                time.sleep(0.1 * (attempt + 1))
+        copied_to = upper
+        if progress:
+            progress(table, rows, copied_to, last)
+        if pause:
+            time.sleep(pause)
+    return rows
+
+
+def copy_batch(engine, table, names, lower, upper):
+    with engine.begin() as connection:
+        rows = connection.execute(
+            text(
+                f"INSERT INTO {table}_partitioned ({names}) SELECT {names} FROM {table} "
+                "WHERE id > :lower AND id <= :upper FOR SHARE ON CONFLICT DO NOTHING"
+            ),
+            {"lower": lower, "upper": upper},
+        ).rowcount
+        connection.execute(
+            text("UPDATE partition_copy SET copied_to = :upper WHERE table_name = :table"),
+            {"upper": upper, "table": table},
+        )
+    return rows
+
+
+@click.command("partition-copy")
+@click.option("--batch-size", default=PARTITION_COPY_BATCH, show_default=True,
+              help="Ids copied per transaction.")
+@click.option("--pause", default=0.0, help="Seconds to sleep between batches.")
+@click.option("--shard", default=None, help="Copy on this SHARD_DATABASE_URIS entry.")
+@with_appcontext
+def partition_copy_command(batch_size, pause, shard):
+    """Copy tasks and comments into their hash-partitioned tables.
+
+    Run it between the migrations that prepare and swap in the partitioned
+    tables, while the app keeps serving; it can be stopped and rerun.
+    """
+    engine = db.engines[shard_bind(shard)]
+    if engine.dialect.name != "postgresql" or not inspect(engine).has_table("partition_copy"):
+        raise click.ClickException(
+            "Nothing to copy: run flask db upgrade d5e8a1f0c6b4 on PostgreSQL first."
+        )
+
+    def progress(table, rows, copied_to, last):
+        click.echo(f"{table}: {rows} rows copied, ids to {copied_to} of {last}.")
+
+    start = time.perf_counter()
+    rows = sum(copy_table(engine, table, batch_size, pause, progress) for table in TABLES)
+    click.echo(
+        f"Copied {rows} rows in {time.perf_counter() - start:.1f} s. "
+        "Run flask db upgrade to swap in the partitioned tables."
+    )
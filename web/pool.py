@@ -0,0 +1,76 @@
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool, QueuePool
+
+from .metrics import metrics
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that reports checkout waits and utilization to the metrics.
+
+    The wait covers queueing for a free connection and opening a new one,
+    which is what a request waits for before its first statement.
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            if metrics.registry is not None:
+                metrics.registry.inc("taskmate_db_pool_timeouts_total", {})
+            raise
+        if metrics.registry is not None:
+            metrics.registry.observe(
+                "taskmate_db_pool_checkout_seconds", {}, time.perf_counter() - start
+            )
+            metrics.registry.observe(
+                "taskmate_db_pool_utilization", {}, self.utilization()
+            )
+        return connection
+
+    def utilization(self):
+        """Return the share of the pool's capacity checked out, from 0 to 1."""
+        capacity = self.size() + max(self._max_overflow, 0)
+        return min(self.checkedout() / capacity, 1.0) if capacity else 1.0
+
+
+def engine_options(config):
+    """Return SQLALCHEMY_ENGINE_OPTIONS for the configured database.
+
+    Every gunicorn worker holds its own pool, so a database sees up to
+    workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections. A sync worker
+    serves one request at a time, so the defaults are small. SQLite keeps
+    SQLAlchemy's defaults.
+
+    Behind PgBouncer (DB_PGBOUNCER) each checkout opens a client connection
+    to it and closes it on return, leaving the pooling to PgBouncer. A
+    local pool would keep idle connections to it, each holding a server
+    connection in session mode, and could hand out ones it has closed.
+    """
+    url = make_url(config["SQLALCHEMY_DATABASE_URI"])
+    if url.get_backend_name() == "sqlite":
+        return {}
+    if config.get("DB_PGBOUNCER", False):
+        return {"poolclass": NullPool}
+
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_size": config.get("DB_POOL_SIZE", 2),
+        "max_overflow": config.get("DB_MAX_OVERFLOW", 3),
+        "pool_timeout": config.get("DB_POOL_TIMEOUT", 30),
+        "pool_recycle": config.get("DB_POOL_RECYCLE", 1800),
+        "pool_pre_ping": config.get("DB_POOL_PRE_PING", True),
+    }
+
+
+def pool_init_app(app):
+    """Fill in SQLALCHEMY_ENGINE_OPTIONS; call it before db.init_app.
+
+    Options set explicitly in SQLALCHEMY_ENGINE_OPTIONS win.
+    """
+    options = engine_options(app.config)
+    options.update(app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
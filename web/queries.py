@@ -1,10 +1,164 @@
+import base64
+import binascii
+from datetime import datetime
+from typing import NamedTuple, Optional
+
 from flask import current_app, g
+from sqlalchemy import or_, type_coerce
 from werkzeug.exceptions import abort
 from . import db
+from .identity import identity_cache, load_once
+from .replica import replica_read
 from .models import User, Task, TaskComment, Tenant
 
+TASK_PAGE_SIZE = 50
+MAX_TASK_PAGE_SIZE = 200
+
+
+class TaskPage(NamedTuple):
+    """One page of a task list, newest first."""
+
+    tasks: tuple
+    next_cursor: Optional[str]
+
+
+class Dashboard(NamedTuple):
+    """Everything the active task views render, loaded in one pass."""
+
+    tasks: tuple
+    overdue: tuple
+    comments: tuple
+    latest_task: Optional[object]
+    view: Optional[object] = None
+    overdue_count: int = 0
+    next_cursor: Optional[str] = None
+
+    def find_task(self, id):
+        for task in self.tasks:
+            if task.id == id:
+                return task
+        return None
+
+
+def comment_count_column():
+    """Correlated comment count for a task list row, served by the
+    (tenant_id, task_id) index on task_comment."""
+    return (
+        db.session.query(db.func.count(TaskComment.id))
+        .filter(
+            TaskComment.task_id == Task.id,
+            TaskComment.tenant_id == g.get("tenant_id"),
+        )
+        .correlate(Task)
+        .scalar_subquery()
+        .label("comment_count")
+    )
+
+
+def encode_cursor(task):
+    value = f"{task.created.isoformat()}|{task.id}"
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        created, id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created), int(id)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        abort(400, "Invalid cursor.")
+
+
+def get_page_size(limit=None):
+    if limit is None:
+        limit = current_app.config.get("TASK_PAGE_SIZE", TASK_PAGE_SIZE)
+    return max(1, min(int(limit), MAX_TASK_PAGE_SIZE))
 
-def get_active_tasks(user_id):
+
+def paginate(query, cursor=None, limit=None):
+    """Seek to the rows after cursor on (created, id) and return a TaskPage.
+
+    The seek predicate lets the (tenant_id, author_id, ...) indexes start at
+    the cursor, so every page costs the same no matter how deep it is.
+    """
+    limit = get_page_size(limit)
+
+    if cursor:
+        created, id = decode_cursor(cursor)
+        # SQLite compares timestamps as text, and rows from the old
+        # CURRENT_TIMESTAMP default lack the ".000000" the ORM writes, so
+        # "10:00:00" sorts before "10:00:00.000000". Bound in both forms, the
+        # seek steps past the cursor's second whichever form it is stored in.
+        stored = type_coerce(Task.created, db.String)
+        full = created.strftime("%Y-%m-%d %H:%M:%S.%f")
+        short = full if created.microsecond else full[:-7]
+        query = query.filter(stored <= full, or_(stored < short, Task.id < id))
+
+    rows = query.order_by(Task.created.desc(), Task.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1])
+
+    return TaskPage(tuple(rows), next_cursor)
+
+
+def active_task_filters(user_id):
+    return (
+        Task.author_id == user_id,
+        Task.status != "DONE",
+        Task.tenant_id == g.get("tenant_id"),
+    )
+
+
+def done_task_filters(user_id):
+    return (
+        Task.author_id == user_id,
+        Task.status == "DONE",
+        Task.tenant_id == g.get("tenant_id"),
+    )
+
+
+def overdue_count_column(user_id):
+    """Overdue total across every active task, not just the current page.
+
+    An uncorrelated subquery, run once per statement, that counts only the
+    overdue rows on the (tenant_id, author_id, status, created) index.
+    """
+    return (
+        db.session.query(db.func.count(Task.id))
+        .filter(
+            Task.author_id == user_id,
+            Task.status == "OVERDUE",
+            Task.tenant_id == g.get("tenant_id"),
+        )
+        .scalar_subquery()
+        .label("overdue_count")
+    )
+
+
+def viewed_body_column(view_id=None, filters=()):
+    """Task.body for the viewed row only, NULL for every other row.
+
+    List views only ever display one description, so this keeps long bodies
+    out of the rows moved for the rest of the list. Without view_id the
+    newest task matching filters, those of the list's first page, is the
+    one viewed, found with a single index seek.
+    """
+    if view_id is None:
+        view_id = (
+            db.session.query(Task.id)
+            .filter(*filters)
+            .order_by(Task.created.desc(), Task.id.desc())
+            .limit(1)
+            .scalar_subquery()
+        )
+
+    return db.case((Task.id == view_id, Task.body), else_=None).label("body")
+
+
+@replica_read
+def get_active_tasks(user_id, cursor=None, limit=None, extra_columns=()):
     current_app.logger.debug("Querying database for active tasks.")
 
     query = (
@@ -15,22 +169,56 @@ def get_active_tasks(user_id):
             Task.created,
             Task.due_date,
             Task.title,
-            Task.body,
             Task.status,
             Task.tenant_id,
+            comment_count_column(),
         )
         .join(User, Task.author_id == User.id)
-        .filter(
-            Task.author_id == user_id,
-            Task.status != "DONE",
-            User.tenant_id == g.get("tenant_id"),
-            Task.tenant_id == g.get("tenant_id"),
-        )
-        .order_by(Task.created.desc())
+        .filter(*active_task_filters(user_id), User.tenant_id == g.get("tenant_id"))
+    )
+
+    if extra_columns:
+        query = query.add_columns(*extra_columns)
+
+    return paginate(query, cursor, limit)
+
+
+@replica_read
+def get_dashboard(user_id, view_id=None, load_detail=True):
+    current_app.logger.debug("Querying database for dashboard.")
+
+    extra_columns = [overdue_count_column(user_id)]
+    if load_detail:
+        extra_columns.append(viewed_body_column(view_id, active_task_filters(user_id)))
+
+    page = get_active_tasks(user_id, extra_columns=extra_columns)
+    tasks = page.tasks
+
+    # get_active_tasks is ordered newest first, so the overdue list keeps the
+    # same ordering as get_overdue_tasks and the first row is the latest task.
+    dashboard = Dashboard(
+        tasks=tasks,
+        overdue=tuple(task for task in tasks if task.status == "OVERDUE"),
+        comments=(),
+        latest_task=tasks[0] if tasks else None,
+        overdue_count=tasks[0].overdue_count if tasks else 0,
+        next_cursor=page.next_cursor,
     )
-    return query.all()
 
+    view = dashboard.latest_task
+    if view_id is not None:
+        # Tasks outside the active list still go through get_task for its
+        # 404/403 handling.
+        view = dashboard.find_task(view_id) or get_task(view_id)
+
+    comments = ()
+    if load_detail and view is not None:
+        comments = tuple(get_comments_for_task(view.id))
 
+    return dashboard._replace(comments=comments, view=view)
+
+
+@replica_read
 def get_latest_task(user_id):
     current_app.logger.debug("Querying database for latest task.")
 
@@ -42,7 +230,6 @@ def get_latest_task(user_id):
             Task.created,
             Task.due_date,
             Task.title,
-            Task.body,
             Task.status,
             Task.tenant_id,
         )
@@ -58,10 +245,11 @@ def get_latest_task(user_id):
     )
 
 
-def get_done_tasks(user_id):
+@replica_read
+def get_done_tasks(user_id, cursor=None, limit=None, extra_columns=()):
     current_app.logger.debug("Querying database for done tasks.")
 
-    return (
+    query = (
         Task.query.with_entities(
             Task.id,
             User.username,
@@ -69,22 +257,21 @@ def get_done_tasks(user_id):
             Task.created,
             Task.due_date,
             Task.title,
-            Task.body,
             Task.status,
             Task.tenant_id,
+            comment_count_column(),
         )
         .join(User, Task.author_id == User.id)
-        .filter(
-            Task.author_id == user_id,
-            Task.status == "DONE",
-            User.tenant_id == g.get("tenant_id"),
-            Task.tenant_id == g.get("tenant_id"),
-        )
-        .order_by(Task.created.desc())
-        .all()
+        .filter(*done_task_filters(user_id), User.tenant_id == g.get("tenant_id"))
     )
 
+    if extra_columns:
+        query = query.add_columns(*extra_columns)
 
+    return paginate(query, cursor, limit)
+
+
+@replica_read
 def get_overdue_tasks(user_id):
     current_app.logger.debug("Querying database for overdue tasks.")
 
@@ -102,6 +289,7 @@ def get_overdue_tasks(user_id):
     )
 
 
+@replica_read
 def get_comments_for_task(task_id):
     current_app.logger.debug("Querying database for comments for a single task.")
 
@@ -123,11 +311,12 @@ def get_comments_for_task(task_id):
             TaskComment.tenant_id == g.get("tenant_id"),
             Task.tenant_id == g.get("tenant_id"),
         )
-        .order_by(TaskComment.task_id.asc())
+        .order_by(TaskComment.created.asc(), TaskComment.id.asc())
         .all()
     )
 
 
+@replica_read
 def get_comments(user_id):
     current_app.logger.debug("Querying database for comments.")
 
@@ -163,10 +352,15 @@ def delete_single_comment(id):
         db.session.commit()
 
 
+@replica_read
 def get_task(id, check_user=True):
     current_app.logger.debug("Querying database for task %s.", id)
 
-    task = Task.query.filter_by(id=id, tenant_id=g.get("tenant_id")).first()
+    task = load_once(
+        "task",
+        id,
+        lambda: Task.query.filter_by(id=id, tenant_id=g.get("tenant_id")).first(),
+    )
 
     if task is None:
         abort(404, f"Task id {id} doesn't exist.")
@@ -177,6 +371,7 @@ def get_task(id, check_user=True):
     return task
 
 
+@replica_read
 def get_latest_done_task(user_id):
     current_app.logger.debug("Querying database for latest task.")
 
@@ -189,7 +384,6 @@ def get_latest_done_task(user_id):
             Task.created,
             Task.due_date,
             Task.title,
-            Task.body,
             Task.status,
             Task.tenant_id,
         )
@@ -205,6 +399,7 @@ def get_latest_done_task(user_id):
     )
 
 
+@replica_read
 def get_status(id, check_user=True):
     current_app.logger.debug("Querying database for status of task %s.", id)
 
@@ -229,6 +424,7 @@ def get_status(id, check_user=True):
     return status
 
 
+@replica_read
 def get_done_task(id, check_user=True):
     current_app.logger.debug("Querying database for done task %s.", id)
 
@@ -276,7 +472,7 @@ def get_timezone_setting(tenant_id):
     try:
         tenant = None
         if tenant_id == g.get("tenant_id"):
-            tenant = Tenant.query.get(tenant_id)
+            tenant = identity_cache.get_tenant(tenant_id)
 
         if tenant:
             timezone = tenant.timezone
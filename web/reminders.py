@@ -0,0 +1,338 @@
+import functools
+import heapq
+import time as clock
+from datetime import datetime, time, timedelta
+
+import click
+import pytz
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import insert, select
+
+from . import db
+from .mailer import queue_mail, wake_sender
+from .models import ReminderChange, Task, Tenant, User
+from .timezones import get_zone
+
+TASK_ID_BITS = 32
+TASK_ID_MASK = (1 << TASK_ID_BITS) - 1
+
+# Tasks re-read per IN query when applying changes or firing reminders.
+READ_CHUNK = 500
+
+
+class ReminderHeap(object):
+    """Pending reminders ordered by fire time.
+
+    Each reminder is one int, (fire_at << 32) | task_id, so the heap is a flat
+    list of ints and the dict maps a task to the very same int object.
+    Rescheduling or cancelling only updates the dict; the superseded heap
+    entry is skipped when it reaches the top, and the heap is rebuilt once
+    such entries outnumber the live ones.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __contains__(self, task_id):
+        return task_id in self._pending
+
+    def fire_time(self, task_id):
+        entry = self._pending.get(task_id)
+        return None if entry is None else entry >> TASK_ID_BITS
+
+    def schedule(self, task_id, fire_at):
+        entry = (fire_at << TASK_ID_BITS) | task_id
+        if self._pending.get(task_id) == entry:
+            return
+        self._pending[task_id] = entry
+        heapq.heappush(self._heap, entry)
+        self._maybe_compact()
+
+    def cancel(self, task_id):
+        if self._pending.pop(task_id, None) is not None:
+            self._maybe_compact()
+
+    def next_fire(self):
+        """Return the earliest pending fire time, or None."""
+        heap = self._heap
+        while heap and self._pending.get(heap[0] & TASK_ID_MASK) != heap[0]:
+            heapq.heappop(heap)
+        return heap[0] >> TASK_ID_BITS if heap else None
+
+    def pop_due(self, now):
+        """Remove and return [(fire_at, task_id)] for reminders due by now."""
+        due = []
+        heap = self._heap
+        limit = (now + 1) << TASK_ID_BITS
+        while heap and heap[0] < limit:
+            entry = heapq.heappop(heap)
+            task_id = entry & TASK_ID_MASK
+            if self._pending.get(task_id) == entry:
+                del self._pending[task_id]
+                due.append((entry >> TASK_ID_BITS, task_id))
+        return due
+
+    def _maybe_compact(self):
+        if len(self._heap) > 2 * len(self._pending) + 1024:
+            self._heap = list(self._pending.values())
+            heapq.heapify(self._heap)
+
+
+@functools.lru_cache(maxsize=4096)
+def reminder_time(due_day, timezone_name, lead_hours):
+    """Return the epoch second lead_hours before due_day starts in timezone_name.
+
+    A task is due at the start of its due date in its tenant's timezone, the
+    moment the overdue sweep flips it.
+    """
+    zone = get_zone(timezone_name)
+    starts = zone.localize(datetime.combine(due_day, time.min))
+    return int(starts.timestamp()) - lead_hours * 3600
+
+
+def record_change(task):
+    """Tell the reminder scheduler that task was created, edited or deleted.
+
+    The row joins the caller's transaction, so the scheduler only sees
+    committed changes. Nothing is recorded while reminders are disabled.
+    """
+    if not current_app.config.get("REMINDERS_ENABLED", False):
+        return
+    if task.id is None:
+        db.session.flush()
+    db.session.add(ReminderChange(task_id=task.id))
+
+
+def record_changes(task_ids):
+    """record_change for tasks changed with a set-based statement."""
+    if not task_ids or not current_app.config.get("REMINDERS_ENABLED", False):
+        return
+    db.session.execute(
+        insert(ReminderChange), [{"task_id": task_id} for task_id in task_ids]
+    )
+
+
+def record_tenant_changes(tenant_id):
+    """record_change for every task of a tenant that may need a reminder."""
+    if not current_app.config.get("REMINDERS_ENABLED", False):
+        return
+    db.session.execute(
+        insert(ReminderChange).from_select(
+            ["task_id"],
+            select(Task.id).where(
+                Task.tenant_id == tenant_id,
+                Task.status == "ACTIVE",
+                Task.due_date.isnot(None),
+            ),
+        )
+    )
+
+
+def chunks(values, size=READ_CHUNK):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start : start + size]
+
+
+class ReminderScheduler(object):
+    """Fires due-soon reminders from an in-memory heap.
+
+    Only ACTIVE tasks due within REMINDER_HORIZON of their reminder are held,
+    loaded by due date range through ix_task_due_date_status and topped up as
+    time passes. Edits reach the heap through the reminder_change table,
+    whose rows are deleted once applied, so no step scans every task. Run
+    one scheduler per database.
+    """
+
+    def __init__(self, lead_hours=24, horizon=timedelta(days=1)):
+        self.lead_hours = lead_hours
+        self.horizon = horizon
+        self.heap = ReminderHeap()
+        self.loaded_until = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            lead_hours=config.get("REMINDER_LEAD_HOURS", 24),
+            horizon=timedelta(seconds=config.get("REMINDER_HORIZON", 86400)),
+        )
+
+    def start(self, now):
+        # Loading the window covers every change committed before it.
+        ReminderChange.query.delete(synchronize_session=False)
+        # Due dates are naive; the start of a day anywhere is within a day of UTC.
+        self.loaded_until = now.replace(tzinfo=None) - timedelta(days=1)
+        return self.refill(now)
+
+    def window_end(self, now):
+        return (
+            now.replace(tzinfo=None)
+            + timedelta(hours=self.lead_hours)
+            + self.horizon
+            + timedelta(days=1)
+        )
+
+    def refill(self, now):
+        """Load the tasks whose due date entered the window since the last call."""
+        end = self.window_end(now)
+        if end <= self.loaded_until:
+            return 0
+
+        rows = (
+            db.session.query(Task.id, Task.due_date, Tenant.timezone)
+            .join(Tenant, Task.tenant_id == Tenant.id)
+            .filter(
+                Task.status == "ACTIVE",
+                Task.due_date >= self.loaded_until,
+                Task.due_date < end,
+            )
+            .yield_per(10000)
+        )
+        now_ts = int(now.timestamp())
+        loaded = 0
+        for task_id, due_date, timezone_name in rows:
+            loaded += self.schedule(task_id, due_date, timezone_name, now_ts)
+        self.loaded_until = end
+        db.session.commit()
+        return loaded
+
+    def schedule(self, task_id, due_date, timezone_name, now):
+        """Schedule task_id unless it is already due. Returns 1 if scheduled."""
+        fire_at = reminder_time(due_date.date(), timezone_name, self.lead_hours)
+        if fire_at + self.lead_hours * 3600 <= now:
+            self.heap.cancel(task_id)
+            return 0
+        self.heap.schedule(task_id, fire_at)
+        return 1
+
+    def apply_changes(self, now):
+        """Reschedule the tasks recorded in reminder_change since the last call."""
+        changes = (
+            ReminderChange.query.with_entities(ReminderChange.id, ReminderChange.task_id)
+            .order_by(ReminderChange.id)
+            .all()
+        )
+        if not changes:
+            return 0
+
+        task_ids = {task_id for _, task_id in changes}
+        now_ts = int(now.timestamp())
+        for chunk in chunks(task_ids):
+            rows = (
+                db.session.query(Task.id, Task.due_date, Task.status, Tenant.timezone)
+                .join(Tenant, Task.tenant_id == Tenant.id)
+                .filter(Task.id.in_(chunk))
+            )
+            for task_id, due_date, status, timezone_name in rows:
+                task_ids.discard(task_id)
+                if status != "ACTIVE" or due_date is None or due_date >= self.loaded_until:
+                    self.heap.cancel(task_id)
+                else:
+                    self.schedule(task_id, due_date, timezone_name, now_ts)
+        # Whatever is left was deleted.
+        for task_id in task_ids:
+            self.heap.cancel(task_id)
+
+        # Ids are not committed in order, so rows are removed by id rather
+        # than by reading past a high water mark.
+        for chunk in chunks(change_id for change_id, _ in changes):
+            ReminderChange.query.filter(ReminderChange.id.in_(chunk)).delete(
+                synchronize_session=False
+            )
+        db.session.commit()
+        return len(changes)
+
+    def fire_due(self, now):
+        """Queue reminder mail for every reminder due by now. Returns the count."""
+        now_ts = int(now.timestamp())
+        due = [task_id for _, task_id in self.heap.pop_due(now_ts)]
+        if not due:
+            return 0
+
+        queued = 0
+        for chunk in chunks(due):
+            rows = (
+                db.session.query(Task, User.username, Tenant.timezone)
+                .join(User, Task.author_id == User.id)
+                .join(Tenant, Task.tenant_id == Tenant.id)
+                .filter(Task.id.in_(chunk), Task.status == "ACTIVE")
+            )
+            for task, username, timezone_name in rows:
+                fire_at = reminder_time(task.due_date.date(), timezone_name, self.lead_hours)
+                if fire_at + self.lead_hours * 3600 <= now_ts:
+                    continue
+                if fire_at > now_ts:
+                    # The tenant moved to a timezone where the day starts later.
+                    self.heap.schedule(task.id, fire_at)
+                    continue
+                if "@" not in username:
+                    continue
+                message = queue_mail(
+                    task.tenant_id,
+                    username,
+                    f"Due soon: {task.title}",
+                    "reminder",
+                    f"reminder:{task.id}:{task.due_date:%Y-%m-%d}",
+                    user={"username": username},
+                    body={
+                        "title": task.title,
+                        "due_date": f"{task.due_date:%Y-%m-%d}",
+                        "description": task.body or "",
+                    },
+                )
+                if message is not None:
+                    queued += 1
+        db.session.commit()
+
+        current_app.logger.info("Queued %s of %s due reminders.", queued, len(due))
+        if queued:
+            wake_sender()
+        return queued
+
+    def run_once(self, now=None):
+        """Apply changes, top up the window and fire due reminders.
+
+        Returns the seconds to sleep before the next call.
+        """
+        if now is None:
+            now = datetime.now(pytz.utc)
+        if self.loaded_until is None:
+            self.start(now)
+
+        self.apply_changes(now)
+        self.refill(now)
+        self.fire_due(now)
+
+        interval = current_app.config.get("REMINDER_POLL_INTERVAL", 30)
+        next_fire = self.heap.next_fire()
+        if next_fire is None:
+            return interval
+        return max(0, min(interval, next_fire - int(now.timestamp())))
+
+
+@click.command("reminders")
+@click.option("--once", is_flag=True, help="Fire due reminders and exit.")
+@click.option("--shard", default=None, help="Remind the tenants on this SHARD_DATABASE_URIS entry.")
+@with_appcontext
+def reminders_command(once, shard):
+    """Send due-soon reminders until interrupted.
+
+    Run one per database: without --shard for the directory's tenants, and
+    with --shard for each shard's.
+    """
+    from .shards import shard_option_key, use_database
+
+    with use_database(shard_option_key(shard)):
+        scheduler = ReminderScheduler.from_config(current_app.config)
+        while True:
+            delay = scheduler.run_once()
+            if once:
+                break
+            clock.sleep(delay)
+            db.session.remove()
+        click.echo(f"{len(scheduler.heap)} reminders pending.")
@@ -0,0 +1,183 @@
+import functools
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, exc, text
+
+from .metrics import metrics
+
+# Requests with these methods only read, so they may read from the replica.
+SAFE_METHODS = frozenset(("GET", "HEAD", "OPTIONS"))
+
+REPLICA_BIND = "replica"
+
+# Seconds the replica trails the primary. A standby that has replayed all
+# it received is current however old its last transaction is.
+LAG_QUERIES = {
+    "postgresql": (
+        "SELECT CASE WHEN NOT pg_is_in_recovery() "
+        "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END"
+    ),
+}
+
+
+class RoutingSession(Session):
+    """Session that sends every query to the tenant's shard, when it has one,
+    and reads made in replica_read functions to the replica.
+
+    Everything else, including every flush and INSERT, UPDATE or DELETE,
+    goes to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and g:
+            # The db.engines key set by the shard router for the request.
+            shard = g.get("shard")
+            if shard is not None:
+                return self._db.engines[shard]
+            if g.get("replica_reads"):
+                router = current_app.extensions.get("replica")
+                if router is not None and router.use_replica(self, clause):
+                    return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def note_flush(session, flush_context):
+    if g:
+        g.wrote_primary = True
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def note_write(orm_execute_state):
+    # text() statements are never is_select, so only count real DML.
+    if g and getattr(orm_execute_state.statement, "is_dml", False):
+        g.wrote_primary = True
+
+
+def replica_read(f):
+    """Let f's queries read from the replica when it is safe to."""
+
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        g.replica_reads = g.get("replica_reads", 0) + 1
+        try:
+            return f(*args, **kwargs)
+        finally:
+            g.replica_reads -= 1
+
+    return wrapper
+
+
+class ReplicaRouter(object):
+    """Routes read-only queries to REPLICA_DATABASE_URI.
+
+    A read goes to the replica only in a GET request that has not written
+    anything, from a user who has not written in the last REPLICA_MAX_LAG
+    seconds, and while the replica is reachable and at most REPLICA_MAX_LAG
+    seconds behind. Both are checked at most every REPLICA_CHECK_INTERVAL
+    seconds per worker; otherwise reads fall back to the primary.
+    """
+
+    def __init__(self, max_lag=10, check_interval=5, lag_query=None):
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lag_query = lag_query
+        self.healthy = False
+        self.lag = None
+        self.checked = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            max_lag=config.get("REPLICA_MAX_LAG", 10),
+            check_interval=config.get("REPLICA_CHECK_INTERVAL", 5),
+            lag_query=config.get("REPLICA_LAG_QUERY"),
+        )
+
+    def use_replica(self, db_session, clause=None):
+        if getattr(clause, "is_dml", False):
+            reason = "write"
+        elif not has_request_context() or request.method not in SAFE_METHODS:
+            reason = "write"
+        elif g.get("wrote_primary") or db_session._flushing or not db_session._is_clean():
+            reason = "write"
+        elif session.get("primary_until", 0) > time.time():
+            reason = "recent_write"
+        elif not self.available(db_session._db.engines[REPLICA_BIND]):
+            reason = "lagging" if self.healthy is None else "unavailable"
+        else:
+            reason = None
+
+        if metrics.registry is not None:
+            metrics.registry.inc(
+                "taskmate_db_read_routes_total",
+                {"target": "primary" if reason else "replica", "reason": reason or "ok"},
+            )
+        return reason is None
+
+    def available(self, engine):
+        now = time.monotonic()
+        if self.checked is not None and now - self.checked < self.check_interval:
+            return bool(self.healthy)
+        with self._lock:
+            if self.checked is None or now - self.checked >= self.check_interval:
+                self.check(engine)
+                self.checked = time.monotonic()
+        return bool(self.healthy)
+
+    def check(self, engine):
+        """Measure the replica's lag. healthy is None while it lags too far."""
+        query = self.lag_query or LAG_QUERIES.get(engine.dialect.name, "SELECT 0")
+        try:
+            with engine.connect() as connection:
+                self.lag = float(connection.execute(text(query)).scalar() or 0)
+        except exc.SQLAlchemyError as e:
+            if self.healthy is not False:
+                current_app.logger.warning("Replica unavailable, reading the primary: %s", e)
+            self.healthy = False
+            self.lag = None
+            return
+        if self.lag > self.max_lag:
+            if self.healthy is not None:
+                current_app.logger.warning(
+                    "Replica is %.1f s behind, reading the primary.", self.lag
+                )
+            self.healthy = None
+        else:
+            self.healthy = True
+
+    def remember_write(self, response):
+        """Keep the user's reads on the primary until the replica has the write."""
+        if g.get("wrote_primary") and self.max_lag > 0:
+            session["primary_until"] = time.time() + self.max_lag
+        return response
+
+    def init_app(self, app):
+        app.after_request(self.remember_write)
+        app.extensions["replica"] = self
+
+
+def replica_init_app(app):
+    """Open the REPLICA_DATABASE_URI engine; call it after db.init_app.
+
+    The replica is not a SQLALCHEMY_BINDS entry: no model lives only there,
+    and create_all and migrations must never touch it.
+    """
+    uri = app.config.get("REPLICA_DATABASE_URI")
+    if not uri:
+        return None
+
+    from . import db
+    from .pool import engine_options
+
+    options = engine_options(dict(app.config, SQLALCHEMY_DATABASE_URI=uri))
+    with app.app_context():
+        db.engines[REPLICA_BIND] = create_engine(uri, **options)
+    router = ReplicaRouter.from_config(app.config)
+    router.init_app(app)
+    return router
@@ -0,0 +1,414 @@
+import re
+from typing import NamedTuple, Optional
+
+import click
+from flask import current_app, g
+from flask.cli import with_appcontext
+from markupsafe import Markup, escape
+from sqlalchemy import DDL, event, inspect, text
+from sqlalchemy.orm import Session
+
+from . import db
+from .models import Task, TaskComment
+
+# Matches are wrapped in private use characters by the database and turned
+# into <mark> only after the task text has been escaped.
+MATCH_START = "\ue000"
+MATCH_END = "\ue001"
+
+MAX_TERMS = 8
+SEARCH_LIMIT = 20
+
+# Tasks re-read per IN query when refreshing the index.
+REFRESH_CHUNK = 500
+
+
+class SearchResult(NamedTuple):
+    id: int
+    title: Markup
+    snippet: Markup
+    status: str
+    due_date: Optional[object]
+
+
+def highlight(value):
+    value = str(escape(value or ""))
+    return Markup(value.replace(MATCH_START, "<mark>").replace(MATCH_END, "</mark>"))
+
+
+def search_terms(query):
+    """Split a search box value into at most MAX_TERMS plain words."""
+    return re.findall(r"\w+", (query or "").lower())[:MAX_TERMS]
+
+
+class SQLiteSearch(object):
+    """FTS5 table keyed by task id.
+
+    The tenant and author are folded into one token in the scope column, so
+    the tenant filter is an index lookup intersected with the search terms
+    rather than a check on every match.
+    """
+
+    create = DDL(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS task_search USING fts5("
+        "scope, title, body, comments, tokenize='porter unicode61')"
+    )
+    drop = DDL("DROP TABLE IF EXISTS task_search")
+    rebuild_sql = (
+        "INSERT INTO task_search (rowid, scope, title, body, comments) "
+        "SELECT task.id, 't' || task.tenant_id || 'u' || coalesce(task.author_id, 0), "
+        "task.title, coalesce(task.body, ''), "
+        "coalesce((SELECT group_concat(content, char(10)) FROM task_comment "
+        "WHERE task_comment.task_id = task.id), '') FROM task{where}"
+    )
+
+    @staticmethod
+    def scope(tenant_id, author_id):
+        return f"t{tenant_id}u{author_id or 0}"
+
+    def search(self, session, terms, tenant_id, author_id, limit):
+        phrases = " ".join(f'"{term}"' for term in terms)
+        match = (
+            f"scope:{self.scope(tenant_id, author_id)} AND "
+            f"{{title body comments}}:({phrases})"
+        )
+        # Rank first and build snippets for the page only; SQLite would
+        # otherwise build one for every match before sorting.
+        ids = [
+            row[0]
+            for row in session.execute(
+                text(
+                    "SELECT rowid FROM task_search WHERE task_search MATCH :match "
+                    "ORDER BY bm25(task_search, 0.0, 10.0, 4.0, 1.0) LIMIT :limit"
+                ),
+                {"match": match, "limit": limit},
+            )
+        ]
+        if not ids:
+            return []
+
+        rows = session.execute(
+            text(
+                "SELECT rowid, highlight(task_search, 1, :start, :end), "
+                "snippet(task_search, 2, :start, :end, '…', 24), "
+                "snippet(task_search, 3, :start, :end, '…', 24) "
+                "FROM task_search WHERE task_search MATCH :match AND rowid IN ("
+                + ", ".join(str(int(id)) for id in ids)
+                + ")"
+            ),
+            {"match": match, "start": MATCH_START, "end": MATCH_END},
+        )
+        hits = {}
+        for task_id, title, body, comments in rows:
+            snippet = comments if MATCH_START in comments and MATCH_START not in body else body
+            hits[task_id] = (title, snippet)
+        return [(id, *hits[id]) for id in ids if id in hits]
+
+    def lock(self, session, tenant_id, task_ids):
+        # SQLite runs one write transaction at a time.
+        pass
+
+    def replace(self, session, task_ids, documents):
+        session.execute(
+            text(
+                "DELETE FROM task_search WHERE rowid IN ("
+                + ", ".join(str(int(id)) for id in task_ids)
+                + ")"
+            )
+        )
+        if documents:
+            session.execute(
+                text(
+                    "INSERT INTO task_search (rowid, scope, title, body, comments) "
+                    "VALUES (:id, :scope, :title, :body, :comments)"
+                ),
+                [
+                    dict(document, scope=self.scope(document["tenant_id"], document["author_id"]))
+                    for document in documents
+                ],
+            )
+
+    def clear(self, session, tenant_id):
+        """Delete tenant_id's rows; call it before deleting the tenant's tasks."""
+        session.execute(
+            text(
+                "DELETE FROM task_search WHERE rowid IN "
+                "(SELECT id FROM task WHERE tenant_id = :tenant_id)"
+            ),
+            {"tenant_id": tenant_id},
+        )
+
+    def rebuild(self, session, tenant_id=None):
+        if tenant_id is None:
+            session.execute(text("DELETE FROM task_search"))
+            session.execute(text(self.rebuild_sql.format(where="")))
+            return
+        self.clear(session, tenant_id)
+        session.execute(
+            text(self.rebuild_sql.format(where=" WHERE task.tenant_id = :tenant_id")),
+            {"tenant_id": tenant_id},
+        )
+
+
+class PostgresSearch(object):
+    """tsvector column with a GIN index, one row per task.
+
+    Title, body and comments are weighted A, B and C for ts_rank_cd.
+    """
+
+    create = DDL(
+        "CREATE TABLE IF NOT EXISTS task_search ("
+        "task_id integer PRIMARY KEY, tenant_id integer NOT NULL, author_id integer, "
+        "comments text NOT NULL DEFAULT '', document tsvector NOT NULL); "
+        "CREATE INDEX IF NOT EXISTS ix_task_search_document "
+        "ON task_search USING gin (document); "
+        "CREATE INDEX IF NOT EXISTS ix_task_search_tenant_author "
+        "ON task_search (tenant_id, author_id)"
+    )
+    drop = DDL("DROP TABLE IF EXISTS task_search")
+    document_sql = (
+        "setweight(to_tsvector('english', {title}), 'A') || "
+        "setweight(to_tsvector('english', {body}), 'B') || "
+        "setweight(to_tsvector('english', {comments}), 'C')"
+    )
+    rebuild_sql = (
+        "INSERT INTO task_search (task_id, tenant_id, author_id, comments, document) "
+        "SELECT id, tenant_id, author_id, comments, "
+        + document_sql.format(title="title", body="body", comments="comments")
+        + " FROM (SELECT task.id, task.tenant_id, task.author_id, task.title, "
+        "coalesce(task.body, '') AS body, coalesce((SELECT string_agg(content, E'\\n' "
+        "ORDER BY task_comment.id) FROM task_comment "
+        "WHERE task_comment.task_id = task.id "
+        "AND task_comment.tenant_id = task.tenant_id), '') AS comments FROM task{where}) "
+        "AS documents"
+    )
+
+    def search(self, session, terms, tenant_id, author_id, limit):
+        options = f"StartSel={MATCH_START}, StopSel={MATCH_END}"
+        rows = session.execute(
+            text(
+                "SELECT hits.task_id, "
+                "ts_headline('english', task.title, query, :title_options), "
+                "ts_headline('english', coalesce(task.body, '') || ' ' || hits.comments, "
+                "query, :snippet_options) "
+                "FROM (SELECT task_id, comments, ts_rank_cd(document, query) AS rank "
+                "FROM task_search, plainto_tsquery('english', :terms) AS query "
+                "WHERE tenant_id = :tenant_id AND author_id = :author_id "
+                "AND document @@ query ORDER BY rank DESC LIMIT :limit) AS hits "
+                "JOIN task ON task.id = hits.task_id AND task.tenant_id = :tenant_id, "
+                "plainto_tsquery('english', :terms) AS query "
+                "ORDER BY hits.rank DESC"
+            ),
+            {
+                "terms": " ".join(terms),
+                "tenant_id": tenant_id,
+                "author_id": author_id,
+                "limit": limit,
+                "title_options": options + ", HighlightAll=true",
+                "snippet_options": options
+                + ', MaxWords=24, MinWords=8, MaxFragments=2, FragmentDelimiter=" … "',
+            },
+        )
+        return [tuple(row) for row in rows]
+
+    def lock(self, session, tenant_id, task_ids):
+        """Wait for other transactions refreshing the same tasks to commit.
+
+        Under READ COMMITTED the documents, read after this, then include
+        their changes, such as a comment added at the same time.
+        """
+        session.execute(
+            text(
+                "SELECT id FROM task WHERE id = ANY(:ids) AND tenant_id = :tenant_id "
+                "ORDER BY id FOR NO KEY UPDATE"
+            ),
+            {"ids": list(task_ids), "tenant_id": tenant_id},
+        )
+
+    def replace(self, session, task_ids, documents):
+        session.execute(
+            text("DELETE FROM task_search WHERE task_id = ANY(:ids)"),
+            {"ids": list(task_ids)},
+        )
+        if documents:
+            session.execute(
+                text(
+                    "INSERT INTO task_search "
+                    "(task_id, tenant_id, author_id, comments, document) "
+                    "VALUES (:id, :tenant_id, :author_id, :comments, "
+                    + self.document_sql.format(
+                        title=":title", body=":body", comments=":comments"
+                    )
+                    + ")"
+                ),
+                documents,
+            )
+
+    def clear(self, session, tenant_id):
+        session.execute(
+            text("DELETE FROM task_search WHERE tenant_id = :tenant_id"),
+            {"tenant_id": tenant_id},
+        )
+
+    def rebuild(self, session, tenant_id=None):
+        if tenant_id is None:
+            session.execute(text("DELETE FROM task_search"))
+            session.execute(text(self.rebuild_sql.format(where="")))
+            return
+        self.clear(session, tenant_id)
+        session.execute(
+            text(self.rebuild_sql.format(where=" WHERE task.tenant_id = :tenant_id")),
+            {"tenant_id": tenant_id},
+        )
+
+
+BACKENDS = {"sqlite": SQLiteSearch(), "postgresql": PostgresSearch()}
+
+for _backend_name, _backend in BACKENDS.items():
+    event.listen(db.metadata, "after_create", _backend.create.execute_if(dialect=_backend_name))
+    event.listen(db.metadata, "before_drop", _backend.drop.execute_if(dialect=_backend_name))
+
+
+def get_backend(session=None):
+    """Return the search backend for the session's database, or None."""
+    session = session or db.session
+    return BACKENDS.get(session.get_bind().dialect.name)
+
+
+def search_tasks(user_id, query, limit=None):
+    """Return the current tenant's tasks by user_id matching query, best first."""
+    terms = search_terms(query)
+    backend = get_backend()
+    if not terms or backend is None:
+        return ()
+
+    limit = limit or current_app.config.get("SEARCH_LIMIT", SEARCH_LIMIT)
+    tenant_id = g.get("tenant_id")
+    hits = backend.search(db.session, terms, tenant_id, user_id, limit)
+    if not hits:
+        return ()
+
+    # The index can trail a bulk change, so the task itself has the last word.
+    tasks = {
+        task.id: task
+        for task in Task.query.with_entities(Task.id, Task.status, Task.due_date).filter(
+            Task.id.in_([hit[0] for hit in hits]),
+            Task.tenant_id == tenant_id,
+            Task.author_id == user_id,
+        )
+    }
+    return tuple(
+        SearchResult(
+            id, highlight(title), highlight(snippet), tasks[id].status, tasks[id].due_date
+        )
+        for id, title, snippet in hits
+        if id in tasks
+    )
+
+
+def chunks(values, size=REFRESH_CHUNK):
+    values = sorted(values)
+    for start in range(0, len(values), size):
+        yield values[start : start + size]
+
+
+def refresh_tasks(session, backend, tenant_id, task_ids):
+    """Rewrite the index rows of tenant_id's task_ids from the task and
+    comment tables."""
+    for chunk in chunks(task_ids):
+        backend.lock(session, tenant_id, chunk)
+        comments = {}
+        for task_id, content in (
+            session.query(TaskComment.task_id, TaskComment.content)
+            .filter(TaskComment.task_id.in_(chunk), TaskComment.tenant_id == tenant_id)
+            .order_by(TaskComment.task_id, TaskComment.id)
+        ):
+            comments.setdefault(task_id, []).append(content)
+
+        documents = [
+            {
+                "id": task.id,
+                "tenant_id": task.tenant_id,
+                "author_id": task.author_id,
+                "title": task.title,
+                "body": task.body or "",
+                "comments": "\n".join(comments.get(task.id, ())),
+            }
+            for task in session.query(
+                Task.id, Task.tenant_id, Task.author_id, Task.title, Task.body
+            ).filter(Task.id.in_(chunk), Task.tenant_id == tenant_id)
+        ]
+        backend.replace(session, chunk, documents)
+
+
+def mark_changed(task_ids, tenant_id, session=None):
+    """Refresh tenant_id's task_ids in the index on commit, for changes made
+    with Core statements that the session events below cannot see."""
+    session = session or db.session
+    session.info.setdefault("search_changes", {}).setdefault(tenant_id, set()).update(task_ids)
+
+
+@event.listens_for(Session, "after_flush")
+def collect_search_changes(session, flush_context):
+    # Task ids by tenant, so each refresh reads one tenant's rows.
+    changed = session.info.setdefault("search_changes", {})
+    for instance in list(session.new) + list(session.deleted):
+        if isinstance(instance, Task):
+            changed.setdefault(instance.tenant_id, set()).add(instance.id)
+        elif isinstance(instance, TaskComment):
+            changed.setdefault(instance.tenant_id, set()).add(instance.task_id)
+    for instance in session.dirty:
+        if isinstance(instance, Task):
+            state = inspect(instance)
+            if any(
+                state.attrs[name].history.has_changes()
+                for name in ("title", "body", "author_id", "tenant_id")
+            ):
+                changed.setdefault(instance.tenant_id, set()).add(instance.id)
+        elif isinstance(instance, TaskComment):
+            changed.setdefault(instance.tenant_id, set()).add(instance.task_id)
+    if not changed:
+        del session.info["search_changes"]
+
+
+@event.listens_for(Session, "before_commit")
+def refresh_search_index(session):
+    # Commit flushes after this hook, so flush first to see every change.
+    session.flush()
+    changes = session.info.pop("search_changes", None)
+    if not changes:
+        return
+    backend = get_backend(session)
+    if backend is not None:
+        for tenant_id, task_ids in changes.items():
+            refresh_tasks(session, backend, tenant_id, task_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_search_changes(session):
+    session.info.pop("search_changes", None)
+
+
+def rebuild_index(tenant_id=None, commit=True):
+    """Rebuild the index for every task, or only tenant_id's tasks."""
+    backend = get_backend()
+    if backend is None:
+        return False
+    backend.rebuild(db.session, tenant_id)
+    if commit:
+        db.session.commit()
+    return True
+
+
+@click.command("search-reindex")
+@click.option("--shard", default=None, help="Rebuild on this SHARD_DATABASE_URIS entry.")
+@with_appcontext
+def search_reindex_command(shard):
+    """Rebuild the task search index from the task and comment tables."""
+    from .shards import shard_option_key, use_database
+
+    with use_database(shard_option_key(shard)):
+        if rebuild_index():
+            click.echo(f"Indexed {Task.query.count()} tasks.")
+        else:
+            click.echo(f"Search is not supported on {db.session.get_bind().dialect.name}.")
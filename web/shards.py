@@ -0,0 +1,430 @@
+import json
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import click
+from flask import current_app, g, request
+from flask.cli import with_appcontext
+from sqlalchemy import create_engine, delete, event, exists, func, select, update
+from werkzeug.exceptions import ServiceUnavailable
+
+from . import db
+from .backup import begin_snapshot, dump_tenant, find_tenant, read_header, restore_tenant, tenant_stats
+from .cache import cache
+from .models import MailOutbox, Task, TaskComment, Tenant, User
+from .pool import engine_options
+from .reminders import record_tenant_changes
+from .replica import SAFE_METHODS, RoutingSession
+from .search import get_backend
+
+# Shards are in db.engines under their SHARD_DATABASE_URIS name with this
+# prefix, so they cannot clash with SQLALCHEMY_BINDS keys.
+SHARD_PREFIX = "shard:"
+
+# Tenant and user columns a shard request may change, copied back to the
+# directory on commit.
+MIRRORED_COLUMNS = {Tenant: ("name", "timezone"), User: ("username", "password")}
+
+
+def shard_bind(name):
+    """Return the db.engines key of the shard called name, or None for None."""
+    return None if name is None else SHARD_PREFIX + name
+
+
+def parse_shards(value):
+    """Parse SHARD_DATABASE_URIS given as "name=uri,name=uri"."""
+    shards = {}
+    for entry in filter(None, (entry.strip() for entry in (value or "").split(","))):
+        name, _, uri = entry.partition("=")
+        shards[name.strip()] = uri.strip()
+    return shards
+
+
+@contextmanager
+def use_database(key):
+    """Run the block's queries on the database at key in db.engines.
+
+    The session is removed on the way in and out, so commit first.
+    """
+    previous = g.get("shard")
+    db.session.remove()
+    g.shard = key
+    try:
+        yield
+    finally:
+        db.session.remove()
+        g.shard = previous
+
+
+class ShardRouter(object):
+    """Routes each request to the database holding its tenant.
+
+    The default database is the directory. It holds every tenant and user,
+    for logging in, and records the shard each tenant lives on. A shard has
+    the full schema, holding its tenants' tasks and comments and copies of
+    their tenant and user rows, so its queries never leave it. Tenants
+    without a shard stay in the directory, as before sharding.
+    """
+
+    def __init__(self, names=()):
+        self.names = tuple(sorted(names))
+        self.move_wait = 5
+        self._placements = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.move_wait = app.config.get("SHARD_MOVE_WAIT", 5)
+        app.extensions["shards"] = self
+
+    def databases(self):
+        """Return the db.engines keys of the directory and every shard."""
+        return [None] + [shard_bind(name) for name in self.names]
+
+    def bucket(self, tenant_id):
+        """Return the shard a new tenant is placed on."""
+        return self.names[tenant_id % len(self.names)]
+
+    def lookup(self, tenant_id):
+        """Return the tenant's (shard, moving_to) from the directory, or None.
+
+        Placements are cached for SHARD_MOVE_WAIT seconds, which is how long
+        a move waits for every worker to see each of its steps.
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._placements.get(tenant_id)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+
+        # Deferred, so a POST does not take the directory's write lock on SQLite.
+        with db.engine.connect() as connection:
+            connection = connection.execution_options(sqlite_begin="DEFERRED")
+            placement = connection.execute(
+                select(Tenant.shard, Tenant.moving_to).where(Tenant.id == tenant_id)
+            ).first()
+        if self.move_wait > 0:
+            with self._lock:
+                self._placements[tenant_id] = (placement, now + self.move_wait)
+        return placement
+
+    def forget(self, tenant_id):
+        with self._lock:
+            self._placements.pop(tenant_id, None)
+
+    def route(self, tenant_id):
+        """Return the db.engines key for the tenant's request.
+
+        Writes are refused while the tenant is being moved; reads carry on
+        from the database it is moving from.
+        """
+        if tenant_id is None:
+            return None
+        placement = self.lookup(tenant_id)
+        if placement is None or placement.shard is None:
+            shard = None
+        elif placement.shard in self.names:
+            shard = placement.shard
+        else:
+            current_app.logger.error(
+                "Tenant %s is on shard %s, which is not configured.", tenant_id, placement.shard
+            )
+            raise ServiceUnavailable(retry_after=60)
+
+        if placement is not None and placement.moving_to and request.method not in SAFE_METHODS:
+            raise ServiceUnavailable(
+                "Your tasks are being moved; try again in a minute.", retry_after=60
+            )
+        return shard_bind(shard)
+
+
+def shards_init_app(app):
+    """Open an engine per SHARD_DATABASE_URIS entry; call it after db.init_app."""
+    uris = app.config.get("SHARD_DATABASE_URIS")
+    if not uris:
+        return None
+
+    with app.app_context():
+        for name, uri in uris.items():
+            options = engine_options(dict(app.config, SQLALCHEMY_DATABASE_URI=uri))
+            db.engines[shard_bind(name)] = create_engine(uri, **options)
+    router = ShardRouter(uris)
+    router.init_app(app)
+    return router
+
+
+def run_on_every_database(function, *args, **kwargs):
+    """Call function on the directory and on every shard; return the sum."""
+    router = current_app.extensions.get("shards")
+    if router is None:
+        return function(*args, **kwargs)
+
+    total = 0
+    for key in router.databases():
+        with use_database(key):
+            total += function(*args, **kwargs)
+    return total
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def collect_directory_changes(session, flush_context):
+    if not (g and g.get("shard")):
+        return
+    changes = session.info.setdefault("directory_changes", {})
+    for instance in session.dirty:
+        columns = MIRRORED_COLUMNS.get(type(instance))
+        if columns:
+            changes[(type(instance), instance.id)] = {
+                column: getattr(instance, column) for column in columns
+            }
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def mirror_directory_changes(session):
+    changes = session.info.pop("directory_changes", None)
+    if not changes:
+        return
+    with db.engine.begin() as connection:
+        for (model, id), values in changes.items():
+            connection.execute(update(model).where(model.id == id).values(**values))
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def discard_directory_changes(session):
+    session.info.pop("directory_changes", None)
+
+
+def place_tenant(tenant_id):
+    """Copy a new tenant and its users to its shard, then record it there.
+
+    Call it with the tenant committed to the directory.
+    """
+    router = current_app.extensions.get("shards")
+    if router is None:
+        return None
+
+    name = router.bucket(tenant_id)
+    tenant = db.session.get(Tenant, tenant_id)
+    copies = [Tenant(id=tenant.id, name=tenant.name, timezone=tenant.timezone)] + [
+        User(id=user.id, tenant_id=tenant.id, username=user.username, password=user.password)
+        for user in User.query.filter_by(tenant_id=tenant_id)
+    ]
+    with use_database(shard_bind(name)):
+        db.session.add_all(copies)
+        db.session.commit()
+
+    db.session.execute(update(Tenant).where(Tenant.id == tenant_id).values(shard=name))
+    db.session.commit()
+    current_app.logger.info("Placed tenant %s on shard %s.", tenant_id, name)
+    return name
+
+
+def clear_tenant(tenant_id, identity):
+    """Delete the tenant's tasks and comments from the session's database,
+    and its users and tenant row too if identity is true.
+
+    The tenant row stays while outbox mail still refers to it.
+    """
+    backend = get_backend()
+    if backend is not None:
+        backend.clear(db.session, tenant_id)
+    record_tenant_changes(tenant_id)
+    models = (TaskComment, Task, User) if identity else (TaskComment, Task)
+    for model in models:
+        db.session.execute(
+            delete(model)
+            .where(model.tenant_id == tenant_id)
+            .execution_options(synchronize_session=False)
+        )
+    if identity:
+        db.session.execute(
+            delete(Tenant)
+            .where(Tenant.id == tenant_id, ~exists().where(MailOutbox.tenant_id == tenant_id))
+            .execution_options(synchronize_session=False)
+        )
+
+
+def move_tenant(tenant_id, target, progress=None):
+    """Move the tenant's users, tasks and comments to the shard target.
+
+    Writes are refused from the start, and once every worker has seen
+    that, SHARD_MOVE_WAIT seconds later, the rows are copied with the tenant
+    dump format. Reads continue from the old database until every worker
+    has seen the directory switch over, when the old rows are deleted.
+    Tenant and user ids stay the same; task and comment ids are renumbered
+    past the target's, as in tenant-restore. Returns the number of rows
+    moved.
+    """
+    router = current_app.extensions["shards"]
+    if target not in router.names:
+        raise click.ClickException(f"No shard {target}.")
+
+    tenant = db.session.get(Tenant, tenant_id)
+    source = tenant.shard
+    if source == target:
+        return 0
+    tenant.moving_to = target
+    db.session.commit()
+    router.forget(tenant_id)
+    time.sleep(router.move_wait)
+
+    try:
+        with tempfile.TemporaryFile("w+", encoding="utf-8") as file:
+            with use_database(shard_bind(source)):
+                begin_snapshot()
+                stats = tenant_stats(tenant_id)
+                dump_tenant(db.session.get(Tenant, tenant_id), stats, file, progress)
+                db.session.rollback()
+
+            file.seek(0)
+            lines = map(json.loads, file)
+            header = read_header(lines)
+            with use_database(shard_bind(target)):
+                # Left behind by an interrupted move.
+                clear_tenant(tenant_id, identity=True)
+                copy = db.session.merge(
+                    Tenant(id=tenant_id, name=header["tenant"]["name"], timezone=header["tenant"]["timezone"])
+                )
+                restore_tenant(header, lines, tenant=copy, keep_ids=("user",))
+                db.session.commit()
+    except Exception:
+        db.session.rollback()
+        db.session.execute(update(Tenant).where(Tenant.id == tenant_id).values(moving_to=None))
+        db.session.commit()
+        router.forget(tenant_id)
+        raise
+
+    db.session.execute(
+        update(Tenant).where(Tenant.id == tenant_id).values(shard=target, moving_to=None)
+    )
+    db.session.commit()
+    router.forget(tenant_id)
+    cache.bump_version(tenant_id)
+    time.sleep(router.move_wait)
+
+    with use_database(shard_bind(source)):
+        clear_tenant(tenant_id, identity=source is not None)
+        db.session.commit()
+
+    current_app.logger.info(
+        "Moved tenant %s from %s to shard %s, %s rows.",
+        tenant_id,
+        source or "the directory",
+        target,
+        header["rows"],
+    )
+    return header["rows"]
+
+
+def tenant_sizes(router):
+    """Return {tenant id: (shard, rows)}, counting tasks and comments."""
+    tenants = {
+        id: [shard, 0] for id, shard in db.session.execute(select(Tenant.id, Tenant.shard))
+    }
+    for key in router.databases():
+        with use_database(key):
+            for model in (Task, TaskComment):
+                for tenant_id, rows in db.session.execute(
+                    select(model.tenant_id, func.count()).group_by(model.tenant_id)
+                ):
+                    # Rows of tenants placed elsewhere are left from a failed move.
+                    if tenant_id in tenants and shard_bind(tenants[tenant_id][0]) == key:
+                        tenants[tenant_id][1] += rows
+    return {id: tuple(value) for id, value in tenants.items()}
+
+
+def plan_moves(tenants, names):
+    """Return {tenant id: shard} moves that even out rows across the shards.
+
+    tenants maps tenant ids to (shard, rows). Tenants still in the directory
+    are placed first, largest first, on the lightest shard. Then, while it
+    narrows the gap between the heaviest and lightest shard, the tenant on
+    the heaviest whose size is nearest half the gap moves to the lightest.
+    """
+    loads = dict.fromkeys(sorted(names), 0)
+    placed = {}
+    for tenant_id, (shard, rows) in sorted(tenants.items(), key=lambda item: -item[1][1]):
+        if shard not in loads:
+            shard = min(loads, key=loads.get)
+        placed[tenant_id] = shard
+        loads[shard] += rows
+
+    while True:
+        heavy = max(loads, key=loads.get)
+        light = min(loads, key=loads.get)
+        gap = loads[heavy] - loads[light]
+        candidates = [
+            tenant_id
+            for tenant_id, shard in placed.items()
+            if shard == heavy and 0 < tenants[tenant_id][1] < gap
+        ]
+        if not candidates:
+            break
+        tenant_id = min(candidates, key=lambda id: (abs(gap - 2 * tenants[id][1]), id))
+        placed[tenant_id] = light
+        loads[heavy] -= tenants[tenant_id][1]
+        loads[light] += tenants[tenant_id][1]
+
+    return {
+        tenant_id: shard
+        for tenant_id, shard in placed.items()
+        if shard != tenants[tenant_id][0]
+    }
+
+
+def get_router():
+    router = current_app.extensions.get("shards")
+    if router is None:
+        raise click.ClickException("Set SHARD_DATABASE_URIS to use shards.")
+    return router
+
+
+def shard_option_key(name):
+    """Return the db.engines key for a --shard option, None being the directory."""
+    if name is not None and name not in get_router().names:
+        raise click.ClickException(f"No shard {name}.")
+    return shard_bind(name)
+
+
+@click.command("shard-move")
+@click.argument("tenant")
+@click.argument("shard")
+@with_appcontext
+def shard_move_command(tenant, shard):
+    """Move TENANT (a name or id) to SHARD."""
+    get_router()
+    start = time.perf_counter()
+    tenant = find_tenant(tenant)
+    rows = move_tenant(tenant.id, shard)
+    click.echo(f"Moved {rows} rows to {shard} in {time.perf_counter() - start:.1f} s.")
+
+
+@click.command("shard-rebalance")
+@click.option("--dry-run", is_flag=True, help="Print the moves without making them.")
+@with_appcontext
+def shard_rebalance_command(dry_run):
+    """Move tenants between shards until their rows are evenly spread.
+
+    Tenants still in the directory database are placed on shards too.
+    """
+    router = get_router()
+    tenants = tenant_sizes(router)
+    moves = plan_moves(tenants, router.names)
+    for tenant_id, target in sorted(moves.items()):
+        shard, rows = tenants[tenant_id]
+        click.echo(f"Tenant {tenant_id}: {rows} rows, {shard or 'directory'} -> {target}")
+        if not dry_run:
+            move_tenant(tenant_id, target)
+    click.echo(f"{'Planned' if dry_run else 'Made'} {len(moves)} moves.")
+
+
+@click.command("shard-upgrade")
+@with_appcontext
+def shard_upgrade_command():
+    """Upgrade every shard's schema to the latest migration."""
+    from flask_migrate import upgrade
+
+    for name in get_router().names:
+        click.echo(f"Upgrading shard {name}.")
+        upgrade(x_arg=[f"shard={name}"])
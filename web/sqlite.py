@@ -0,0 +1,92 @@
+from flask import has_request_context, request
+from sqlalchemy import event
+
+from . import db
+from .replica import SAFE_METHODS
+
+
+class SQLiteProfile(object):
+    """Connection settings for running on SQLite with several workers.
+
+    Every connection uses WAL, so readers never wait for the writer, and a
+    busy timeout, so writers queue for the lock instead of failing. Write
+    transactions start with BEGIN IMMEDIATE, which takes the write lock
+    before their first read: a deferred transaction that reads and then
+    writes fails with "database is locked" whenever another worker
+    committed in between, however long the busy timeout.
+
+    A transaction writes if it belongs to a request with an unsafe method,
+    or to a command or background job. Pass the ``sqlite_begin`` execution
+    option ("DEFERRED", "IMMEDIATE" or "EXCLUSIVE") to choose explicitly.
+    """
+
+    def __init__(
+        self,
+        journal_mode="WAL",
+        synchronous="NORMAL",
+        busy_timeout=5000,
+        mmap_size=256 * 2**20,
+        cache_size=-64 * 1024,
+        immediate_writes=True,
+    ):
+        self.pragmas = (
+            ("journal_mode", journal_mode),
+            ("synchronous", synchronous),
+            ("busy_timeout", busy_timeout),
+            ("mmap_size", mmap_size),
+            ("cache_size", cache_size),
+        )
+        self.immediate_writes = immediate_writes
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            journal_mode=config.get("SQLITE_JOURNAL_MODE", "WAL"),
+            synchronous=config.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+            busy_timeout=config.get("SQLITE_BUSY_TIMEOUT", 5000),
+            mmap_size=config.get("SQLITE_MMAP_SIZE", 256 * 2**20),
+            cache_size=config.get("SQLITE_CACHE_SIZE", -64 * 1024),
+            immediate_writes=config.get("SQLITE_IMMEDIATE_WRITES", True),
+        )
+
+    def attach(self, engine):
+        event.listen(engine, "connect", self.connect)
+        event.listen(engine, "begin", self.begin)
+
+    def connect(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in self.pragmas:
+                cursor.execute(f"PRAGMA {name} = {value}")
+        finally:
+            cursor.close()
+
+    def begin_mode(self, connection):
+        mode = connection.get_execution_options().get("sqlite_begin")
+        if mode is not None:
+            return mode
+        if not self.immediate_writes:
+            return "DEFERRED"
+        if has_request_context() and request.method in SAFE_METHODS:
+            return "DEFERRED"
+        return "IMMEDIATE"
+
+    def begin(self, connection):
+        # pysqlite only begins implicitly outside a transaction, so it leaves
+        # this one alone and still commits and rolls it back.
+        connection.exec_driver_sql(f"BEGIN {self.begin_mode(connection)}")
+
+
+def sqlite_init_app(app):
+    """Apply the SQLite profile to the app's SQLite engines, the replica's
+    included, unless SQLITE_PROFILE is off."""
+    with app.app_context():
+        engines = [e for e in db.engines.values() if e.dialect.name == "sqlite"]
+    if not engines or not app.config.get("SQLITE_PROFILE", True):
+        return None
+
+    profile = SQLiteProfile.from_config(app.config)
+    for engine in engines:
+        profile.attach(engine)
+    app.extensions["sqlite_profile"] = profile
+    return profile
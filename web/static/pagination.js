@@ -0,0 +1,63 @@
+function renderTaskItem(task) {
+  var item = document.createElement("li");
+  item.className = "list-group-item";
+
+  var badge = document.createElement("a");
+  badge.className = "badge mt-0 text-light";
+  if (task.due_date) {
+    badge.classList.add(task.status === "OVERDUE" ? "bg-danger" : "bg-success");
+    badge.textContent = task.due_date;
+  } else {
+    badge.classList.add("bg-info");
+    badge.textContent = "No due date.";
+  }
+  item.appendChild(badge);
+
+  if (task.comment_count) {
+    var comments = document.createElement("a");
+    comments.className = "badge mt-0 bg-secondary text-light";
+    comments.textContent = task.comment_count + " comments";
+    item.appendChild(document.createTextNode(" "));
+    item.appendChild(comments);
+  }
+  item.appendChild(document.createElement("br"));
+
+  var form = document.createElement("form");
+  form.id = "task-form-" + task.id;
+  form.action = task.view_url;
+  form.method = "post";
+
+  var title = document.createElement("div");
+  title.className = "btn btn-link btn-lg word-wrap";
+  title.textContent = task.title;
+  title.onclick = function () {
+    form.submit();
+  };
+
+  item.appendChild(title);
+  item.appendChild(form);
+  return item;
+}
+
+function loadMoreTasks(button) {
+  var url = button.dataset.url + "&cursor=" + encodeURIComponent(button.dataset.cursor);
+  button.disabled = true;
+
+  fetch(url, { credentials: "same-origin" })
+    .then(function (response) {
+      return response.json();
+    })
+    .then(function (page) {
+      var list = document.getElementById("task-list");
+      page.tasks.forEach(function (task) {
+        list.appendChild(renderTaskItem(task));
+      });
+
+      if (page.next_cursor) {
+        button.dataset.cursor = page.next_cursor;
+        button.disabled = false;
+      } else {
+        button.remove();
+      }
+    });
+}
@@ -0,0 +1,104 @@
+from datetime import datetime, time, timedelta
+
+import click
+import pytz
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, update
+
+from . import db
+from .cache import cache
+from .models import SweepWatermark, Task, Tenant
+
+# Tasks created or edited with a due date in the past are flagged OVERDUE by
+# the write path using the server's date, which can trail the tenant's local
+# date by up to a day. Re-checking a short window behind the watermark keeps
+# those tasks from slipping through.
+SWEEP_GRACE = timedelta(days=2)
+
+
+def get_due_cutoff(timezone_name, now=None):
+    """Return the naive due_date before which a task is overdue in timezone_name."""
+    if now is None:
+        now = datetime.now(pytz.utc)
+
+    try:
+        tz = pytz.timezone(timezone_name)
+    except pytz.UnknownTimeZoneError:
+        current_app.logger.warning(
+            "Unknown timezone %s, sweeping with UTC.", timezone_name
+        )
+        tz = pytz.utc
+
+    local_today = now.astimezone(tz).date()
+    return datetime.combine(local_today + timedelta(days=1), time.min)
+
+
+def sweep_overdue_tasks(now=None):
+    """Set ACTIVE tasks whose due date has passed to OVERDUE.
+
+    Issues one UPDATE per distinct tenant timezone and only considers tasks
+    whose due date crossed into the past since the previous sweep.
+    """
+    swept = 0
+    changed_tenants = set()
+    timezones = [row[0] for row in db.session.query(Tenant.timezone).distinct()]
+
+    for timezone_name in timezones:
+        cutoff = get_due_cutoff(timezone_name, now)
+        watermark = db.session.get(SweepWatermark, timezone_name)
+
+        query = (
+            update(Task)
+            .where(
+                Task.tenant_id.in_(
+                    select(Tenant.id).where(Tenant.timezone == timezone_name)
+                ),
+                Task.status == "ACTIVE",
+                Task.due_date < cutoff,
+            )
+            .values(status="OVERDUE")
+            .execution_options(synchronize_session=False)
+        )
+
+        if watermark is None:
+            watermark = SweepWatermark(timezone=timezone_name, watermark=cutoff)
+            db.session.add(watermark)
+        else:
+            query = query.where(Task.due_date >= watermark.watermark - SWEEP_GRACE)
+            watermark.watermark = max(watermark.watermark, cutoff)
+
+        result = db.session.execute(query)
+        swept += result.rowcount
+
+        if result.rowcount:
+            changed_tenants.update(
+                tenant_id
+                for (tenant_id,) in db.session.query(Tenant.id).filter(
+                    Tenant.timezone == timezone_name
+                )
+            )
+
+        current_app.logger.info(
+            "Overdue sweep set %s tasks to OVERDUE for timezone %s (cutoff %s).",
+            result.rowcount,
+            timezone_name,
+            cutoff,
+        )
+
+    db.session.commit()
+    # Only after the commit, or a page read in between would be cached
+    # under the new version with the old statuses.
+    for tenant_id in changed_tenants:
+        cache.bump_version(tenant_id)
+    return swept
+
+
+@click.command("sweep-overdue")
+@with_appcontext
+def sweep_overdue_command():
+    """Set tasks past their due date to OVERDUE."""
+    from .shards import run_on_every_database
+
+    swept = run_on_every_database(sweep_overdue_tasks)
+    click.echo(f"Set {swept} tasks to OVERDUE.")
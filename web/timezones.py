@@ -1,35 +1,94 @@
-from flask import current_app
-import pytz
+import functools
+from bisect import bisect_right
 from datetime import datetime
 
-def get_timezones():
-    return {
-        "Africa/Lagos": "+01:00",
-        "Africa/Johannesburg": "+02:00",
-        "Africa/Nairobi": "+03:00",
-        "America/Buenos_Aires": "-03:00",
-        "America/Chicago": "-05:00",
-        "America/Los_Angeles": "-08:00",
-        "America/New_York": "-04:00",
-        "America/Santiago": "-04:00",
-        "America/Sao_Paulo": "-03:00",
-        "Asia/Dubai": "+04:00",
-        "Asia/Perth": "+08:00",
-        "Asia/Shanghai": "+08:00",
-        "Asia/Tokyo": "+09:00",
-        "Australia/Brisbane": "+10:00",
-        "Australia/Melbourne": "+10:00",
-        "Australia/Perth": "+08:00",
-        "Australia/Sydney": "+10:00",
-        "Europe/Berlin": "+02:00",
-        "Europe/London": "+01:00",
-        "Europe/Paris": "+02:00"
-    }
-
-def get_gmt(timezone_name):
-    timezones = get_timezones()
-    for key, value in timezones.items():
-        current_app.logger.info("Key is %s, timezone name is %s", key, timezone_name)
-        if timezone_name in key:
-            return key
-    return None
\ No newline at end of file
+import pytz
+
+
+class TimezoneRegistry(object):
+    """Every IANA zone known to pytz, built once when the module is imported.
+
+    Names are validated and canonicalised with a dict lookup. Current UTC
+    offsets are cached per zone until that zone's next DST transition, so
+    listing every zone on a form does not recompute them on each request.
+    """
+
+    def __init__(self, names, choices):
+        self.names = frozenset(names)
+        self._canonical = {name.lower(): name for name in names}
+        self._choices = tuple(sorted(choices))
+        # name -> (offset, naive UTC start and end of the offset's validity)
+        self._offsets = {}
+
+    def __contains__(self, name):
+        return self.canonical(name) is not None
+
+    def __len__(self):
+        return len(self.names)
+
+    def canonical(self, name):
+        """Return the registered spelling of name, or None if it is unknown."""
+        if not name:
+            return None
+        return self._canonical.get(name.strip().lower())
+
+    def utcoffset(self, name, now=None):
+        """Return the current UTC offset of name as a timedelta."""
+        if now is None:
+            now = datetime.now(pytz.utc).replace(tzinfo=None)
+
+        cached = self._offsets.get(name)
+        if cached is not None:
+            offset, starts, ends = cached
+            if (starts is None or starts <= now) and (ends is None or now < ends):
+                return offset
+
+        zone = get_zone(name)
+        offset = pytz.utc.localize(now).astimezone(zone).utcoffset()
+        self._offsets[name] = (offset, *transition_window(zone, now))
+        return offset
+
+    def label(self, name, now=None):
+        offset = self.utcoffset(name, now)
+        minutes = int(offset.total_seconds()) // 60
+        sign = "-" if minutes < 0 else "+"
+        hours, minutes = divmod(abs(minutes), 60)
+        return f"{name} (UTC{sign}{hours:02d}:{minutes:02d})"
+
+    def choices(self, now=None):
+        """Return (name, label) pairs for a timezone select box."""
+        return [(name, self.label(name, now)) for name in self._choices]
+
+
+def transition_window(zone, now):
+    """Return the naive UTC times of zone's offset changes either side of now.
+
+    Either end is None when there is no change in that direction.
+    """
+    transitions = getattr(zone, "_utc_transition_times", None)
+    if not transitions:
+        return None, None
+
+    index = bisect_right(transitions, now)
+    starts = transitions[index - 1] if index else None
+    ends = transitions[index] if index < len(transitions) else None
+    return starts, ends
+
+
+@functools.lru_cache(maxsize=None)
+def get_zone(timezone_name):
+    """Return the pytz zone for timezone_name, or UTC if it is unknown.
+
+    Building a zone reads and parses its tzfile, so each zone is built once
+    per process.
+    """
+    if not timezone_name:
+        return pytz.utc
+    try:
+        return pytz.timezone(timezone_name)
+    except pytz.UnknownTimeZoneError:
+        return pytz.utc
+
+
+# Deprecated aliases such as Asia/Calcutta are accepted but not offered.
+timezones = TimezoneRegistry(pytz.all_timezones, pytz.common_timezones)